@@ -55,7 +55,9 @@ class QueryConsumer(AsyncWebsocketConsumer):
             level = validated_data.get("level")
             message = validated_data.get("message") or ""
 
-            messages = await database_sync_to_async(buddy._get_messages)(level, nodes, message)
+            messages, _ = await database_sync_to_async(buddy.get_query_messages)(
+                level, nodes, message
+            )
 
             try:
                 response = await llms.utils.get_async_openai_client().chat.completions.create(
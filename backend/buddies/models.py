@@ -1,18 +1,30 @@
 import logging
+import re
 import typing
 
 from django.db import models
 from openai.types.chat import ChatCompletionMessageParam
 
+import llms.models
 import llms.utils
 import utils.tokens
+from nodes import models as nodes_models
 from utils import models as utils_models
 
 if typing.TYPE_CHECKING:
-    from nodes import models as nodes_models
+    import uuid
 
 logger = logging.getLogger(__name__)
 
+# The context of the nodes is put between these in the system prompt.
+CONTEXT_PREFIX = "\nCurrent text editor state:\n```\n"
+CONTEXT_SUFFIX = "\n```"
+# The start of a node in the context, behind the blank lines in front of it.
+NODE_START = re.compile(r"(?<=\n)(?=\()")
+# Texts that are counted on their own are budgeted with this many extra tokens, since the tokens at
+# their boundaries can be encoded differently in the whole prompt.
+CONTEXT_TOKEN_MARGIN = 2
+
 
 class Buddy(utils_models.SoftDeletableBaseModel):
     """A buddy is a template used to query an LLM model."""
@@ -29,13 +41,13 @@ class Buddy(utils_models.SoftDeletableBaseModel):
     )
 
     def query_model(
-        self, nodes: list["nodes_models.Node"], level: int, query: str
+        self, messages: list[ChatCompletionMessageParam]
     ) -> typing.Generator[str | None, None, None]:
-        """Query the buddy."""
+        """Query the buddy with the messages of `get_query_messages`."""
 
         response = llms.llm.get_openai_client().chat.completions.create(
             model=self.model,
-            messages=self._get_messages(level, nodes, query),
+            messages=messages,
             stream=True,
             timeout=180,
         )
@@ -62,7 +74,12 @@ class Buddy(utils_models.SoftDeletableBaseModel):
     def calculate_token_counts(
         self, nodes: list["nodes_models.Node"], max_depth: int, query: str
     ) -> dict[int, int]:
-        """Calculate the token counts for each level."""
+        """
+        Calculate the token counts for each level.
+        The prompts of all levels are made of the same node strings, so every node is rendered
+        once for each way it is included and the prompts are counted in parts, see `_count_parts`.
+        Parts that repeat between levels are only encoded once.
+        """
         nodes_at_depth = [node.fetch_subnodes((max_depth // 2) + 1) for node in nodes]
         max_depth_achieved = max(
             min(
@@ -72,41 +89,213 @@ class Buddy(utils_models.SoftDeletableBaseModel):
             ),
             0,
         )
+        depths = range(max_depth_achieved + 1)
+        # The nodes of the context of each node for each level.
+        context_nodes = [
+            [
+                node.context_nodes_for_depth(depth, nodes_at_depth_node)
+                for node, nodes_at_depth_node in zip(nodes, nodes_at_depth, strict=True)
+            ]
+            for depth in depths
+        ]
+
+        # The connections of all levels are fetched up front instead of per level.
+        subnode_ids: "dict[int, list[uuid.UUID]]" = {}
+        if max_depth_achieved > 1:
+            subnode_ids = nodes_models.Node.get_subnode_public_ids(
+                {
+                    node.pk
+                    for level_contexts in context_nodes
+                    for context in level_contexts
+                    for node, _, include_connections in context
+                    if include_connections
+                }
+            )
 
-        token_counts: dict[int, int] = {}
-        for depth in range(max_depth_achieved + 1):
-            token_counts[depth] = utils.tokens.num_tokens_from_messages(
-                self._get_messages(depth, nodes, query, nodes_at_depth), self.model
+        node_strings: dict[tuple[int, bool, bool], str] = {}
+        for level_contexts in context_nodes:
+            for context in level_contexts:
+                for node, include_content, include_connections in context:
+                    key = (node.pk, include_content, include_connections)
+                    if key not in node_strings:
+                        node_strings[key] = node.node_as_str(
+                            include_content=include_content,
+                            include_connections=include_connections,
+                            subnode_ids=subnode_ids.get(node.pk, []),
+                        )
+
+        system_prompts = [
+            self._get_system_prompt(
+                [
+                    "".join(
+                        node_strings[(node.pk, include_content, include_connections)] + "\n"
+                        for node, include_content, include_connections in context
+                    )
+                    for context in level_contexts
+                ]
             )
+            for level_contexts in context_nodes
+        ]
+        return dict(zip(depths, self._count_messages(system_prompts, query), strict=True))
+
+    def get_input_token_limit(self) -> int | None:
+        """Return the input token limit of the LLM of the buddy, if it is known."""
+        return (
+            llms.models.LLModel.objects.filter(identifier=self.model)
+            .values_list("input_token_limit", flat=True)
+            .first()
+        )
+
+    def get_query_messages(
+        self, level: int, nodes: list["nodes_models.Node"], query: str
+    ) -> tuple[list[ChatCompletionMessageParam], list["nodes_models.Node"]]:
+        """
+        Return the messages to query the buddy with and the nodes that were left out of the context
+        to stay within the input token limit of the LLM.
+        The cached contexts of the nodes are used if they fit, otherwise the context is assembled
+        from the nodes closest to the given nodes, see `_pack_context`. The contexts and nodes are
+        counted on their own with counts cached by text, see `utils.tokens.count_with_encoding`,
+        and each of them is budgeted with `CONTEXT_TOKEN_MARGIN` extra tokens.
+        """
+        node_context = [node.get_cached_context(level) for node in nodes]
+        dropped_nodes: list[nodes_models.Node] = []
+        if (limit := self.get_input_token_limit()) is not None:
+            budget = limit - self._count_messages_without_context(query)
+            context_counts = utils.tokens.count_with_encoding(
+                utils.tokens.get_encoding_or_default(self.model), node_context
+            )
+            if sum(count + CONTEXT_TOKEN_MARGIN for count in context_counts) > budget:
+                node_context, dropped_nodes = self._pack_context(level, nodes, budget)
+                logger.info(
+                    f"Left {len(dropped_nodes)} nodes out of the context of buddy {self.public_id} "
+                    f"to stay within the input token limit of {limit} tokens."
+                )
+
+        system_prompt = self._get_system_prompt(node_context)
+        return self._get_messages_with_system_prompt(system_prompt, query), dropped_nodes
+
+    def _count_messages_without_context(self, query: str) -> int:
+        """Return the token count of the messages with an empty context."""
+        return (
+            utils.tokens.num_tokens_from_messages(
+                self._get_messages_with_system_prompt(self._get_system_prompt([]), query),
+                self.model,
+            )
+            + CONTEXT_TOKEN_MARGIN
+        )
 
-        return token_counts
-
-    def _get_messages(
-        self,
-        level: int,
-        nodes: list["nodes_models.Node"],
-        query: str,
-        nodes_at_depth: list[dict[int, list["nodes_models.Node"]]] | None | list[None] = None,
-    ) -> typing.Iterable[ChatCompletionMessageParam]:
-        node_context: list[str] = []
-        if nodes_at_depth is None:
-            nodes_at_depth = [None] * len(nodes)
-
-        for node, nodes_at_depth_node in zip(nodes, nodes_at_depth, strict=True):
-            node_context.append(node.node_context_for_depth(level, nodes_at_depth_node))
-
-        system_prompt = str(
-            self.system_message
-            + "\nCurrent text editor state:\n```\n"
-            + "\n".join(node_context)
-            + "\n```",
+    def _pack_context(
+        self, level: int, nodes: list["nodes_models.Node"], budget: int
+    ) -> tuple[list[str], list["nodes_models.Node"]]:
+        """
+        Return the contexts of the given nodes with the nodes that fit into `budget` tokens and the
+        nodes that were left out.
+        The nodes are ranked by their distance to the given node whose context they are part of and
+        added in that order if they fit, each with `CONTEXT_TOKEN_MARGIN` extra tokens.
+        """
+        nodes_at_depth = [node.fetch_subnodes((level // 2) + 1) for node in nodes]
+        context_nodes = [
+            node.context_nodes_for_depth(level, nodes_at_depth_node)
+            for node, nodes_at_depth_node in zip(nodes, nodes_at_depth, strict=True)
+        ]
+        subnode_ids: "dict[int, list[uuid.UUID]]" = {}
+        if level > 1:
+            subnode_ids = nodes_models.Node.get_subnode_public_ids(
+                {
+                    node.pk
+                    for context in context_nodes
+                    for node, _, include_connections in context
+                    if include_connections
+                }
+            )
+        node_strings = {
+            (index, position): node.node_as_str(
+                include_content=include_content,
+                include_connections=include_connections,
+                subnode_ids=subnode_ids.get(node.pk, []),
+            )
+            + "\n"
+            for index, context in enumerate(context_nodes)
+            for position, (node, include_content, include_connections) in enumerate(context)
+        }
+        node_counts = dict(
+            zip(
+                node_strings,
+                utils.tokens.count_with_encoding(
+                    utils.tokens.get_encoding_or_default(self.model), list(node_strings.values())
+                ),
+                strict=True,
+            )
         )
 
+        # The distance of each node to the node whose context it is part of.
+        distances: dict[tuple[int, int], int] = {}
+        for index, nodes_at_depth_node in enumerate(nodes_at_depth):
+            depths = {
+                node.pk: depth for depth, _nodes in nodes_at_depth_node.items() for node in _nodes
+            }
+            for position, (node, _, _) in enumerate(context_nodes[index]):
+                distances[(index, position)] = depths[node.pk]
+
+        included: set[tuple[int, int]] = set()
+        for key in sorted(node_strings, key=lambda key: (distances[key], key)):
+            if node_counts[key] + CONTEXT_TOKEN_MARGIN <= budget:
+                included.add(key)
+                budget -= node_counts[key] + CONTEXT_TOKEN_MARGIN
+
+        included_nodes = {context_nodes[index][position][0].pk for index, position in included}
+        dropped_nodes = {
+            node.pk: node
+            for context in context_nodes
+            for node, _, _ in context
+            if node.pk not in included_nodes
+        }
+        node_context = [
+            "".join(
+                node_strings[(index, position)]
+                for position in range(len(context))
+                if (index, position) in included
+            )
+            for index, context in enumerate(context_nodes)
+        ]
+        return node_context, list(dropped_nodes.values())
+
+    def _get_system_prompt(self, node_context: list[str]) -> str:
+        return self.system_message + CONTEXT_PREFIX + "\n".join(node_context) + CONTEXT_SUFFIX
+
+    @staticmethod
+    def _get_messages_with_system_prompt(
+        system_prompt: str, query: str
+    ) -> list[ChatCompletionMessageParam]:
         return [
             {"role": "developer", "content": system_prompt},
             {"role": "user", "content": query},
         ]
 
+    def _count_parts(self, system_prompts: list[str]) -> list[list[int]]:
+        """
+        Return the token counts of the parts of each system prompt, split right before each node.
+        The encoders never merge a newline with a parenthesis at the start of the next line, so the
+        counts of the parts add up to the count of the whole prompt. Prompts that share nodes share
+        parts, which are encoded once.
+        """
+        parts = [NODE_START.split(system_prompt) for system_prompt in system_prompts]
+        counts = iter(
+            utils.tokens.count_with_encoding(
+                utils.tokens.get_encoding_or_default(self.model),
+                [part for prompt_parts in parts for part in prompt_parts],
+            )
+        )
+        return [[next(counts) for _ in prompt_parts] for prompt_parts in parts]
+
+    def _count_messages(self, system_prompts: list[str], query: str) -> list[int]:
+        """Return the token counts of the messages with each of the given system prompts."""
+        # The messages without the system prompt, whose parts are counted separately.
+        message_count = utils.tokens.num_tokens_from_messages(
+            self._get_messages_with_system_prompt("", query), self.model
+        )
+        return [message_count + sum(counts) for counts in self._count_parts(system_prompts)]
+
     class Meta(utils_models.SoftDeletableBaseModel.Meta):
         verbose_name_plural = "buddies"
 
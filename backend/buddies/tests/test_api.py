@@ -17,6 +17,7 @@ class BuddyViewSetTestCase(BaseTransactionTestCase):
             data={"nodes": [node.public_id], "level": 1, "message": "test"},
         )
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Buddy-Dropped-Nodes"], "0")
 
     def test_buddy_query_empty(self) -> None:
         buddy = factories.BuddyFactory()
@@ -4,6 +4,8 @@ from django.utils import timezone
 from openai.types.chat import ChatCompletion, ChatCompletionMessage
 from openai.types.chat.chat_completion import Choice
 
+import llms.models
+import utils.tokens
 from buddies import models
 from buddies.tests import factories
 from nodes.tests import factories as node_factories
@@ -55,3 +57,100 @@ class BuddyTestCase(BaseTransactionTestCase):
         self.assertIn(0, token_counts)
         self.assertNotIn(1, token_counts)
         self.assertNotIn(-1, token_counts)
+
+    def test_token_counts_match_messages(self) -> None:
+        """The counts of the levels add up to the counts of the messages of each level."""
+        root, other = node_factories.NodeFactory.create_batch(2)
+        subnodes = [
+            node_factories.NodeFactory.create(title="Trailing space ", text=""),
+            node_factories.NodeFactory.create(title="Numbers 123", text="Ends with a number 42"),
+            node_factories.NodeFactory.create(title="", text="(Parentheses) and 'quotes'"),
+        ]
+        root.subnodes.add(*subnodes)
+        other.subnodes.add(subnodes[0])
+        for subnode in subnodes:
+            subnode.subnodes.add(*node_factories.NodeFactory.create_batch(2))
+
+        for model in ("gpt-4", "gpt-4o"):
+            buddy = factories.BuddyFactory.create(model=model, system_message="System.")
+            nodes = [root, other]
+            token_counts = buddy.calculate_token_counts(nodes, 5, "Question?")
+            self.assertListEqual(list(token_counts), list(range(4)))
+            for level, count in token_counts.items():
+                messages, dropped_nodes = buddy.get_query_messages(level, nodes, "Question?")
+                self.assertListEqual(dropped_nodes, [])
+                self.assertEqual(count, utils.tokens.num_tokens_from_messages(messages, model))
+
+    def test_query_messages_within_token_limit(self) -> None:
+        buddy = factories.BuddyFactory.create(model="gpt-4")
+        node = node_factories.NodeFactory.create()
+        node.subnodes.add(*node_factories.NodeFactory.create_batch(2))
+        expected = buddy._get_messages_with_system_prompt(
+            buddy._get_system_prompt([node.node_context_for_depth(2)]), "Question?"
+        )
+
+        # Without a known input token limit, the whole context is sent.
+        self.assertEqual(buddy.get_query_messages(2, [node], "Question?"), (expected, []))
+
+        llms.models.LLModel.objects.create(
+            name="GPT-4", identifier="gpt-4", input_token_limit=100_000
+        )
+        self.assertEqual(buddy.get_query_messages(2, [node], "Question?"), (expected, []))
+        # The counts of the context and the system message are cached, only the query is encoded.
+        misses = utils.tokens.cache.stats["misses"]
+        buddy.get_query_messages(2, [node], "Another question?")
+        self.assertEqual(utils.tokens.cache.stats["misses"], misses)
+
+    def test_query_messages_keep_a_margin(self) -> None:
+        """A context that fits the limit exactly is packed, the separate counts need a margin."""
+        buddy = factories.BuddyFactory.create(model="gpt-4", system_message="System.")
+        node = node_factories.NodeFactory.create(title="Root", text="word " * 20)
+        subnode = node_factories.NodeFactory.create(title="Subnode", text="word " * 20)
+        node.subnodes.add(subnode)
+        messages, _ = buddy.get_query_messages(2, [node], "Question?")
+        count = utils.tokens.num_tokens_from_messages(messages, "gpt-4")
+
+        llm = llms.models.LLModel.objects.create(
+            name="GPT-4", identifier="gpt-4", input_token_limit=count
+        )
+        self.assertListEqual(buddy.get_query_messages(2, [node], "Question?")[1], [subnode])
+
+        llm.input_token_limit = count + 3 * models.CONTEXT_TOKEN_MARGIN
+        llm.save()
+        self.assertEqual(buddy.get_query_messages(2, [node], "Question?"), (messages, []))
+
+    def test_query_messages_are_packed_by_distance(self) -> None:
+        buddy = factories.BuddyFactory.create(model="gpt-4", system_message="System.")
+        node = node_factories.NodeFactory.create(title="Root", text="word " * 20)
+        subnodes = [
+            node_factories.NodeFactory.create(title=f"Subnode {index}", text="word " * 20)
+            for index in range(3)
+        ]
+        node.subnodes.add(*subnodes)
+        # Enough for the root and its subnodes with the margins and the IDs of the leaves they are
+        # connected to, but not for any of the leaves.
+        messages, _ = buddy.get_query_messages(3, [node], "Question?")
+        limit = utils.tokens.num_tokens_from_messages(messages, "gpt-4") + 250
+
+        leaves = []
+        for subnode in subnodes:
+            subnode_leaves = [
+                node_factories.NodeFactory.create(
+                    title=f"Leaf {len(leaves) + index}", text="long " * 300
+                )
+                for index in range(2)
+            ]
+            subnode.subnodes.add(*subnode_leaves)
+            leaves.extend(subnode_leaves)
+        llms.models.LLModel.objects.create(
+            name="GPT-4", identifier="gpt-4", input_token_limit=limit
+        )
+
+        messages, dropped_nodes = buddy.get_query_messages(3, [node], "Question?")
+        self.assertLessEqual(utils.tokens.num_tokens_from_messages(messages, "gpt-4"), limit)
+        self.assertCountEqual(dropped_nodes, leaves)
+        system_prompt = str(messages[0]["content"])
+        for included in [node, *subnodes]:
+            self.assertIn(str(included.public_id), system_prompt)
+        for leaf in leaves:
+            self.assertNotIn(f"Leaf {leaves.index(leaf)}", system_prompt)
@@ -22,6 +22,9 @@ if typing.TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# The number of nodes left out of the context to stay within the input token limit of the LLM.
+DROPPED_NODES_HEADER = "X-Buddy-Dropped-Nodes"
+
 
 @extend_schema(
     tags=["Buddies"],
@@ -45,7 +48,9 @@ class BuddyModelViewSet(views.BaseModelViewSet):
         description="Query a buddy using the given nodes and level. The level defines the depth of "
         "the query, level 0 meaning that only the node detail page of the node specified is "
         "queried, level 1 includes the specified node's graph (subnodes), level 2 will also add "
-        "the subnodes detail pages to the context, etc.",
+        "the subnodes detail pages to the context, etc. If the context exceeds the input token "
+        "limit of the LLM, the nodes furthest from the given nodes are left out, their number is "
+        f"returned in the `{DROPPED_NODES_HEADER}` header.",
         responses={(200, "text/event-stream"): OpenApiTypes.STR, 404: None},
     )
     @action(detail=True, methods=["post"], serializer_class=serializers.BuddyQuerySerializer)
@@ -60,9 +65,12 @@ class BuddyModelViewSet(views.BaseModelViewSet):
         level = validated_data.get("level")
         message = validated_data.get("message") or ""
 
-        return StreamingHttpResponse(
-            buddy.query_model(nodes, level, message), content_type="text/event-stream"
+        messages, dropped_nodes = buddy.get_query_messages(level, nodes, message)
+        response = StreamingHttpResponse(
+            buddy.query_model(messages), content_type="text/event-stream"
         )
+        response[DROPPED_NODES_HEADER] = str(len(dropped_nodes))
+        return response
 
     @extend_schema(
         summary="Calculate token counts",
@@ -478,6 +478,8 @@ REST_FRAMEWORK: typing.Mapping[str, typing.Any] = {
 
 # django-cors-headers - https://github.com/adamchainz/django-cors-headers#setup
 CORS_URLS_REGEX = r"^/api/.*$"
+# Lets the frontend read how many nodes were left out of the context of a buddy query.
+CORS_EXPOSE_HEADERS = ["X-Buddy-Dropped-Nodes"]
 
 # By Default swagger ui is available only to admin user(s). You can change permission classes to
 # change that See more configuration options at
@@ -502,12 +504,71 @@ IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = "imagekit.cachefiles.strategies.Optimistic
 NODE_CRDT_KEY = env("NODE_CRDT_KEY", default="default")
 NODE_CRDT_EVENTS_INTERVAL = env.int("NODE_CRDT_INTERVAL", default=60 * 5)
 NODE_CRDT_EVENTS_TASK = env("NODE_CRDT_TASK", default="nodes.tasks.process_document_events")
+# The number of document events that are claimed and applied together.
+NODE_CRDT_EVENTS_BATCH_SIZE = env.int("NODE_CRDT_EVENTS_BATCH_SIZE", default=500)
+# The number of partitions document events are sharded into, each one can be processed in parallel.
+NODE_CRDT_EVENTS_PARTITIONS = env.int("NODE_CRDT_EVENTS_PARTITIONS", default=1)
+# The number of seconds the document listener collects notifications before dispatching tasks.
+NODE_CRDT_EVENTS_DEBOUNCE_WINDOW = env.float("NODE_CRDT_EVENTS_DEBOUNCE_WINDOW", default=0.5)
 
 # The interval at which we create document snapshots.
 NODE_VERSIONING_INTERVAL = env.int("NODE_VERSIONING_INTERVAL", default=60 * 5)
 # The interval at which the task is executed.
 NODE_VERSIONING_TASK_INTERVAL = env.int("NODE_VERSIONING_INTERVAL", default=60)
 NODE_VERSIONING_TASK = env("NODE_VERSIONING_TASK", default="nodes.tasks.document_versioning")
+# The number of documents that are versioned together.
+NODE_VERSIONING_BATCH_SIZE = env.int("NODE_VERSIONING_BATCH_SIZE", default=100)
+# The codec new document versions are compressed with ("zstd" or "none").
+NODE_VERSIONING_CODEC = env("NODE_VERSIONING_CODEC", default="zstd")
+# Document versions are kept for `NODE_VERSIONING_KEEP_ALL` seconds, after that only the latest
+# version per hour is kept until `NODE_VERSIONING_KEEP_HOURLY` seconds and one version per day after
+# that. Each tier is (age in seconds, bucket size in seconds).
+NODE_VERSIONING_RETENTION = [
+    (env.int("NODE_VERSIONING_KEEP_ALL", default=60 * 60 * 24), 60 * 60),
+    (env.int("NODE_VERSIONING_KEEP_HOURLY", default=60 * 60 * 24 * 30), 60 * 60 * 24),
+]
+# Whether thinned out versions are deleted from the database instead of being soft-deleted.
+NODE_VERSIONING_RETENTION_HARD_DELETE = env.bool(
+    "NODE_VERSIONING_RETENTION_HARD_DELETE", default=False
+)
+NODE_VERSIONING_RETENTION_TASK_INTERVAL = env.int(
+    "NODE_VERSIONING_RETENTION_TASK_INTERVAL", default=60 * 60
+)
+NODE_VERSIONING_RETENTION_TASK = env(
+    "NODE_VERSIONING_RETENTION_TASK", default="nodes.tasks.thin_document_versions"
+)
+
+# Permissions
+# ------------------------------------------------------------------------------
+# The number of seconds the IDs of the spaces a user can access are cached. The cache is invalidated
+# when memberships or the visibility of spaces change, this is the upper bound for bulk updates.
+SPACE_IDS_CACHE_TIMEOUT = env.int("SPACE_IDS_CACHE_TIMEOUT", default=60 * 5)
+
+# Search
+# ------------------------------------------------------------------------------
+# The number of seconds typeahead results are cached per user and query.
+NODE_TYPEAHEAD_CACHE_TIMEOUT = env.int("NODE_TYPEAHEAD_CACHE_TIMEOUT", default=30)
+# The `utils.embeddings.Embedder` used for the semantic search and its keyword arguments. Nodes
+# have to be embedded again after switching, see the `reset_node_embeddings` management command.
+NODE_EMBEDDINGS_PROVIDER = env(
+    "NODE_EMBEDDINGS_PROVIDER", default="utils.embeddings.HashingEmbedder"
+)
+NODE_EMBEDDINGS_PROVIDER_OPTIONS = env.json("NODE_EMBEDDINGS_PROVIDER_OPTIONS", default={})
+# Node texts are embedded in chunks of this many words, overlapping by `NODE_EMBEDDINGS_OVERLAP`.
+NODE_EMBEDDINGS_CHUNK_WORDS = env.int("NODE_EMBEDDINGS_CHUNK_WORDS", default=200)
+NODE_EMBEDDINGS_OVERLAP = env.int("NODE_EMBEDDINGS_OVERLAP", default=40)
+# The number of changed nodes that are embedded together.
+NODE_EMBEDDINGS_BATCH_SIZE = env.int("NODE_EMBEDDINGS_BATCH_SIZE", default=100)
+NODE_EMBEDDINGS_TASK_INTERVAL = env.int("NODE_EMBEDDINGS_TASK_INTERVAL", default=60)
+NODE_EMBEDDINGS_TASK = env("NODE_EMBEDDINGS_TASK", default="nodes.tasks.update_node_embeddings")
+# The number of spaces whose vectors are kept in memory for the semantic search.
+NODE_EMBEDDINGS_INDEX_CACHE_SIZE = env.int("NODE_EMBEDDINGS_INDEX_CACHE_SIZE", default=100)
+
+# Buddies
+# ------------------------------------------------------------------------------
+# The number of seconds the context of a node is cached per depth. The cache is invalidated when a
+# node in the context changes, this is the upper bound for changes that bypass the signals.
+NODE_CONTEXT_CACHE_TIMEOUT = env.int("NODE_CONTEXT_CACHE_TIMEOUT", default=60 * 60)
 
 # LLMs
 # ------------------------------------------------------------------------------
@@ -516,6 +577,13 @@ OPENAI_BASE_URL = env("OPENAI_BASE_URL", default=None)
 AZURE_OPENAI_API_KEY = env("AZURE_OPENAI_API_KEY", default=None)
 AZURE_OPENAI_ENDPOINT = env("AZURE_OPENAI_ENDPOINT", default=None)
 AZURE_OPENAI_API_VERSION = env("AZURE_OPENAI_API_VERSION", default="2024-09-01-preview")
+# Token counts are cached by content hash, in-process for up to `TOKEN_COUNT_CACHE_SIZE` texts and,
+# if set, in the `TOKEN_COUNT_CACHE_ALIAS` cache of `CACHES` to share them between processes.
+TOKEN_COUNT_CACHE_SIZE = env.int("TOKEN_COUNT_CACHE_SIZE", default=10_000)
+TOKEN_COUNT_CACHE_ALIAS: str | None = env("TOKEN_COUNT_CACHE_ALIAS", default=None)
+TOKEN_COUNT_CACHE_TIMEOUT = env.int("TOKEN_COUNT_CACHE_TIMEOUT", default=60 * 60 * 24 * 7)
+# Shorter texts are encoded without looking them up in the cache.
+TOKEN_COUNT_CACHE_MIN_LENGTH = env.int("TOKEN_COUNT_CACHE_MIN_LENGTH", default=32)
 
 # API settings
 # ------------------------------------------------------------------------------
@@ -37,6 +37,8 @@ CACHES = {
         },
     }
 }
+# Share token counts between processes, see `TOKEN_COUNT_CACHE_SIZE`.
+TOKEN_COUNT_CACHE_ALIAS = env("TOKEN_COUNT_CACHE_ALIAS", default="default")
 
 # SECURITY
 # ------------------------------------------------------------------------------
@@ -0,0 +1,222 @@
+import hashlib
+import heapq
+import threading
+import typing
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import models as django_models
+from django.db import transaction
+
+from nodes import models
+from utils import embeddings
+
+# The stamp of an index, the number of vectors and the time of the latest change in the space.
+Stamp = tuple[int, typing.Any]
+
+
+def chunk_text(title: str | None, text: str | None) -> list[str]:
+    """
+    Split the text of a node into chunks of `NODE_EMBEDDINGS_CHUNK_WORDS` words, overlapping by
+    `NODE_EMBEDDINGS_OVERLAP` words. The title is prepended to every chunk, so that chunks are
+    found by the topic of the node as well.
+    """
+    title = (title or "").strip()
+    words = (text or "").split()
+    size = settings.NODE_EMBEDDINGS_CHUNK_WORDS
+    step = max(size - settings.NODE_EMBEDDINGS_OVERLAP, 1)
+
+    chunks = []
+    for start in range(0, max(len(words) - size + step, 1), step):
+        chunk = " ".join(words[start : start + size])
+        chunks.append(f"{title}\n{chunk}" if title and chunk else title or chunk)
+    return [chunk for chunk in chunks if chunk]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def update_node_embeddings(nodes: typing.Iterable[models.Node]) -> int:
+    """
+    Store the vectors of the chunks of the given nodes, computed with the configured embedder.
+    Returns the number of embedded chunks, see `embed_nodes` and `store_node_embeddings`.
+    """
+    nodes = list(nodes)
+    rows, embedded = embed_nodes(nodes)
+    with transaction.atomic():
+        store_node_embeddings(nodes, rows)
+    return embedded
+
+
+def embed_nodes(nodes: typing.Iterable[models.Node]) -> tuple[list[models.NodeEmbedding], int]:
+    """
+    Return the unsaved chunk vectors of the given nodes, computed with the configured embedder,
+    and the number of embedded chunks.
+    Chunks whose text didn't change keep their vector, the others are embedded together in one
+    call. Nothing is written, so this doesn't need to run in a transaction.
+    """
+    embedder = embeddings.get_embedder()
+    chunks = {node.pk: chunk_text(node.title, node.text) for node in nodes}
+
+    existing = {
+        (node_id, hash_): vector
+        for node_id, hash_, vector in models.NodeEmbedding.objects.filter(
+            node_id__in=chunks, embedder=embedder.name
+        ).values_list("node_id", "text_hash", "vector")
+    }
+
+    rows: list[models.NodeEmbedding] = []
+    missing: list[tuple[models.NodeEmbedding, str]] = []
+    for node_id, texts in chunks.items():
+        for index, text in enumerate(texts):
+            row = models.NodeEmbedding(
+                node_id=node_id, chunk=index, embedder=embedder.name, text_hash=text_hash(text)
+            )
+            if (vector := existing.get((node_id, row.text_hash))) is not None:
+                row.vector = bytes(vector)
+            else:
+                missing.append((row, text))
+            rows.append(row)
+
+    if missing:
+        vectors = embedder.embed([text for _, text in missing])
+        for (row, _), vector in zip(missing, vectors, strict=True):
+            row.vector = vector.astype(np.float32).tobytes()
+
+    return rows, len(missing)
+
+
+def store_node_embeddings(
+    nodes: typing.Iterable[models.Node], rows: list[models.NodeEmbedding]
+) -> None:
+    """Replace the chunk vectors of the configured embedder of the given nodes with `rows`."""
+    models.NodeEmbedding.objects.filter(
+        node_id__in=[node.pk for node in nodes], embedder=embeddings.get_embedder().name
+    ).delete()
+    models.NodeEmbedding.objects.bulk_create(rows)
+
+
+class SpaceIndex:
+    """Brute-force k-NN index over the chunk vectors of the nodes of a space."""
+
+    def __init__(self, node_ids: np.ndarray, vectors: np.ndarray) -> None:
+        # Rows are sorted by node, `starts` are the first rows of each node.
+        self.vectors = vectors
+        self.starts = np.flatnonzero(np.r_[len(node_ids) > 0, node_ids[1:] != node_ids[:-1]])
+        self.node_ids = node_ids[self.starts]
+
+    def search(self, query: np.ndarray, limit: int) -> list[tuple[float, int]]:
+        """Return up to `limit` (score, node ID) pairs, scored by their most similar chunk."""
+        if not len(self.node_ids):
+            return []
+        scores = np.maximum.reduceat(self.vectors @ query, self.starts)
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(float(scores[i]), int(self.node_ids[i])) for i in top]
+
+
+class SpaceIndexCache:
+    """
+    In-process cache of the indexes of the `NODE_EMBEDDINGS_INDEX_CACHE_SIZE` most recently searched
+    spaces. An index is loaded again when the number of vectors or the time of the latest change in
+    its space differs from when it was loaded.
+    """
+
+    def __init__(self) -> None:
+        self.entries: OrderedDict[tuple[int, str], tuple[Stamp, SpaceIndex]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_queryset(
+        space_ids: typing.Collection[int], embedder: embeddings.Embedder
+    ) -> "django_models.QuerySet[models.NodeEmbedding]":
+        return models.NodeEmbedding.objects.filter(
+            embedder=embedder.name,
+            node__space_id__any=space_ids,
+            node__node_type=models.NodeType.DEFAULT,
+            node__is_removed=False,
+        )
+
+    def get_indexes(
+        self, space_ids: typing.Collection[int], embedder: embeddings.Embedder
+    ) -> list[SpaceIndex]:
+        stamps: dict[int, Stamp] = {
+            space_id: (count, latest)
+            for space_id, count, latest in self.get_queryset(space_ids, embedder)
+            .values("node__space_id")
+            .annotate(count=django_models.Count("id"), latest=django_models.Max("updated_at"))
+            .values_list("node__space_id", "count", "latest")
+        }
+
+        indexes: dict[int, SpaceIndex] = {}
+        with self.lock:
+            for space_id, stamp in stamps.items():
+                entry = self.entries.get((space_id, embedder.name))
+                if entry is not None and entry[0] == stamp:
+                    self.entries.move_to_end((space_id, embedder.name))
+                    indexes[space_id] = entry[1]
+
+        stale = [space_id for space_id in stamps if space_id not in indexes]
+        if stale:
+            loaded = self.load(stale, embedder)
+            with self.lock:
+                for space_id, index in loaded.items():
+                    self.entries[(space_id, embedder.name)] = (stamps[space_id], index)
+                    self.entries.move_to_end((space_id, embedder.name))
+                while len(self.entries) > settings.NODE_EMBEDDINGS_INDEX_CACHE_SIZE:
+                    self.entries.popitem(last=False)
+            indexes.update(loaded)
+        return list(indexes.values())
+
+    def load(
+        self, space_ids: typing.Collection[int], embedder: embeddings.Embedder
+    ) -> dict[int, SpaceIndex]:
+        rows = (
+            self.get_queryset(space_ids, embedder)
+            .order_by("node__space_id", "node_id", "chunk")
+            .values_list("node__space_id", "node_id", "vector")
+        )
+        grouped: dict[int, tuple[list[int], list[bytes]]] = {}
+        for space_id, node_id, vector in rows.iterator(chunk_size=2000):
+            node_ids, vectors = grouped.setdefault(space_id, ([], []))
+            node_ids.append(node_id)
+            vectors.append(bytes(vector))
+
+        return {
+            space_id: SpaceIndex(
+                np.array(node_ids, dtype=np.int64),
+                np.frombuffer(b"".join(vectors), dtype=np.float32).reshape(
+                    len(vectors), embedder.dimensions
+                ),
+            )
+            for space_id, (node_ids, vectors) in grouped.items()
+        }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+index_cache = SpaceIndexCache()
+
+
+def search(
+    query: str, space_ids: typing.Collection[int], limit: int = 10
+) -> list[tuple[float, int]]:
+    """
+    Return up to `limit` (score, node ID) pairs of the nodes in the given spaces that are most
+    similar to the query, by the cosine similarity of their most similar chunk.
+    """
+    embedder = embeddings.get_embedder()
+    vector = embedder.embed([query])[0]
+    results = (
+        result
+        for index in index_cache.get_indexes(space_ids, embedder)
+        for result in index.search(vector, limit)
+    )
+    return heapq.nlargest(limit, results)
@@ -16,28 +16,17 @@ if typing.TYPE_CHECKING:
 
 
 def get_document_queryset(request: request.Request) -> QuerySet:
-    user = request.user or AnonymousUser()
+    space_ids = models.Space.get_space_ids_for_user(READ, request.user or AnonymousUser())
     return models.Document.objects.filter(
-        (
-            Q(space__isnull=False)
-            & (models.Space.get_user_has_permission_filter(READ, user, prefix="space"))
-        )
-        | (
-            Q(node_editor__isnull=False)
-            & Q(models.Node.get_user_has_permission_filter(READ, user, prefix="node_editor"))
-        )
-        | (
-            Q(node_graph__isnull=False)
-            & Q(models.Node.get_user_has_permission_filter(READ, user, prefix="node_graph"))
-        )
+        Q(space__pk__any=space_ids)
+        | Q(node_editor__space_id__any=space_ids)
+        | Q(node_graph__space_id__any=space_ids)
     )
 
 
 def get_space_queryset(request: request.Request) -> QuerySet:
-    user = request.user or AnonymousUser()
-    return models.Space.available_objects.filter(
-        models.Space.get_user_has_permission_filter(action=READ, user=user)
-    ).distinct()
+    space_ids = models.Space.get_space_ids_for_user(READ, request.user or AnonymousUser())
+    return models.Space.available_objects.filter(pk__any=space_ids)
 
 
 def get_method_queryset(request: request.Request) -> QuerySet:
@@ -64,8 +53,8 @@ class NodePermissionFilterBackend(DRYPermissionFiltersBase):
     ) -> "QuerySet[models.Node]":
         """Only return nodes that the user has access to."""
         return queryset.filter(
-            models.Node.get_user_has_permission_filter(READ, user=request.user)
-        ).distinct()
+            space_id__any=models.Space.get_space_ids_for_user(READ, request.user)
+        )
 
 
 class NodeFilterSet(filters.FilterSet):
@@ -81,45 +70,17 @@ class SpacePermissionFilterBackend(DRYPermissionFiltersBase):
         self, request: request.Request, queryset: QuerySet, view: views.APIView
     ) -> "QuerySet[models.Space]":
         """Only return spaces that the user has access to."""
-        return queryset.filter(
-            models.Space.get_user_has_permission_filter(READ, user=request.user)
-        ).distinct()
+        return queryset.filter(pk__any=models.Space.get_space_ids_for_user(READ, request.user))
 
 
 class DocumentVersionPermissionFilterBackend(DRYPermissionFiltersBase):
     def filter_list_queryset(
         self, request: request.Request, queryset: QuerySet, view: views.APIView
     ) -> "QuerySet[models.DocumentVersion]":
-        """Only return spaces that the user has access to."""
-        user = request.user or AnonymousUser()
-        queryset_filters = (
-            (
-                Q(document__space__isnull=False)
-                & (
-                    models.Space.get_user_has_permission_filter(
-                        "read", user, prefix="document__space"
-                    )
-                )
-            )
-            | (
-                Q(document__node_editor__isnull=False)
-                & Q(
-                    models.Node.get_user_has_permission_filter(
-                        "read", user, prefix="document__node_editor"
-                    )
-                )
-            )
-            | (
-                Q(document__node_graph__isnull=False)
-                & Q(
-                    models.Node.get_user_has_permission_filter(
-                        "read", user, prefix="document__node_graph"
-                    )
-                )
-            )
-        )
-
-        return queryset.filter(queryset_filters).distinct()
+        """Only return versions of documents that the user has access to."""
+        # A subquery instead of joins, so versions of documents that are readable through several
+        # paths aren't repeated.
+        return queryset.filter(document_id__in=get_document_queryset(request).values("pk"))
 
 
 class MethodNodePermissionFilterBackend(DRYPermissionFiltersBase):
@@ -0,0 +1,196 @@
+"""
+Helpers for listening to document change notifications.
+
+The `document_change` trigger sends a notification with the public ID of the changed document for
+every change. Dispatching a task for every notification would flood the queue during bursts of
+edits, so notifications are collected for a short window and one task is dispatched per partition
+that received events in that window.
+
+By default the listener dispatches Celery tasks, `AsyncDocumentListener` processes the events in
+the listener process instead to avoid the broker round trip.
+"""
+
+import asyncio
+import logging
+import time
+
+import psycopg
+from asgiref.sync import sync_to_async
+from django import db
+from django.conf import settings
+
+from nodes import models, sync, tasks
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationDebouncer:
+    """
+    Collect document notifications and dispatch the affected partitions once per window.
+
+    The window starts with the first notification after a dispatch and isn't extended by later
+    notifications, so a constant stream of notifications is still dispatched once per window.
+    """
+
+    def __init__(self, window: float | None = None, partitions: int | None = None) -> None:
+        self.window = settings.NODE_CRDT_EVENTS_DEBOUNCE_WINDOW if window is None else window
+        self.partitions = settings.NODE_CRDT_EVENTS_PARTITIONS if partitions is None else partitions
+
+        self.document_ids: set[str] = set()
+        self.pending_partitions: set[int] = set()
+        self.window_started_at: float | None = None
+
+        # Counters to size the window, see `stats`.
+        self.received = 0
+        self.documents = 0
+        self.dispatched = 0
+
+    def add(self, payload: str, now: float | None = None) -> None:
+        """Register a notification with the given payload (the public ID of the document)."""
+        self.received += 1
+        if self.window_started_at is None:
+            self.window_started_at = time.monotonic() if now is None else now
+
+        try:
+            partition = sync.partition_for_public_id(payload, self.partitions)
+        except ValueError:
+            # Notifications without a document, process all partitions to be safe.
+            logger.warning(f"Notification without a valid document ID received: {payload!r}")
+            self.pending_partitions.update(range(self.partitions))
+            return
+
+        if payload not in self.document_ids:
+            self.document_ids.add(payload)
+            self.documents += 1
+        self.pending_partitions.add(partition)
+
+    def timeout(self, now: float | None = None) -> float | None:
+        """Return the number of seconds until the current window is due, None if it's empty."""
+        if self.window_started_at is None:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.window_started_at + self.window - now)
+
+    def pop_due(self, now: float | None = None) -> list[int]:
+        """Return the partitions to dispatch if the current window is due and start a new one."""
+        if self.timeout(now) != 0.0:
+            return []
+        return self.pop()
+
+    def pop(self) -> list[int]:
+        """Return the partitions of the current window and start a new one."""
+        partitions = sorted(self.pending_partitions)
+        self.document_ids.clear()
+        self.pending_partitions.clear()
+        self.window_started_at = None
+        self.dispatched += len(partitions)
+        return partitions
+
+    def dispatch(self, now: float | None = None) -> list[int]:
+        """Queue a task for each partition of the current window if it's due."""
+        if partitions := self.pop_due(now):
+            tasks.queue_document_events(partitions)
+        return partitions
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        The number of notifications received, distinct documents per window (summed up) and
+        tasks dispatched.
+        """
+        return {
+            "received": self.received,
+            "documents": self.documents,
+            "dispatched": self.dispatched,
+        }
+
+
+def process_partition(partition: int) -> dict[str, int]:
+    """Process the events of a partition in the current thread, like a Celery worker would."""
+    db.close_old_connections()
+    try:
+        return tasks.process_document_events(partition=partition)
+    finally:
+        db.close_old_connections()
+
+
+class AsyncDocumentListener:
+    """
+    Listen for document notifications with asyncio and process the events in-process.
+
+    Events are processed in worker threads with the regular (synchronous) event processing, each
+    thread keeps its own database connection. At most one run per partition is in progress and
+    one more is queued, notifications for a partition that already has a queued run are covered by
+    that run. If processing fails, the partition is handed over to Celery instead.
+    """
+
+    def __init__(self, debouncer: NotificationDebouncer | None = None) -> None:
+        self.debouncer = debouncer or NotificationDebouncer()
+        self.locks = {partition: asyncio.Lock() for partition in range(self.debouncer.partitions)}
+        self.queued_partitions: set[int] = set()
+        self.running: set[asyncio.Task] = set()
+        # Set once the listener receives notifications.
+        self.listening = asyncio.Event()
+
+    @staticmethod
+    def connection_params(alias: str) -> dict:
+        """Return the parameters for a psycopg connection to the given database."""
+        params = db.connections[alias].get_connection_params()
+        # These only apply to the synchronous connections Django creates.
+        params.pop("cursor_factory", None)
+        params.pop("context", None)
+        return params
+
+    async def listen(self, alias: str = "default") -> None:
+        """Listen until the connection is lost, the caller is expected to restart the listener."""
+        async with await psycopg.AsyncConnection.connect(
+            **self.connection_params(alias), autocommit=True
+        ) as conn:
+            await conn.execute(f"LISTEN {models.PG_NOTIFY_CHANNEL};")
+            logger.info("Listening for notifications...")
+            self.listening.set()
+
+            # Catch up with events that were recorded while nobody was listening.
+            for partition in range(self.debouncer.partitions):
+                self.schedule(partition)
+
+            try:
+                async for notify in conn.notifies():
+                    logger.debug(
+                        f"NOTIFY received: {notify.pid}, {notify.channel}, {notify.payload}"
+                    )
+                    self.add(notify.payload)
+            finally:
+                logger.info(f"Notification stats: {self.debouncer.stats}")
+
+    def add(self, payload: str) -> None:
+        """Register a notification and schedule the dispatch when a new window starts."""
+        new_window = self.debouncer.timeout() is None
+        self.debouncer.add(payload)
+        if new_window:
+            asyncio.get_running_loop().call_later(self.debouncer.window, self.dispatch)
+
+    def dispatch(self) -> None:
+        for partition in self.debouncer.pop():
+            self.schedule(partition)
+
+    def schedule(self, partition: int) -> None:
+        if partition in self.queued_partitions:
+            return
+        self.queued_partitions.add(partition)
+        task = asyncio.create_task(self.process(partition))
+        # Keep a reference to the task, otherwise it might be garbage collected while running.
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def process(self, partition: int) -> None:
+        async with self.locks[partition]:
+            self.queued_partitions.discard(partition)
+            try:
+                stats = await sync_to_async(process_partition, thread_sensitive=False)(partition)
+                logger.debug(f"Processed partition {partition}: {stats}")
+            except Exception as e:
+                logger.exception(f"Error processing partition {partition}, using Celery: {e}")
+                await sync_to_async(tasks.queue_document_events, thread_sensitive=False)(
+                    [partition]
+                )
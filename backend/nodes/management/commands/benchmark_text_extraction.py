@@ -0,0 +1,77 @@
+import timeit
+import typing
+
+from django.core.management import BaseCommand
+
+import nodes.utils
+
+if typing.TYPE_CHECKING:
+    from django.core.management.base import CommandParser
+
+
+def extract_text_recursive(node: dict[str, typing.Any] | list | None) -> list[str]:
+    """The previous, recursive implementation of `extract_text_from_node`, used as the baseline."""
+    texts: list[str] = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "type" and value == "text":
+                texts.append(node["text"])
+            elif isinstance(value, (dict, list)):
+                texts.extend(extract_text_recursive(value))
+    elif isinstance(node, list):
+        for item in node:
+            texts.extend(extract_text_recursive(item))
+    return texts
+
+
+def build_document(paragraphs: int, depth: int) -> dict[str, typing.Any]:
+    """Build an editor document with the given number of paragraphs, nested in lists."""
+    paragraph = {
+        "type": "paragraph",
+        "content": [
+            {"type": "text", "text": "Lorem ipsum dolor sit amet, consectetur adipiscing elit."},
+            {"type": "hardBreak"},
+            {"type": "text", "marks": [{"type": "bold"}], "text": "Sed do eiusmod tempor."},
+        ],
+    }
+    content: list[dict[str, typing.Any]] = [paragraph] * paragraphs
+    for _ in range(depth):
+        content = [{"type": "bulletList", "content": [{"type": "listItem", "content": content}]}]
+    return {"type": "doc", "content": content}
+
+
+class Command(BaseCommand):
+    help = "Compare the text extraction from editor documents with the previous implementation"
+
+    def add_arguments(self, parser: "CommandParser") -> None:
+        parser.add_argument(
+            "--paragraphs", type=int, default=5000, help="Number of paragraphs in the document."
+        )
+        parser.add_argument(
+            "--depth", type=int, default=50, help="Number of nested lists around the paragraphs."
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs.")
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        document = build_document(options["paragraphs"], options["depth"])
+        repeat = options["repeat"]
+
+        implementations: dict[str, typing.Callable[[], str]] = {
+            "recursive": lambda: " ".join(extract_text_recursive(document)),
+            "iterative": lambda: " ".join(nodes.utils.extract_text_from_node(document)),
+        }
+        results = {name: function() for name, function in implementations.items()}
+        assert results["recursive"] == results["iterative"], "The implementations differ."
+
+        timings = {
+            name: min(timeit.repeat(function, number=1, repeat=repeat))
+            for name, function in implementations.items()
+        }
+        for name, timing in timings.items():
+            self.stdout.write(f"{name}: {timing * 1000:.2f} ms")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Extracted {len(results['iterative'])} characters, the iterative implementation "
+                f"took {timings['iterative'] / timings['recursive']:.2f}x the time."
+            )
+        )
@@ -0,0 +1,94 @@
+import timeit
+import typing
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+import nodes.models
+import permissions.models
+import permissions.utils
+import users.models
+
+if typing.TYPE_CHECKING:
+    from django.core.management.base import CommandParser
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the role annotation of a page of nodes with the grouped role lookup after "
+        "pagination, on a space created for the benchmark and rolled back afterwards"
+    )
+
+    def add_arguments(self, parser: "CommandParser") -> None:
+        parser.add_argument(
+            "--nodes", type=int, default=10000, help="Number of nodes in the space."
+        )
+        parser.add_argument(
+            "--members", type=int, default=1000, help="Number of members of the space."
+        )
+        parser.add_argument("--page-size", type=int, default=100, help="Number of nodes per page.")
+        parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs.")
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        with transaction.atomic():
+            self.benchmark(options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, options: dict[str, typing.Any]) -> None:
+        space = nodes.models.Space.objects.create(title="Benchmark")
+        members = users.models.User.objects.bulk_create(
+            users.models.User(email=f"benchmark-{index}@example.com")
+            for index in range(options["members"])
+        )
+        permissions.models.ObjectMembership.objects.bulk_create(
+            permissions.models.ObjectMembership(
+                content_object=space, user=user, role=permissions.utils.get_member_role()
+            )
+            for user in members
+        )
+        nodes.models.Node.objects.bulk_create(
+            nodes.models.Node(title=f"Node {index}", space=space)
+            for index in range(options["nodes"])
+        )
+        user = members[0]
+        page_size = options["page_size"]
+        queryset = (
+            nodes.models.Node.available_objects.filter(space=space)
+            .only("id", "public_id", "space")
+            .select_related("space")
+            .order_by("pk")
+        )
+
+        def annotation() -> dict[int, list[str]]:
+            # Like the list views did: the paginator counts the annotated queryset, then fetches
+            # the page.
+            annotated = queryset.annotate(
+                user_roles=nodes.models.Node.get_role_annotation_query(user)
+            ).distinct()
+            annotated.count()
+            return {node.pk: node.user_roles for node in annotated[:page_size]}
+
+        def grouped() -> dict[int, list[str]]:
+            queryset.count()
+            return nodes.models.Node.get_user_roles(queryset[:page_size], user)
+
+        implementations: dict[str, typing.Callable[[], dict[int, list[str]]]] = {
+            "annotation": annotation,
+            "grouped": grouped,
+        }
+        results = {name: function() for name, function in implementations.items()}
+        assert results["annotation"] == results["grouped"], "The implementations differ."
+
+        timings = {
+            name: min(timeit.repeat(function, number=1, repeat=options["repeat"]))
+            for name, function in implementations.items()
+        }
+        for name, timing in timings.items():
+            self.stdout.write(f"{name}: {timing * 1000:.2f} ms")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Resolved the roles of {len(results['grouped'])} of {options['nodes']} nodes in a "
+                f"space with {options['members']} members, the grouped lookup took "
+                f"{timings['grouped'] / timings['annotation']:.2f}x the time."
+            )
+        )
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import selectors
 import signal
@@ -9,8 +10,11 @@ import psycopg
 from django.core.management import BaseCommand
 from django.db import connections
 
+import nodes.listener
 import nodes.models
-import nodes.tasks
+
+if typing.TYPE_CHECKING:
+    from django.core.management.base import CommandParser
 
 logger = logging.getLogger(__name__)
 
@@ -28,13 +32,30 @@ signal.signal(signal.SIGTERM, signal_handler)
 class Command(BaseCommand):
     help = "Listen for changes in the document table"
 
+    def add_arguments(self, parser: "CommandParser") -> None:
+        parser.add_argument(
+            "--in-process",
+            action="store_true",
+            help="Process the events in this process instead of dispatching Celery tasks.",
+        )
+
     def handle(self, *args: typing.Any, **options: typing.Any) -> None:
         if "direct" in connections:
-            connection = connections["direct"]
+            alias = "direct"
             logger.info("Using direct connection")
         else:
-            connection = connections["default"]
+            alias = "default"
             logger.error("Using default connection instead of direct connection")
+
+        if options["in_process"]:
+            try:
+                asyncio.run(nodes.listener.AsyncDocumentListener().listen(alias))
+            except psycopg.OperationalError:
+                self.connection_lost()
+            return
+
+        connection = connections[alias]
+        debouncer = nodes.listener.NotificationDebouncer()
         with connection.cursor() as curs:
             conn = curs.connection
             curs.execute(f"LISTEN {nodes.models.PG_NOTIFY_CHANNEL};")
@@ -42,24 +63,37 @@ class Command(BaseCommand):
 
             sel = selectors.DefaultSelector()
             sel.register(conn, selectors.EVENT_READ)
-            while True:
-                if not sel.select(timeout=60.0):
-                    continue  # No FD activity detected in one minute
-
-                # Activity detected. Is the connection still ok?
-                try:
-                    conn.execute("SELECT 1")
-                except psycopg.OperationalError:
-                    # You were disconnected: do something useful such as panicking
-                    self.stdout.write(
-                        self.style.WARNING("We lost our database connection! Shutting down...")
-                    )
-                    sys.exit(1)
-
-                for notify in conn.notifies():
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f"NOTIFY received: {notify.pid}, {notify.channel}, {notify.payload}"
-                        )
-                    )
-                    nodes.tasks.process_document_events.delay()
+            try:
+                while True:
+                    # Wait until the current window is due or for one minute if it's empty.
+                    timeout = debouncer.timeout()
+                    if not sel.select(timeout=60.0 if timeout is None else timeout):
+                        if timeout is None:
+                            # No FD activity detected in one minute, is the connection still ok?
+                            self.check_connection(conn)
+                            logger.info(f"Notification stats: {debouncer.stats}")
+                        debouncer.dispatch()
+                        continue
+
+                    try:
+                        for notify in conn.notifies(timeout=0):
+                            logger.debug(
+                                f"NOTIFY received: {notify.pid}, {notify.channel}, {notify.payload}"
+                            )
+                            debouncer.add(notify.payload)
+                    except psycopg.OperationalError:
+                        self.connection_lost()
+                    debouncer.dispatch()
+            finally:
+                logger.info(f"Notification stats: {debouncer.stats}")
+
+    def check_connection(self, conn: psycopg.Connection) -> None:
+        try:
+            conn.execute("SELECT 1")
+        except psycopg.OperationalError:
+            self.connection_lost()
+
+    def connection_lost(self) -> typing.NoReturn:
+        # You were disconnected: do something useful such as panicking
+        self.stdout.write(self.style.WARNING("We lost our database connection! Shutting down..."))
+        sys.exit(1)
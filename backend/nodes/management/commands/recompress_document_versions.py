@@ -0,0 +1,62 @@
+import typing
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+import nodes.models
+from utils import compression
+
+if typing.TYPE_CHECKING:
+    from django.core.management.base import CommandParser
+
+
+class Command(BaseCommand):
+    help = "Recompress document versions with a different codec and report the space saved"
+
+    def add_arguments(self, parser: "CommandParser") -> None:
+        parser.add_argument(
+            "--codec",
+            default=settings.NODE_VERSIONING_CODEC,
+            choices=compression.Codec.values,
+            help="The codec to recompress the versions with (default: NODE_VERSIONING_CODEC).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="The number of versions that are recompressed in one transaction.",
+        )
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        codec = options["codec"]
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("The batch size has to be at least 1.")
+
+        versions = (
+            nodes.models.DocumentVersion.all_objects.exclude(codec=codec)
+            .only("data", "codec")
+            .order_by("pk")
+        )
+
+        count = size_before = size_after = 0
+        last_pk = 0
+        while batch := list(versions.filter(pk__gt=last_pk)[:batch_size]):
+            for version in batch:
+                size_before += len(version.data)
+                version.set_data(version.get_data(), codec)
+                size_after += len(version.data)
+            nodes.models.DocumentVersion.all_objects.bulk_update(batch, ["data", "codec"])
+
+            count += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f"Recompressed {count} versions...")
+
+        saved = size_before - size_after
+        ratio = saved / size_before * 100 if size_before else 0.0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recompressed {count} versions with {codec}: {size_before} -> {size_after} bytes, "
+                f"saved {saved} bytes ({ratio:.1f}%)."
+            )
+        )
@@ -0,0 +1,35 @@
+import typing
+
+from django.core.management import BaseCommand
+
+import nodes.models
+from utils import embeddings
+
+if typing.TYPE_CHECKING:
+    from django.core.management.base import CommandParser
+
+
+class Command(BaseCommand):
+    help = (
+        "Flag all nodes to be embedded again by the embedding task, e.g. after switching the "
+        "embedding provider"
+    )
+
+    def add_arguments(self, parser: "CommandParser") -> None:
+        parser.add_argument(
+            "--delete-other",
+            action="store_true",
+            help="Delete the vectors of other embedders than the configured one.",
+        )
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        flagged = nodes.models.Node.all_objects.filter(embeddings_stale=False).update(
+            embeddings_stale=True
+        )
+        self.stdout.write(self.style.SUCCESS(f"Flagged {flagged} nodes to be embedded again."))
+
+        if options["delete_other"]:
+            deleted, _ = nodes.models.NodeEmbedding.objects.exclude(
+                embedder=embeddings.get_embedder().name
+            ).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} vectors of other embedders."))
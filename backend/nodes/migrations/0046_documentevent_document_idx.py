@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-17 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nodes", "0045_methodnode_run_permissions"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="documentevent",
+            index=models.Index(
+                fields=["public_id", "document_type"], name="documentevent_document_idx"
+            ),
+        ),
+    ]
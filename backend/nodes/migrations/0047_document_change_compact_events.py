@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-17 13:24
+
+import pgtrigger.compiler
+import pgtrigger.migrations
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nodes", "0046_documentevent_document_idx"),
+    ]
+
+    operations = [
+        pgtrigger.migrations.RemoveTrigger(
+            model_name="document",
+            name="document_change",
+        ),
+        pgtrigger.migrations.AddTrigger(
+            model_name="document",
+            trigger=pgtrigger.compiler.Trigger(
+                name="document_change",
+                sql=pgtrigger.compiler.UpsertTriggerSql(
+                    func="\n                    IF (TG_OP = 'INSERT') THEN\n                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (NEW.public_id, NEW.document_type, 'INSERT', NOW());\n                    ELSIF (TG_OP = 'UPDATE') THEN\n                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (NEW.public_id, NEW.document_type, 'UPDATE', NOW());\n                    ELSIF (TG_OP = 'DELETE') THEN\n                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (OLD.public_id, OLD.document_type, 'DELETE', NOW());\n                    END IF;\n                    PERFORM pg_notify('nodes_document_change', COALESCE(NEW.public_id, OLD.public_id)::text);\n                    RETURN NEW;\n                    ",
+                    hash="f467d6e60f170e096479390625c9ab601b8dfefc",
+                    operation="INSERT OR UPDATE OR DELETE",
+                    pgid="pgtrigger_document_change_b3491",
+                    table="nodes_document",
+                    when="AFTER",
+                ),
+            ),
+        ),
+    ]
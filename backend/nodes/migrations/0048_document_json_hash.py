@@ -0,0 +1,85 @@
+# Generated by Django 5.2.3 on 2026-10-17 13:34
+
+import pgtrigger.compiler
+import pgtrigger.migrations
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nodes", "0047_document_change_compact_events"),
+    ]
+
+    operations = [
+        pgtrigger.migrations.RemoveTrigger(
+            model_name="document",
+            name="document_change",
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="json_hash",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="last_versioned_hash",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+        pgtrigger.migrations.AddTrigger(
+            model_name="document",
+            trigger=pgtrigger.compiler.Trigger(
+                name="document_change",
+                sql=pgtrigger.compiler.UpsertTriggerSql(
+                    func="\n                    IF (TG_OP = 'INSERT') THEN\n                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (NEW.public_id, NEW.document_type, 'INSERT', NOW());\n                    ELSIF (TG_OP = 'UPDATE') THEN\n                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (NEW.public_id, NEW.document_type, 'UPDATE', NOW());\n                    ELSIF (TG_OP = 'DELETE') THEN\n                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (OLD.public_id, OLD.document_type, 'DELETE', NOW());\n                    END IF;\n                    PERFORM pg_notify('nodes_document_change', COALESCE(NEW.public_id, OLD.public_id)::text);\n                    RETURN NEW;\n                    ",
+                    hash="7b9757fbe3d8c98410ee1d36f050754aa6d4cbe8",
+                    operation='INSERT OR UPDATE OF "json" OR DELETE',
+                    pgid="pgtrigger_document_change_b3491",
+                    table="nodes_document",
+                    when="AFTER",
+                ),
+            ),
+        ),
+        pgtrigger.migrations.AddTrigger(
+            model_name="document",
+            trigger=pgtrigger.compiler.Trigger(
+                name="document_json_hash",
+                sql=pgtrigger.compiler.UpsertTriggerSql(
+                    func="\n                    NEW.json_hash := encode(sha256(convert_to(NEW.json::text, 'UTF8')), 'hex');\n                    RETURN NEW;\n                    ",
+                    hash="b56ab4a838a4bb638d43118efdc26db0c10b11dc",
+                    operation='INSERT OR UPDATE OF "json"',
+                    pgid="pgtrigger_document_json_hash_9e820",
+                    table="nodes_document",
+                    when="BEFORE",
+                ),
+            ),
+        ),
+        # Hash the existing documents and treat documents that didn't change since their last
+        # version as versioned. This doesn't trigger the `document_change` trigger anymore, since it
+        # only fires for updates of the JSON.
+        migrations.RunSQL(
+            sql=[
+                "UPDATE nodes_document "
+                "SET json_hash = encode(sha256(convert_to(json::text, 'UTF8')), 'hex')",
+                "UPDATE nodes_document AS document SET last_versioned_hash = document.json_hash "
+                "WHERE EXISTS (SELECT 1 FROM nodes_documentversion AS version "
+                "WHERE version.document_id = document.id AND NOT version.is_removed "
+                "AND version.created_at >= document.updated_at)",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="document",
+            index=models.Index(
+                condition=models.Q(
+                    ("json_hash", models.F("last_versioned_hash")), _negated=True
+                ),
+                fields=["id"],
+                name="document_unversioned_idx",
+            ),
+        ),
+    ]
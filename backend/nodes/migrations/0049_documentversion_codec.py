@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-17 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nodes", "0048_document_json_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentversion",
+            name="codec",
+            field=models.CharField(
+                choices=[("none", "None"), ("zstd", "Zstandard")],
+                default="none",
+                max_length=16,
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-17 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nodes", "0049_documentversion_codec"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="documentversion",
+            index=models.Index(
+                fields=["document", "-created_at"], name="documentversion_document_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="documentversion",
+            index=models.Index(
+                fields=["created_at"], name="documentversion_created_at_idx"
+            ),
+        ),
+    ]
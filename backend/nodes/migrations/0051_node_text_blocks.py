@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-17 14:01
+
+import pgtrigger.compiler
+import pgtrigger.migrations
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nodes", "0050_documentversion_indexes"),
+    ]
+
+    operations = [
+        pgtrigger.migrations.RemoveTrigger(
+            model_name="node",
+            name="node_update_search_vector",
+        ),
+        migrations.AddField(
+            model_name="node",
+            name="text_blocks",
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        pgtrigger.migrations.AddTrigger(
+            model_name="node",
+            trigger=pgtrigger.compiler.Trigger(
+                name="node_update_search_vector",
+                sql=pgtrigger.compiler.UpsertTriggerSql(
+                    func="\n                    IF TG_OP = 'INSERT' OR NEW.search_vector IS NULL\n                        OR NEW.title IS DISTINCT FROM OLD.title\n                        OR NEW.text IS DISTINCT FROM OLD.text THEN\n                        NEW.search_vector := setweight(to_tsvector('pg_catalog.english', coalesce(new.title,'')), 'A') || setweight(to_tsvector('pg_catalog.english', coalesce(new.text,'')), 'C');\n                    END IF;\n                    return NEW;\n                    ",
+                    hash="173696300a800787dccbaa909f2a5c4be6ea4f6b",
+                    operation="UPDATE OR INSERT",
+                    pgid="pgtrigger_node_update_search_vector_401f5",
+                    table="nodes_node",
+                    when="BEFORE",
+                ),
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-17 14:15
+
+from django.db import migrations
+
+# The index serves the case-insensitive substring and prefix lookups of the title typeahead
+# (`UPPER(title) LIKE UPPER(...)`). It needs the pg_trgm extension, which isn't available on every
+# server, so it's only created if the extension can be installed. Without it, the typeahead still
+# works with a sequential scan.
+CREATE_INDEX = """
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS node_title_trgm_idx
+            ON nodes_node USING gin (UPPER(title::text) gin_trgm_ops);
+    ELSE
+        RAISE NOTICE 'pg_trgm is not available, skipping node_title_trgm_idx';
+    END IF;
+END
+$$;
+"""
+
+DROP_INDEX = "DROP INDEX IF EXISTS node_title_trgm_idx;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nodes", "0051_node_text_blocks"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, reverse_sql=DROP_INDEX, elidable=False),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.3 on 2026-10-17 14:21
+
+import django.db.models.deletion
+import pgtrigger.compiler
+import pgtrigger.migrations
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nodes", "0052_node_title_trgm_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NodeEmbedding",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("chunk", models.PositiveIntegerField()),
+                ("embedder", models.CharField(max_length=255)),
+                ("text_hash", models.CharField(max_length=32)),
+                ("vector", models.BinaryField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        pgtrigger.migrations.RemoveTrigger(
+            model_name="node",
+            name="node_update_search_vector",
+        ),
+        migrations.AddField(
+            model_name="node",
+            name="embeddings_stale",
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="node",
+            index=models.Index(
+                condition=models.Q(("embeddings_stale", True)),
+                fields=["id"],
+                name="node_embeddings_stale_idx",
+            ),
+        ),
+        pgtrigger.migrations.AddTrigger(
+            model_name="node",
+            trigger=pgtrigger.compiler.Trigger(
+                name="node_update_search_vector",
+                sql=pgtrigger.compiler.UpsertTriggerSql(
+                    func="\n                    IF TG_OP = 'INSERT' OR NEW.search_vector IS NULL\n                        OR NEW.title IS DISTINCT FROM OLD.title\n                        OR NEW.text IS DISTINCT FROM OLD.text THEN\n                        NEW.search_vector := setweight(to_tsvector('pg_catalog.english', coalesce(new.title,'')), 'A') || setweight(to_tsvector('pg_catalog.english', coalesce(new.text,'')), 'C');\n                        NEW.embeddings_stale := true;\n                    END IF;\n                    return NEW;\n                    ",
+                    hash="8a1ec9980aba9ed3b2eed657e6385c6f638a0d04",
+                    operation="UPDATE OR INSERT",
+                    pgid="pgtrigger_node_update_search_vector_401f5",
+                    table="nodes_node",
+                    when="BEFORE",
+                ),
+            ),
+        ),
+        migrations.AddField(
+            model_name="nodeembedding",
+            name="node",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="embeddings",
+                to="nodes.node",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="nodeembedding",
+            constraint=models.UniqueConstraint(
+                fields=("node", "embedder", "chunk"), name="nodeembedding_unique_chunk"
+            ),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 import typing
 import uuid
 from collections import OrderedDict, defaultdict
@@ -15,7 +16,8 @@ from django.contrib.postgres import indexes as pg_indexes
 from django.contrib.postgres import search as pg_search
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.core.cache import cache
+from django.db import connection, models, transaction
 from django.db.models import Q
 from django.db.models.functions import Coalesce
 
@@ -25,7 +27,7 @@ import permissions.models
 import permissions.utils
 import utils.models
 from config.celery_app import app
-from utils import tokens
+from utils import compression, tokens
 
 if typing.TYPE_CHECKING:
     from django import http
@@ -35,6 +37,31 @@ if typing.TYPE_CHECKING:
 
 PG_NOTIFY_CHANNEL = "nodes_document_change"
 
+# The cache keys of the space IDs per user and action, see `Space.get_space_ids_for_user`. Cached
+# IDs are only valid for the current version, changing it invalidates the IDs of all users.
+SPACE_IDS_CACHE_KEY = "nodes:space_ids:{user}:{action}"
+SPACE_IDS_CACHE_VERSION_KEY = "nodes:space_ids:version"
+NODE_CONTEXT_CACHE_KEY = "nodes:context:{node}:{depth}:{edges}"
+NODE_CONTEXT_CACHE_VERSION_KEY = "nodes:context:version:{node}"
+# Changes to these fields change the context of the node and of the nodes above it.
+NODE_CONTEXT_FIELDS = frozenset({"title", "text", "description", "is_removed"})
+
+# The minimum depth of the available nodes below a node, up to a maximum depth. UNION drops
+# duplicate (node, depth) rows, so cycles and diamonds in the graph don't multiply the rows of a
+# level, and the depth limit ends the recursion.
+SUBNODE_DEPTHS_SQL = """
+WITH RECURSIVE subgraph (node_id, depth) AS (
+    SELECT %(root)s::bigint, 0
+    UNION
+    SELECT edge.to_node_id, subgraph.depth + 1
+    FROM subgraph
+    JOIN {edges} edge ON edge.from_node_id = subgraph.node_id
+    JOIN {nodes} node ON node.id = edge.to_node_id AND NOT node.is_removed
+    WHERE subgraph.depth < %(depth)s
+)
+SELECT node_id, MIN(depth) FROM subgraph WHERE node_id <> %(root)s GROUP BY node_id
+"""
+
 
 class DocumentType(models.TextChoices):
     EDITOR = "EDITOR", "Editor"
@@ -70,6 +97,8 @@ class DocumentEvent(models.Model):
     public_id = models.UUIDField(editable=False)
     document_type = models.CharField(max_length=255, choices=DocumentType.choices)
     action = models.CharField(max_length=255, choices=EventType.choices)
+    # The data is only set on events recorded before events were made compact, newer events
+    # read the current data of the document when they are processed.
     old_data = models.JSONField(null=True, blank=True)
     new_data = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -77,6 +106,12 @@ class DocumentEvent(models.Model):
     def __str__(self) -> str:
         return f"{self.public_id} - {self.action.title()}"
 
+    class Meta:
+        indexes = [
+            # Used to find newer events for the same document when coalescing events.
+            models.Index(fields=["public_id", "document_type"], name="documentevent_document_idx"),
+        ]
+
 
 class BaseNode(utils.models.SoftDeletableBaseModel):
     title = models.TextField(null=True, default=None)
@@ -167,6 +202,14 @@ class Node(BaseNode):
         "Document", on_delete=models.SET_NULL, null=True, blank=True, related_name="%(class)s_graph"
     )
 
+    # The hash and token count of each top-level block of `content`, so that only changed blocks
+    # have to be counted again when the content changes, see `update_text`.
+    text_blocks = models.JSONField(default=list, blank=True, editable=False)
+
+    # Set by the `node_update_search_vector` trigger when the title or text changes, the node is
+    # embedded again by `nodes.tasks.update_node_embeddings`.
+    embeddings_stale = models.BooleanField(default=True, editable=False)
+
     tracker = model_utils.FieldTracker()
 
     @staticmethod
@@ -305,6 +348,20 @@ class Node(BaseNode):
         )
         return Coalesce(role_subquery.values("roles"), public_subquery)
 
+    @staticmethod
+    def get_user_roles(
+        nodes: typing.Iterable["Node"], user: "user_typing.AnyUserType"
+    ) -> dict[int, list[str]]:
+        """
+        Return the roles of the user per primary key of the given nodes, which are their roles on
+        the spaces of the nodes (see `Space.get_user_roles`). The spaces should be loaded with the
+        nodes, e.g. with `select_related("space")`.
+        """
+        nodes = list(nodes)
+        spaces = {node.space_id: node.space for node in nodes if node.space_id}
+        roles = Space.get_user_roles(spaces.values(), user)
+        return {node.pk: roles.get(node.space_id, []) for node in nodes}
+
     @staticmethod
     def __add_to_update_fields(
         update_fields: typing.Iterable[str] | None, *fields: str
@@ -319,6 +376,74 @@ class Node(BaseNode):
     def __is_updated(update_fields: typing.Iterable[str] | None, field: str) -> bool:
         return update_fields is None or field in update_fields
 
+    def update_computed_fields(
+        self, update_fields: typing.Iterable[str] | None = None
+    ) -> list[str]:
+        """
+        Recalculate the automatically managed fields for the tracked fields that have changed and
+        return the names of the fields that were updated.
+        This is called by `save`, but can also be used before bulk writes, which bypass `save`.
+        """
+        computed_fields: list[str] = []
+        # The token counts of the changed fields are counted in one batch at the end.
+        count_fields: dict[str, str | None] = {}
+        if self.tracker.has_changed("content") and self.__is_updated(update_fields, "content"):
+            self.update_text()
+            computed_fields.extend(["text", "text_token_count", "text_blocks"])
+        if self.tracker.has_changed("title") and self.__is_updated(update_fields, "title"):
+            count_fields["title_token_count"] = self.title
+        if self.tracker.has_changed("description") and self.__is_updated(
+            update_fields, "description"
+        ):
+            count_fields["description_token_count"] = self.description
+
+        if count_fields:
+            for field, count in zip(
+                count_fields, tokens.token_counts(list(count_fields.values())), strict=True
+            ):
+                setattr(self, field, count)
+            computed_fields.extend(count_fields)
+        return computed_fields
+
+    def update_text(self) -> None:
+        """
+        Update `text` and `text_token_count` from `content`.
+
+        Only the blocks that aren't in `text_blocks` yet are counted, the counts of unchanged
+        blocks are reused. Every block but the first is counted with the space it's joined with,
+        so the sum matches counting the whole text, except for runs of whitespace at the block
+        boundaries, which can be off by a token.
+        """
+        blocks = nodes.utils.extract_text_blocks(self.content)
+        self.text = " ".join(blocks)
+
+        block_texts = [block if i == 0 else f" {block}" for i, block in enumerate(blocks)]
+        keys = [hashlib.blake2b(text.encode(), digest_size=8).hexdigest() for text in block_texts]
+        counts: dict[str, int] = dict(self.text_blocks or [])
+        changed = [i for i, key in enumerate(keys) if key not in counts]
+        for i, count in zip(
+            changed, tokens.token_counts([block_texts[i] for i in changed]), strict=True
+        ):
+            counts[keys[i]] = typing.cast("int", count)
+
+        self.text_blocks = [[key, counts[key]] for key in keys]
+        self.text_token_count = sum(counts[key] for key in keys)
+
+    def has_unsaved_changes(self, update_fields: typing.Iterable[str] | None = None) -> bool:
+        """
+        Return whether saving the given (by default all) fields would change the stored row.
+        Fields that aren't tracked, like the fields of `MethodNode`, are assumed to have changed.
+        """
+        if self._state.adding:
+            return True
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields]
+        for field_name in update_fields:
+            attname = self._meta.get_field(field_name).attname
+            if attname not in self.tracker.fields or self.tracker.has_changed(attname):
+                return True
+        return False
+
     def save(
         self,
         force_insert: bool = False,  # type: ignore[override] # I can't see what's wrong with this.
@@ -326,29 +451,26 @@ class Node(BaseNode):
         using: str | None = None,
         update_fields: typing.Iterable[str] | None = None,
     ) -> None:
-        add_to_update_fields: list[str] = []
-        if self.tracker.has_changed("content") and self.__is_updated(update_fields, "content"):
-            self.text = " ".join(nodes.utils.extract_text_from_node(self.content))
-            add_to_update_fields.append("text")
-            self.text_token_count = tokens.token_count(self.text)
-            add_to_update_fields.append("text_token_count")
-        if self.tracker.has_changed("title") and self.__is_updated(update_fields, "title"):
-            self.title_token_count = tokens.token_count(self.title)
-            add_to_update_fields.append("title_token_count")
-        if self.tracker.has_changed("description") and self.__is_updated(
-            update_fields, "description"
-        ):
-            self.description_token_count = tokens.token_count(self.description)
-            add_to_update_fields.append("description_token_count")
+        if not force_insert and not self.has_unsaved_changes(update_fields):
+            # Nothing to write, this avoids a dead tuple and the search vector trigger.
+            return None
 
+        add_to_update_fields = self.update_computed_fields(update_fields)
         update_fields = self.__add_to_update_fields(update_fields, *add_to_update_fields)
 
         return super().save(force_insert, force_update, using, update_fields)
 
     def node_as_str(
-        self, include_content: bool, include_connections: bool, edges: dict | None = None
+        self,
+        include_content: bool,
+        include_connections: bool,
+        edges: dict | None = None,
+        subnode_ids: typing.Sequence[uuid.UUID] | None = None,
     ) -> str:
-        """Return a string representation of the node."""
+        """
+        Return a string representation of the node. The public IDs of the subnodes for the
+        connections are queried unless they are given as `subnode_ids`.
+        """
         if edges is None:
             edges = {}
         single_line_title = self.title.replace("\n", " ").replace("\r", " ") if self.title else ""
@@ -363,7 +485,9 @@ class Node(BaseNode):
             if single_line_description:
                 node_str += f"\n - Description: {single_line_description}"
         if include_connections:
-            if subnode_ids := self.subnodes.values_list("public_id", flat=True):
+            if subnode_ids is None:
+                subnode_ids = self.subnodes.values_list("public_id", flat=True)
+            if subnode_ids:
                 node_str += f"\n - Connects to: {', '.join(map(str, subnode_ids))}"
 
         if str(self.public_id) in edges:
@@ -374,25 +498,50 @@ class Node(BaseNode):
 
         return node_str
 
+    @staticmethod
+    def get_subnode_public_ids(node_ids: typing.Iterable[int]) -> dict[int, list[uuid.UUID]]:
+        """Return the public IDs of the subnodes per node for the given nodes, with one query."""
+        subnode_ids: dict[int, list[uuid.UUID]] = defaultdict(list)
+        for from_node_id, public_id in (
+            Node.subnodes.through.objects.filter(from_node_id__any=list(node_ids))
+            .order_by("pk")
+            .values_list("from_node_id", "to_node__public_id")
+        ):
+            subnode_ids[from_node_id].append(public_id)
+        return subnode_ids
+
     def fetch_subnodes(self, depth: int) -> dict[int, list["Node"]]:
-        """Fetch subnodes of a node and return then by depth."""
-        nodes_at_depth = {0: [self]}
-        for i in range(1, depth + 1):
-            subnodes = Node.available_objects.filter(
-                parents__in=nodes_at_depth[i - 1]
-            ).prefetch_related("subnodes")
-            if not subnodes:
-                break
-            nodes_at_depth[i] = list(subnodes)
-        return nodes_at_depth
+        """
+        Fetch the subnodes of a node up to the given depth and return them by depth. Every node is
+        only returned at the smallest depth it is found at, with the fields used for the context.
+        The depths are resolved with one recursive query and the nodes loaded with a second one.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SUBNODE_DEPTHS_SQL.format(
+                    edges=Node.subnodes.through._meta.db_table, nodes=Node._meta.db_table
+                ),
+                {"root": self.pk, "depth": depth},
+            )
+            depths: dict[int, int] = dict(cursor.fetchall())
 
-    def node_context_for_depth(
-        self,
-        query_depth: int,
-        nodes_at_depth: dict[int, list["Node"]] | None = None,
-        include_edges: bool = False,
-    ) -> str:
-        """Get the context of a node for a certain depth."""
+        nodes_at_depth: dict[int, list[Node]] = {0: [self]}
+        subnodes = (
+            Node.available_objects.filter(pk__any=list(depths))
+            .only("id", "public_id", "title", "text", "description")
+            .order_by("pk")
+        )
+        for subnode in subnodes:
+            nodes_at_depth.setdefault(depths[subnode.pk], []).append(subnode)
+        return dict(sorted(nodes_at_depth.items()))
+
+    def context_nodes_for_depth(
+        self, query_depth: int, nodes_at_depth: dict[int, list["Node"]] | None = None
+    ) -> list[tuple["Node", bool, bool]]:
+        """
+        Return the nodes of the context of a node for a certain depth in the order they appear in,
+        with whether their content and their connections are included.
+        """
         node_depth = (query_depth // 2) + 1
         if nodes_at_depth:
             nodes_at_depth = {
@@ -403,8 +552,34 @@ class Node(BaseNode):
 
         ignore_content_at_depth = node_depth if query_depth % 2 == 0 else None
 
-        nodes_added: "dict[uuid.UUID, tuple[bool, bool]]" = {}
-        context_nodes: "dict[uuid.UUID, str]" = OrderedDict()
+        # The nodes by public ID, insertion order preserves the original order (context closer to
+        # the initial node comes first).
+        context_nodes: "dict[uuid.UUID, tuple[Node, bool, bool]]" = OrderedDict()
+        for depth, _nodes in nodes_at_depth.items():
+            include_content = depth != ignore_content_at_depth
+            for node in _nodes:
+                # Check if the node is already added to the context, if so, with what settings.
+                _, set_include_content, set_include_connections = context_nodes.get(
+                    node.public_id, (node, False, False)
+                )
+
+                # Calculate the new settings for the node, to provide as much context as possible.
+                context_nodes[node.public_id] = (
+                    node,
+                    set_include_content or include_content,
+                    (set_include_connections or depth != node_depth) and query_depth > 1,
+                )
+
+        return list(context_nodes.values())
+
+    def node_context_for_depth(
+        self,
+        query_depth: int,
+        nodes_at_depth: dict[int, list["Node"]] | None = None,
+        include_edges: bool = False,
+    ) -> str:
+        """Get the context of a node for a certain depth."""
+        context_nodes = self.context_nodes_for_depth(query_depth, nodes_at_depth)
 
         edges = defaultdict(list)
         if include_edges and self.graph_document and "edges" in self.graph_document.json:
@@ -412,35 +587,75 @@ class Node(BaseNode):
             for edge in raw_edges.values():
                 edges[edge["source"]].append(edge["target"])
 
-        for depth, _nodes in nodes_at_depth.items():
-            include_content = depth != ignore_content_at_depth
-            for node in _nodes:
-                # Check if the node is already added to the context, if so, with what settings.
-                set_include_content, set_include_connections = nodes_added.get(
-                    node.public_id, (False, False)
-                )
+        # The connections of the whole subgraph are fetched up front instead of per node.
+        subnode_ids: dict[int, list[uuid.UUID]] = {}
+        if query_depth > 1:
+            subnode_ids = Node.get_subnode_public_ids(
+                node.pk for node, _, include_connections in context_nodes if include_connections
+            )
 
-                # Calculate the new settings for the node, to provide as much context as possible.
-                new_include_content = set_include_content or include_content
-                new_include_connections = (
-                    set_include_connections or depth != node_depth
-                ) and query_depth > 1
+        return "".join(
+            node.node_as_str(
+                include_content=include_content,
+                include_connections=include_connections,
+                edges=edges,
+                subnode_ids=subnode_ids.get(node.pk, []),
+            )
+            + "\n"
+            for node, include_content, include_connections in context_nodes
+        )
 
-                # Save the new settings for the node.
-                nodes_added[node.public_id] = (new_include_content, new_include_connections)
+    def get_cached_context(self, query_depth: int, include_edges: bool = False) -> str:
+        """
+        Return the context of `node_context_for_depth`.
+        The context is cached for `NODE_CONTEXT_CACHE_TIMEOUT` seconds together with the version of
+        every node in its subgraph and is rebuilt as soon as one of those versions changes, see
+        `invalidate_context_cache`.
+        """
+        key = NODE_CONTEXT_CACHE_KEY.format(
+            node=self.pk, depth=query_depth, edges=int(include_edges)
+        )
+        if (cached := cache.get(key)) is not None:
+            context, versions = cached
+            if cache.get_many(list(versions)) == versions:
+                return context
+
+        nodes_at_depth = self.fetch_subnodes((query_depth // 2) + 1)
+        version_keys = [
+            NODE_CONTEXT_CACHE_VERSION_KEY.format(node=node.pk)
+            for _nodes in nodes_at_depth.values()
+            for node in _nodes
+        ]
+        # The versions are read before the context is built, so that a change in the meantime
+        # invalidates the context right away.
+        versions = cache.get_many(version_keys)
+        if missing := {key: uuid.uuid4().hex for key in version_keys if key not in versions}:
+            cache.set_many(missing, settings.NODE_CONTEXT_CACHE_TIMEOUT)
+            versions.update(missing)
 
-                # Add node context to the OrderedDict to preserve the original order (context
-                # closer to the initial node comes first).
-                context_nodes[node.public_id] = (
-                    node.node_as_str(
-                        include_content=new_include_content,
-                        include_connections=new_include_connections,
-                        edges=edges,
-                    )
-                    + "\n"
-                )
+        context = self.node_context_for_depth(query_depth, nodes_at_depth, include_edges)
+        cache.set(key, (context, versions), settings.NODE_CONTEXT_CACHE_TIMEOUT)
+        return context
 
-        return "".join(context_nodes.values())
+    @staticmethod
+    def invalidate_context_cache(node_ids: typing.Iterable[int]) -> None:
+        """
+        Invalidate the cached contexts of `get_cached_context` that include any of the given nodes.
+        This is called by signals when the title, text, description or subnodes of a node change
+        and by the document event processing for bulk updates.
+        The cache is invalidated right away and again after the transaction is committed, so that
+        contexts cached by other requests in the meantime don't outlive the change.
+        """
+        keys = [NODE_CONTEXT_CACHE_VERSION_KEY.format(node=node_id) for node_id in set(node_ids)]
+        if not keys:
+            return
+
+        def invalidate() -> None:
+            cache.delete_many(keys)
+
+        invalidate()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(invalidate)
 
     @staticmethod
     def has_read_permission(request: "http.HttpRequest") -> bool:
@@ -490,6 +705,9 @@ class Node(BaseNode):
         indexes = utils.models.SoftDeletableBaseModel.Meta.indexes + [
             pg_indexes.GinIndex("search_vector", name="search_vector_idx"),
             models.Index(fields=["is_removed"], name="node_is_removed_idx"),
+            models.Index(
+                fields=["id"], condition=Q(embeddings_stale=True), name="node_embeddings_stale_idx"
+            ),
         ]
         triggers = [
             pgtrigger.Trigger(
@@ -498,7 +716,12 @@ class Node(BaseNode):
                 when=pgtrigger.Before,
                 func=pgtrigger.Func(
                     """
-                    NEW.search_vector := setweight(to_tsvector('pg_catalog.english', coalesce(new.title,'')), 'A') || setweight(to_tsvector('pg_catalog.english', coalesce(new.text,'')), 'C');
+                    IF TG_OP = 'INSERT' OR NEW.search_vector IS NULL
+                        OR NEW.title IS DISTINCT FROM OLD.title
+                        OR NEW.text IS DISTINCT FROM OLD.text THEN
+                        NEW.search_vector := setweight(to_tsvector('pg_catalog.english', coalesce(new.title,'')), 'A') || setweight(to_tsvector('pg_catalog.english', coalesce(new.text,'')), 'C');
+                        NEW.embeddings_stale := true;
+                    END IF;
                     return NEW;
                     """  # noqa: E501
                 ),
@@ -673,11 +896,41 @@ class DocumentVersion(utils.models.SoftDeletableBaseModel):
     document_type = models.CharField(max_length=255, choices=DocumentType.choices)
     document = models.ForeignKey("Document", on_delete=models.CASCADE, related_name="versions")
     json_hash = models.CharField(max_length=255)
+    # The CRDT data, compressed with `codec`. Use `get_data` and `set_data` to access it.
     data = models.BinaryField()
+    codec = models.CharField(
+        max_length=16, choices=compression.Codec.choices, default=compression.Codec.NONE
+    )
 
     def __str__(self) -> str:
         return f"{self.document.public_id} - {self.created_at}"
 
+    def get_data(self) -> bytes:
+        """Return the uncompressed CRDT data."""
+        return compression.decompress(self.data, self.codec)
+
+    def get_data_size(self) -> int:
+        """Return the size of the uncompressed CRDT data."""
+        return compression.decompressed_size(self.data, self.codec)
+
+    def iter_data(
+        self, start: int = 0, stop: int | None = None, chunk_size: int = 64 * 1024
+    ) -> typing.Iterator[bytes]:
+        """Yield the uncompressed CRDT data from `start` to `stop` (exclusive) in chunks."""
+        return compression.iter_decompress(self.data, self.codec, start, stop, chunk_size)
+
+    def set_data(self, data: bytes, codec: str | None = None) -> None:
+        """Compress the CRDT data with the given codec (by default `NODE_VERSIONING_CODEC`)."""
+        self.codec = codec or settings.NODE_VERSIONING_CODEC
+        self.data = compression.compress(data, self.codec)
+
+    class Meta(utils.models.SoftDeletableBaseModel.Meta):
+        indexes = utils.models.SoftDeletableBaseModel.Meta.indexes + [
+            # Used to find the latest versions of a document and to thin out versions by age.
+            models.Index(fields=["document", "-created_at"], name="documentversion_document_idx"),
+            models.Index(fields=["created_at"], name="documentversion_created_at_idx"),
+        ]
+
     @staticmethod
     def has_read_permission(request: "http.HttpRequest") -> bool:
         """
@@ -704,6 +957,34 @@ class DocumentVersion(utils.models.SoftDeletableBaseModel):
         return self.document.has_object_write_permission(request)
 
 
+class NodeEmbedding(models.Model):
+    """
+    The vector of a chunk of the title and text of a node, used for the semantic search.
+    Vectors are computed asynchronously by `nodes.tasks.update_node_embeddings`, see
+    `nodes.embeddings`.
+    """
+
+    node = models.ForeignKey("Node", on_delete=models.CASCADE, related_name="embeddings")
+    chunk = models.PositiveIntegerField()
+    # The name of the `utils.embeddings.Embedder` that computed the vector.
+    embedder = models.CharField(max_length=255)
+    # A hash of the embedded text, so that unchanged chunks aren't embedded again.
+    text_hash = models.CharField(max_length=32)
+    # The L2-normalized vector as float32 bytes.
+    vector = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.node_id} - {self.chunk}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["node", "embedder", "chunk"], name="nodeembedding_unique_chunk"
+            )
+        ]
+
+
 class Space(permissions.models.MembershipBaseModel):
     title = models.CharField(max_length=255)
     default_node = models.ForeignKey(
@@ -718,6 +999,9 @@ class Space(permissions.models.MembershipBaseModel):
         "Document", on_delete=models.SET_NULL, null=True, blank=True, related_name="space"
     )
 
+    # Changes to these fields change who can access the space, see `invalidate_space_ids_cache`.
+    tracker = model_utils.FieldTracker(fields=["is_public", "is_public_writable", "is_removed"])
+
     # Manually annotating reverse relations that are not automatically detected.
     # See: https://github.com/typeddjango/django-stubs/issues/1354
     nodes: "RelatedManager[Node]"
@@ -770,6 +1054,60 @@ class Space(permissions.models.MembershipBaseModel):
 
         raise ValueError("Invalid action type.")
 
+    @staticmethod
+    def get_space_ids_for_user(
+        action: permissions.models.Action, user: "user_typing.AnyUserType | None" = None
+    ) -> list[int]:
+        """
+        Return the primary keys of the available spaces the user has permission to do <action> on.
+        Filtering by these IDs avoids joining the memberships into queries over the contents of
+        spaces, which produces duplicate rows that need a DISTINCT.
+        The IDs are cached per user and action for `SPACE_IDS_CACHE_TIMEOUT` seconds, see
+        `invalidate_space_ids_cache` for when they are invalidated.
+        """
+        user = user or AnonymousUser()
+        key = SPACE_IDS_CACHE_KEY.format(user=user.pk or "anonymous", action=action)
+        cached = cache.get_many([SPACE_IDS_CACHE_VERSION_KEY, key])
+        version = cached.get(SPACE_IDS_CACHE_VERSION_KEY)
+        if version is not None and key in cached and cached[key][0] == version:
+            return cached[key][1]
+
+        if version is None:
+            cache.add(SPACE_IDS_CACHE_VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(SPACE_IDS_CACHE_VERSION_KEY)
+        space_ids = list(
+            Space.available_objects.filter(Space.get_user_has_permission_filter(action, user))
+            .values_list("pk", flat=True)
+            .distinct()
+        )
+        cache.set(key, (version, space_ids), settings.SPACE_IDS_CACHE_TIMEOUT)
+        return space_ids
+
+    @staticmethod
+    def invalidate_space_ids_cache(user_id: int | None = None) -> None:
+        """
+        Invalidate the cached space IDs of `get_space_ids_for_user` for the given user, or for all
+        users if no user is given. This is called by signals when memberships in spaces change and
+        when spaces are made (non-)public or are removed, but not for bulk updates.
+        The cache is invalidated right away and again after the transaction is committed, so that
+        IDs cached by other requests in the meantime don't outlive the change.
+        """
+
+        def invalidate() -> None:
+            if user_id is None:
+                cache.set(SPACE_IDS_CACHE_VERSION_KEY, uuid.uuid4().hex, None)
+            else:
+                cache.delete_many(
+                    [
+                        SPACE_IDS_CACHE_KEY.format(user=user_id, action=action)
+                        for action in typing.get_args(permissions.models.Action)
+                    ]
+                )
+
+        invalidate()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(invalidate)
+
     @staticmethod
     def get_role_annotation_query(user: "user_typing.AnyUserType") -> Coalesce | models.Case:
         # TODO: This can probably be simplified more, since the roles for spaces are much simpler,
@@ -865,6 +1203,11 @@ class Document(models.Model):
 
     data = models.BinaryField()
     json = models.JSONField()
+    # The SHA-256 hash of the JSON, maintained by the `document_json_hash` trigger since the CRDT
+    # server writes to this table directly.
+    json_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
+    # The hash of the JSON when the last version was created, empty if there is no version yet.
+    last_versioned_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -878,25 +1221,48 @@ class Document(models.Model):
                 name="nodes_document_unique_public_id_and_type",
             )
         ]
+        indexes = [
+            # Used to find documents that changed since their last version.
+            models.Index(
+                fields=["id"],
+                condition=~models.Q(json_hash=models.F("last_versioned_hash")),
+                name="document_unversioned_idx",
+            )
+        ]
+        # Events only record which document changed, the data is read from the document when the
+        # event is processed. The public ID is sent as the notification payload, so listeners can
+        # dispatch the right partition without querying the events. Updates that don't touch the
+        # JSON (e.g. when a version is created) don't create events.
         triggers = [
             pgtrigger.Trigger(
                 name="document_change",
-                operation=pgtrigger.Insert | pgtrigger.Update | pgtrigger.Delete,
+                operation=pgtrigger.Insert | pgtrigger.UpdateOf("json") | pgtrigger.Delete,
                 when=pgtrigger.After,
                 func=pgtrigger.Func(
                     f"""
                     IF (TG_OP = 'INSERT') THEN
-                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at, new_data) VALUES (NEW.public_id, NEW.document_type, '{DocumentEvent.EventType.INSERT}', NOW(), NEW.json);
+                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (NEW.public_id, NEW.document_type, '{DocumentEvent.EventType.INSERT}', NOW());
                     ELSIF (TG_OP = 'UPDATE') THEN
-                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at, old_data, new_data) VALUES (NEW.public_id, NEW.document_type, '{DocumentEvent.EventType.UPDATE}', NOW(), OLD.json, NEW.json);
+                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (NEW.public_id, NEW.document_type, '{DocumentEvent.EventType.UPDATE}', NOW());
                     ELSIF (TG_OP = 'DELETE') THEN
-                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at, old_data) VALUES (OLD.public_id, OLD.document_type, '{DocumentEvent.EventType.DELETE}', NOW(), OLD.json);
+                        INSERT INTO nodes_documentevent (public_id, document_type, action, created_at) VALUES (OLD.public_id, OLD.document_type, '{DocumentEvent.EventType.DELETE}', NOW());
                     END IF;
-                    NOTIFY {PG_NOTIFY_CHANNEL};
+                    PERFORM pg_notify('{PG_NOTIFY_CHANNEL}', COALESCE(NEW.public_id, OLD.public_id)::text);
                     RETURN NEW;
                     """  # noqa: E501
                 ),
-            )
+            ),
+            pgtrigger.Trigger(
+                name="document_json_hash",
+                operation=pgtrigger.Insert | pgtrigger.UpdateOf("json"),
+                when=pgtrigger.Before,
+                func=pgtrigger.Func(
+                    """
+                    NEW.json_hash := encode(sha256(convert_to(NEW.json::text, 'UTF8')), 'hex');
+                    RETURN NEW;
+                    """
+                ),
+            ),
         ]
 
     @staticmethod
@@ -75,12 +75,19 @@ class NodeSearchResultSerializer(utils.serializers.BaseSoftDeletableSerializer[m
     image_2x = serializers.ImageField(read_only=True)
     image_thumbnail = serializers.ImageField(read_only=True)
     image_thumbnail_2x = serializers.ImageField(read_only=True)
+    headline = serializers.SerializerMethodField()
+
+    def get_headline(self, obj: models.Node) -> str | None:
+        """The text with the matches highlighted, only set if requested."""
+        return getattr(obj, "headline", None)
 
     class Meta(utils.serializers.BaseSoftDeletableSerializer.Meta):
         model = models.Node
         exclude = (utils.serializers.BaseSoftDeletableSerializer.Meta.exclude or []) + [
             "content",
             "text",
+            "text_blocks",
+            "embeddings_stale",
             "graph_document",
             "editor_document",
             "subnodes",
@@ -93,8 +100,8 @@ class AvailableSpaceField(utils.serializers.PublicIdRelatedField):
     def get_queryset(self) -> "django_models.QuerySet[models.Space]":
         user = self.context["request"].user
         return models.Space.available_objects.filter(
-            models.Space.get_user_has_permission_filter(action=permissions.models.READ, user=user)
-        ).distinct()
+            pk__any=models.Space.get_space_ids_for_user(permissions.models.READ, user)
+        )
 
 
 @extend_schema_field(uuid.UUID)
@@ -175,6 +182,54 @@ class NodeSearchQuerySerializer(serializers.Serializer):
     q = serializers.CharField(required=True)
     space = AvailableSpaceField(required=False)
     node_type = serializers.ChoiceField(required=False, choices=models.NodeType.choices)
+    mode = serializers.ChoiceField(
+        required=False,
+        default="plain",
+        choices=[("plain", "Plain"), ("websearch", "Websearch")],
+        help_text=(
+            "How the query is parsed: `plain` matches all words, `websearch` supports quoted "
+            'phrases, "or" and -excluded words like web search engines.'
+        ),
+    )
+    highlight = serializers.BooleanField(
+        required=False,
+        default=False,
+        help_text="Whether to return a snippet of the text with the matches highlighted.",
+    )
+    cursor = serializers.CharField(
+        required=False,
+        allow_blank=True,
+        help_text=(
+            "Paginate with a cursor over (rank, ID) instead of `offset`, which costs the same for "
+            "every page. Pass an empty cursor for the first page and follow the `next` links."
+        ),
+    )
+
+
+class NodeTypeaheadQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(required=True, max_length=255)
+    space = AvailableSpaceField(required=False)
+    node_type = serializers.ChoiceField(required=False, choices=models.NodeType.choices)
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=50)
+
+
+class NodeTypeaheadResultSerializer(serializers.Serializer):
+    id = serializers.UUIDField(source="public_id", read_only=True)
+    title = serializers.CharField(read_only=True)
+    node_type = serializers.ChoiceField(choices=models.NodeType.choices, read_only=True)
+    space = serializers.UUIDField(source="space__public_id", allow_null=True, read_only=True)
+
+
+class NodeSemanticSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(required=True)
+    space = AvailableSpaceField(required=False)
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=50)
+
+
+class NodeSemanticSearchResultSerializer(NodeTypeaheadResultSerializer):
+    score = serializers.FloatField(
+        read_only=True, help_text="The cosine similarity of the most similar chunk of the node."
+    )
 
 
 class SpaceDefaultNodeField(utils.serializers.PublicIdRelatedField):
@@ -213,6 +268,7 @@ class DocumentVersionSerializer(
         exclude = (utils.serializers.BaseSoftDeletableSerializer.Meta.exclude or []) + [
             "data",
             "json_hash",
+            "codec",
         ]
 
 
@@ -242,6 +298,8 @@ class MethodNodeListSerializer(utils.serializers.BaseSoftDeletableSerializer[mod
         exclude = (utils.serializers.BaseSoftDeletableSerializer.Meta.exclude or []) + [
             "content",
             "text",
+            "text_blocks",
+            "embeddings_stale",
             "graph_document",
             "editor_document",
             "image_original",
@@ -2,9 +2,15 @@ import typing
 
 from celery import signals
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.db import close_old_connections
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django_celery_beat.models import IntervalSchedule, PeriodicTask
 
+from nodes.models import NODE_CONTEXT_FIELDS, Node, Space
+from permissions.models import ObjectMembership, ObjectMembershipRole
+
 
 @signals.after_setup_task_logger.connect
 def create_periodic_tasks(sender: typing.Any, **kwargs: typing.Any) -> None:
@@ -42,8 +48,117 @@ def create_periodic_tasks(sender: typing.Any, **kwargs: typing.Any) -> None:
         },
     )
 
+    # Create a schedule for the document version retention task
+    try:
+        schedule, created = IntervalSchedule.objects.get_or_create(
+            every=settings.NODE_VERSIONING_RETENTION_TASK_INTERVAL, period=IntervalSchedule.SECONDS
+        )
+    except IntervalSchedule.MultipleObjectsReturned:
+        schedule = IntervalSchedule.objects.filter(
+            every=settings.NODE_VERSIONING_RETENTION_TASK_INTERVAL, period=IntervalSchedule.SECONDS
+        ).first()
+
+    # Associate this schedule with the task
+    PeriodicTask.objects.update_or_create(
+        task=settings.NODE_VERSIONING_RETENTION_TASK,
+        defaults={
+            "interval": schedule,
+            "name": "Thin out document versions every "
+            f"{settings.NODE_VERSIONING_RETENTION_TASK_INTERVAL} seconds",
+        },
+    )
+
+    # Create a schedule for the node embedding task
+    try:
+        schedule, created = IntervalSchedule.objects.get_or_create(
+            every=settings.NODE_EMBEDDINGS_TASK_INTERVAL, period=IntervalSchedule.SECONDS
+        )
+    except IntervalSchedule.MultipleObjectsReturned:
+        schedule = IntervalSchedule.objects.filter(
+            every=settings.NODE_EMBEDDINGS_TASK_INTERVAL, period=IntervalSchedule.SECONDS
+        ).first()
+
+    # Associate this schedule with the task
+    PeriodicTask.objects.update_or_create(
+        task=settings.NODE_EMBEDDINGS_TASK,
+        defaults={
+            "interval": schedule,
+            "name": f"Embed changed nodes every {settings.NODE_EMBEDDINGS_TASK_INTERVAL} seconds",
+        },
+    )
+
 
 # TODO: This should probably live in another place, not in a specific app.
 @signals.task_postrun.connect
 def close_old_database_connections(sender: typing.Any, **kwargs: typing.Any) -> None:
     close_old_connections()
+
+
+@receiver(
+    post_save, sender=ObjectMembership, dispatch_uid="invalidate_space_ids_on_membership_save"
+)
+@receiver(
+    post_delete, sender=ObjectMembership, dispatch_uid="invalidate_space_ids_on_membership_delete"
+)
+def invalidate_space_ids_on_membership_change(
+    sender: typing.Any, instance: ObjectMembership, **kwargs: typing.Any
+) -> None:
+    """Invalidate the cached space IDs of the user when their membership in a space changes."""
+    if instance.content_type_id == ContentType.objects.get_for_model(Space).pk:
+        Space.invalidate_space_ids_cache(instance.user_id)
+
+
+@receiver(post_save, sender=Space, dispatch_uid="invalidate_space_ids_on_space_save")
+def invalidate_space_ids_on_space_save(
+    sender: typing.Any, instance: Space, **kwargs: typing.Any
+) -> None:
+    """
+    Invalidate the cached space IDs of all users when a public space is created or a space is made
+    (non-)public or (un)removed. New private spaces are covered by the membership of their owner.
+    """
+    if kwargs["created"] and not instance.is_public:
+        return
+    if instance.tracker.changed():
+        Space.invalidate_space_ids_cache()
+
+
+@receiver(post_delete, sender=Space, dispatch_uid="invalidate_space_ids_on_space_delete")
+@receiver(post_save, sender=ObjectMembershipRole, dispatch_uid="invalidate_space_ids_on_role_save")
+def invalidate_all_space_ids(sender: typing.Any, **kwargs: typing.Any) -> None:
+    """Invalidate the cached space IDs of all users when a space is deleted or a role changes."""
+    Space.invalidate_space_ids_cache()
+
+
+@receiver(post_save, sender=Node, dispatch_uid="invalidate_node_context_on_node_save")
+def invalidate_node_context_on_node_save(
+    sender: typing.Any, instance: Node, **kwargs: typing.Any
+) -> None:
+    """
+    Invalidate the cached contexts that include the node when its title, text or description
+    change. Removing or restoring a node also changes the contexts of its parents.
+    """
+    if kwargs["created"]:
+        return
+    changed = NODE_CONTEXT_FIELDS.intersection(instance.tracker.changed())
+    if not changed:
+        return
+    node_ids = [instance.pk]
+    if "is_removed" in changed:
+        node_ids.extend(instance.parents.values_list("pk", flat=True))
+    Node.invalidate_context_cache(node_ids)
+
+
+@receiver(
+    m2m_changed, sender=Node.subnodes.through, dispatch_uid="invalidate_node_context_on_subnodes"
+)
+def invalidate_node_context_on_subnodes_change(
+    sender: typing.Any, instance: Node, action: str, reverse: bool, **kwargs: typing.Any
+) -> None:
+    """Invalidate the cached contexts that include a node whose subnodes change."""
+    if action in ("post_add", "post_remove"):
+        Node.invalidate_context_cache(kwargs["pk_set"] if reverse else [instance.pk])
+    elif action == "pre_clear":
+        # The parents of a cleared reverse relation are gone after the clear.
+        Node.invalidate_context_cache(
+            instance.parents.values_list("pk", flat=True) if reverse else [instance.pk]
+        )
@@ -0,0 +1,435 @@
+"""
+Synchronisation of CRDT documents into Nodes and Spaces.
+
+The CRDT server writes documents into the `Document` table, a trigger records every change as a
+`DocumentEvent` and the `process_document_events` task uses the helpers in this module to project
+those events onto the `Node` and `Space` tables.
+"""
+
+import logging
+import typing
+import uuid
+from collections import defaultdict
+
+from django.db import models as django_models
+from django.db import transaction
+from django.utils import timezone
+
+from nodes import models
+
+logger = logging.getLogger(__name__)
+
+UPSERT_ACTIONS = (models.DocumentEvent.EventType.INSERT, models.DocumentEvent.EventType.UPDATE)
+
+
+class DocumentPartition(django_models.Func):
+    """
+    The partition a document belongs to, derived from the last two bytes of its public ID.
+    This has to match `partition_for_public_id`.
+    """
+
+    template = (
+        "mod(get_byte(uuid_send(%(expressions)s), 14) * 256 "
+        "+ get_byte(uuid_send(%(expressions)s), 15), %(partitions)d)"
+    )
+    output_field = django_models.IntegerField()
+
+    def __init__(self, expression: str, partitions: int) -> None:
+        super().__init__(expression, partitions=int(partitions))
+
+
+def partition_for_public_id(public_id: uuid.UUID | str, partitions: int) -> int:
+    """Return the partition of the document with the given public ID."""
+    return int.from_bytes(uuid.UUID(str(public_id)).bytes[-2:], "big") % partitions
+
+
+def filter_partition(
+    queryset: "django_models.QuerySet[models.DocumentEvent]", partition: int, partitions: int
+) -> "django_models.QuerySet[models.DocumentEvent]":
+    """
+    Only return the events of the given partition.
+    All events of a document end up in the same partition, so processing partitions in parallel
+    keeps the order of events within a document.
+    """
+    if partitions == 1:
+        return queryset
+    return queryset.alias(partition=DocumentPartition("public_id", partitions)).filter(
+        partition=partition
+    )
+
+
+class DocumentEventBatch:
+    """
+    Apply a batch of document events to the Nodes and Spaces they describe.
+
+    All Nodes, Spaces and Documents referenced by the batch are fetched up front with one query
+    each, the events are then replayed in order against those in-memory objects and the result is
+    written back with bulk operations. This keeps the number of queries independent of the number
+    of events in the batch.
+    """
+
+    def __init__(self, events: list[models.DocumentEvent], raise_exception: bool = False) -> None:
+        self.events = events
+        self.raise_exception = raise_exception
+
+        # Nodes and spaces are keyed by the string representation of their public ID.
+        self.nodes: dict[str, models.Node] = {}
+        self.new_nodes: dict[str, models.Node] = {}
+        self.changed_node_fields: dict[str, set[str]] = defaultdict(set)
+        self.spaces: dict[str, models.Space] = {}
+        self.changed_spaces: dict[str, models.Space] = {}
+        # The node public IDs of each space (by primary key) after the last event for that space.
+        self.space_members: dict[int, set[str]] = {}
+        # The current data of the documents of compact events, keyed by (public ID, document type).
+        self.document_data: dict[tuple[str, str], typing.Any] = {}
+        # Document primary keys keyed by (public ID, document type).
+        self.documents: dict[tuple[str, str], int] = {}
+        # (parent public ID, subnode public ID) pairs that should be connected.
+        self.subnode_links: set[tuple[str, str]] = set()
+        # Public IDs of the nodes with graph events, their subnodes or edges may have changed.
+        self.changed_graphs: set[str] = set()
+        # The number of existing nodes that had events, but whose projection didn't change.
+        self.skipped_writes = 0
+
+    def process(self) -> None:
+        """Load everything the batch needs, apply the events in order and write the result."""
+        self.load()
+        for document_event in self.events:
+            logger.debug(f"Processing event {document_event.pk} for {document_event.public_id}")
+            try:
+                self.apply(document_event)
+            except Exception as e:
+                logger.exception(f"Error processing event {document_event.pk}: {e}")
+                if self.raise_exception:
+                    raise
+        self.flush()
+
+    def event_data(self, document_event: models.DocumentEvent) -> typing.Any:
+        """
+        Return the document data of the event.
+        Compact events don't carry any data, the current data of their document is used instead.
+        """
+        if document_event.new_data is not None:
+            return document_event.new_data
+        return self.document_data.get((str(document_event.public_id), document_event.document_type))
+
+    def _node_ids_from_data(self, document_event: models.DocumentEvent) -> list[str]:
+        return list(map(str, (self.event_data(document_event) or {}).get("nodes", {})))
+
+    def load(self) -> None:
+        """Fetch all Nodes, Spaces and Documents referenced by the events in the batch."""
+        compact_events = {
+            (str(document_event.public_id), document_event.document_type)
+            for document_event in self.events
+            if document_event.new_data is None and document_event.action in UPSERT_ACTIONS
+        }
+        if compact_events:
+            for public_id, document_type, data in models.Document.objects.filter(
+                public_id__in={public_id for public_id, _ in compact_events}
+            ).values_list("public_id", "document_type", "json"):
+                if (str(public_id), document_type) in compact_events:
+                    self.document_data[(str(public_id), document_type)] = data
+
+        node_ids: set[str] = set()
+        space_ids: set[str] = set()
+        for document_event in self.events:
+            public_id = str(document_event.public_id)
+            if document_event.document_type == models.DocumentType.SPACE:
+                space_ids.add(public_id)
+                node_ids.update(self._node_ids_from_data(document_event))
+            else:
+                node_ids.add(public_id)
+                if document_event.document_type == models.DocumentType.GRAPH:
+                    node_ids.update(self._node_ids_from_data(document_event))
+
+        if node_ids:
+            self.nodes = {
+                str(node.public_id): node
+                for node in models.Node.all_objects.select_for_update(no_key=True).filter(
+                    public_id__in=node_ids
+                )
+            }
+        if space_ids:
+            self.spaces = {
+                str(space.public_id): space
+                for space in models.Space.all_objects.select_for_update(no_key=True).filter(
+                    public_id__in=space_ids
+                )
+            }
+        self.documents = {
+            (str(public_id), document_type): pk
+            for public_id, document_type, pk in models.Document.objects.filter(
+                public_id__in=node_ids | space_ids
+            ).values_list("public_id", "document_type", "pk")
+        }
+
+    def apply(self, document_event: models.DocumentEvent) -> None:
+        """Apply a single event to the in-memory state of the batch."""
+        if document_event.action == models.DocumentEvent.EventType.DELETE:
+            # We don't actually expect the document to be deleted in the database, they are just
+            # marked as deleted.
+            logger.warning(f"Deletion event for {document_event.public_id} received. Ignoring...")
+            return
+        if document_event.action not in UPSERT_ACTIONS:
+            logger.warning(
+                f"Unknown action {document_event.action} for {document_event.public_id} "
+                "received. ignoring..."
+            )
+            return
+
+        if document_event.document_type == models.DocumentType.EDITOR:
+            self._apply_editor_event(document_event)
+        elif document_event.document_type == models.DocumentType.SPACE:
+            self._apply_space_event(document_event)
+        elif document_event.document_type == models.DocumentType.GRAPH:
+            self._apply_graph_event(document_event)
+        elif document_event.document_type == models.DocumentType.METHOD_GRAPH:
+            self._apply_method_graph_event(document_event)
+        else:
+            logger.warning(
+                f"Unknown document type {document_event.document_type} for "
+                f"{document_event.public_id} received. Ignoring..."
+            )
+
+    def _mark_changed(self, node: models.Node, *fields: str) -> None:
+        self.changed_node_fields[str(node.public_id)].update(fields)
+
+    def _get_node(self, public_id: str, node_type: models.NodeType) -> models.Node:
+        """Return the node with the given public ID, building a new one if it doesn't exist."""
+        if (node := self.nodes.get(public_id)) is None:
+            node = models.Node(public_id=public_id, node_type=node_type)
+            self.nodes[public_id] = node
+            self.new_nodes[public_id] = node
+        return node
+
+    def _set_document(
+        self,
+        node: models.Node,
+        field: str,
+        public_id: str,
+        document_type: models.DocumentType,
+    ) -> None:
+        """Set the document of the given type on the node if it hasn't been set yet."""
+        if getattr(node, f"{field}_id") is not None:
+            return
+        if (document_id := self.documents.get((public_id, document_type))) is not None:
+            setattr(node, f"{field}_id", document_id)
+            self._mark_changed(node, field)
+
+    def _apply_editor_event(self, document_event: models.DocumentEvent) -> None:
+        public_id = str(document_event.public_id)
+        node = self._get_node(public_id, models.NodeType.DEFAULT)
+        self._set_document(node, "graph_document", public_id, models.DocumentType.GRAPH)
+        self._set_document(node, "editor_document", public_id, models.DocumentType.EDITOR)
+        content = self.event_data(document_event)
+        if public_id in self.new_nodes or content != node.content:
+            node.content = content
+            self._mark_changed(node, "content")
+        else:
+            # Register the node, so it's counted as a skipped write if nothing else changes.
+            self.changed_node_fields.setdefault(public_id, set())
+
+    def _apply_space_event(self, document_event: models.DocumentEvent) -> None:
+        public_id = str(document_event.public_id)
+        if not (data := self.event_data(document_event)):
+            logger.error(f"Space Event {public_id} has no data. Ignoring...")
+            return
+
+        space = self.spaces.get(public_id)
+        if space is None:
+            logger.error(f"Space {public_id} does not exist. Ignoring...")
+            if self.raise_exception:
+                raise models.Space.DoesNotExist(f"Space {public_id} does not exist.")
+            return
+
+        # 1. Update the space
+        if space.document_id is None and (
+            document_id := self.documents.get((public_id, models.DocumentType.SPACE))
+        ):
+            space.document_id = document_id
+            self.changed_spaces[public_id] = space
+
+        # Extract nodes and titles from space data
+        node_titles = {
+            str(node_id): node_data.get("title")
+            for node_id, node_data in data.get("nodes", {}).items()
+        }
+
+        # 2. Remove nodes from the space that are no longer part of it. Nodes that weren't loaded
+        #    are handled in `flush`.
+        for node_id, node in self.nodes.items():
+            if node.space_id == space.pk and node_id not in node_titles:
+                node.space = None
+                self._mark_changed(node, "space")
+
+        # 3. Update the space and titles of existing nodes and create new nodes that didn't get
+        #    their content synced yet.
+        for node_id, title in node_titles.items():
+            if node_id not in self.nodes:
+                node = self._get_node(node_id, models.NodeType.DEFAULT)
+                # This is in case the node was synced meanwhile.
+                self._set_document(node, "graph_document", node_id, models.DocumentType.GRAPH)
+                self._set_document(node, "editor_document", node_id, models.DocumentType.EDITOR)
+            node = self.nodes[node_id]
+            if node.space_id != space.pk:
+                node.space = space
+                self._mark_changed(node, "space")
+            if node.title != title:
+                node.title = title
+                self._mark_changed(node, "title")
+
+        self.space_members[space.pk] = set(node_titles)
+
+    def _apply_graph_event(self, document_event: models.DocumentEvent) -> None:
+        public_id = str(document_event.public_id)
+        if not self.event_data(document_event):
+            logger.error(f"Graph Event {public_id} has no data. Ignoring...")
+            return
+
+        # 1. Get or create the parent node
+        node = self._get_node(public_id, models.NodeType.DEFAULT)
+        self._set_document(node, "graph_document", public_id, models.DocumentType.GRAPH)
+        self.changed_graphs.add(public_id)
+
+        # 2. Set subnodes
+        for node_id in self._node_ids_from_data(document_event):
+            self._get_node(node_id, models.NodeType.DEFAULT)
+            self.subnode_links.add((public_id, node_id))
+
+    def _apply_method_graph_event(self, document_event: models.DocumentEvent) -> None:
+        public_id = str(document_event.public_id)
+        node = self._get_node(public_id, models.NodeType.METHOD)
+        self._set_document(node, "graph_document", public_id, models.DocumentType.METHOD_GRAPH)
+
+    def flush(self) -> None:
+        """Write the in-memory state of the batch back to the database."""
+        # 1. Detach nodes that are no longer part of a space but weren't loaded for this batch.
+        for space_pk, node_ids in self.space_members.items():
+            models.Node.all_objects.filter(space_id=space_pk).exclude(
+                public_id__in=node_ids
+            ).update(space=None)
+
+        # 2. Create new nodes
+        if self.new_nodes:
+            for node in self.new_nodes.values():
+                node.update_computed_fields()
+            models.Node.all_objects.bulk_create(self.new_nodes.values())
+
+        # 3. Update existing nodes
+        now = timezone.now()
+        # Grouped by the exact set of changed fields so a node is never written with stale values
+        # for fields that only another node in the batch changed.
+        changed_nodes: dict[tuple[str, ...], list[models.Node]] = defaultdict(list)
+        for public_id, fields in self.changed_node_fields.items():
+            if public_id in self.new_nodes:
+                continue
+            node = self.nodes[public_id]
+            # Events can change a field back to its stored value, e.g. undoing an edit.
+            fields.difference_update(
+                field for field in ("content", "title") if not node.tracker.has_changed(field)
+            )
+            if not fields:
+                self.skipped_writes += 1
+                continue
+            fields.update(node.update_computed_fields(fields))
+            if "content" in fields:
+                node.updated_at = now
+                fields.add("updated_at")
+            changed_nodes[tuple(sorted(fields))].append(node)
+        for update_fields, nodes in changed_nodes.items():
+            models.Node.all_objects.bulk_update(nodes, update_fields)
+
+        # 4. Update spaces
+        if self.changed_spaces:
+            models.Space.all_objects.bulk_update(self.changed_spaces.values(), ["document"])
+
+        # 5. Connect subnodes
+        if self.subnode_links:
+            through_model = models.Node.subnodes.through
+            through_model.objects.bulk_create(
+                [
+                    through_model(
+                        from_node_id=self.nodes[parent_id].pk,
+                        to_node_id=self.nodes[subnode_id].pk,
+                    )
+                    for parent_id, subnode_id in self.subnode_links
+                ],
+                ignore_conflicts=True,
+            )
+
+        # 6. Invalidate the cached contexts of the changed nodes, the bulk writes bypass signals.
+        models.Node.invalidate_context_cache(
+            [
+                node.pk
+                for public_id, node in self.nodes.items()
+                if public_id not in self.new_nodes
+                and (
+                    public_id in self.changed_graphs
+                    or models.NODE_CONTEXT_FIELDS.intersection(
+                        self.changed_node_fields.get(public_id, ())
+                    )
+                )
+            ]
+        )
+
+
+def coalesce_events(
+    events: list[models.DocumentEvent],
+) -> tuple[list[models.DocumentEvent], list[models.DocumentEvent]]:
+    """
+    Collapse the events to the latest event per document.
+
+    Only the newest data of a document matters for the projection, so every event that is followed
+    by another event for the same document (either within the batch or further down the queue) is
+    superseded. Returns the events that need to be processed, in their original order, and the
+    superseded events, which can be discarded without processing them.
+    """
+    latest_events: dict[tuple[str, str], models.DocumentEvent] = {}
+    for document_event in events:
+        latest_events[(str(document_event.public_id), document_event.document_type)] = (
+            document_event
+        )
+
+    if latest_events:
+        # Events that are queued after this batch supersede all of its events for that document.
+        newer_events = (
+            models.DocumentEvent.objects.filter(
+                public_id__in={public_id for public_id, _ in latest_events},
+                pk__gt=max(document_event.pk for document_event in events),
+            )
+            .values_list("public_id", "document_type")
+            .distinct()
+        )
+        for public_id, document_type in newer_events:
+            latest_events.pop((str(public_id), document_type), None)
+
+    latest_event_pks = {document_event.pk for document_event in latest_events.values()}
+    return (
+        [document_event for document_event in events if document_event.pk in latest_event_pks],
+        [document_event for document_event in events if document_event.pk not in latest_event_pks],
+    )
+
+
+def process_events(events: list[models.DocumentEvent], raise_exception: bool = False) -> int:
+    """
+    Apply the given events as a single batch.
+    If writing the batch fails, the events are retried one by one so that a single bad event
+    doesn't block the rest of the batch.
+    Returns the number of node writes that were skipped because nothing changed.
+    """
+    if not events:
+        return 0
+
+    try:
+        with transaction.atomic():
+            batch = DocumentEventBatch(events, raise_exception=raise_exception)
+            batch.process()
+            return batch.skipped_writes
+    except Exception as e:
+        if raise_exception:
+            raise
+        if len(events) == 1:
+            logger.exception(f"Error processing event {events[0].pk}: {e}")
+            return 0
+        logger.exception(f"Error processing batch of {len(events)} events, retrying one by one.")
+        return sum(process_events([document_event]) for document_event in events)
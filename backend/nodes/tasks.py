@@ -1,341 +1,246 @@
 import logging
+import typing
 from datetime import timedelta
-from hashlib import sha256
 
 import pglock
 from celery import shared_task
 from django.conf import settings
 from django.db import transaction
+from django.db.models import F, Q, TextField, Value, Window
+from django.db.models.functions import MD5, Coalesce, Concat, Extract, Floor, RowNumber
 from django.utils import timezone
 
-from nodes import models
+from nodes import embeddings, models, sync
 
 logger = logging.getLogger(__name__)
 
 
+def queue_document_events(partitions: typing.Iterable[int] | None = None) -> None:
+    """Queue a `process_document_events` task for each of the given (by default all) partitions."""
+    if partitions is None:
+        partitions = range(settings.NODE_CRDT_EVENTS_PARTITIONS)
+    for partition in partitions:
+        process_document_events.delay(partition=partition)
+
+
 @shared_task(ignore_result=True, expires=10)
-def process_document_events(raise_exception: bool = False) -> None:  # noqa: PLR0915, PLR0912
+def process_document_events(
+    raise_exception: bool = False, batch_size: int | None = None, partition: int | None = None
+) -> dict[str, int]:
     """
     Process document events and update the corresponding Nodes and Spaces.
-    TODO: Check whether we have an issue with Out of Order Processing.
-    TODO: Reduce complexity of this function.
+    Events are sharded into `NODE_CRDT_EVENTS_PARTITIONS` partitions by their document, each
+    partition has its own lock, so partitions can be processed in parallel. If no partition is
+    given, all partitions are processed one after the other.
+    Events are claimed and applied in batches of `batch_size` (defaults to the
+    `NODE_CRDT_EVENTS_BATCH_SIZE` setting), see `nodes.sync.DocumentEventBatch` for details.
+    Events that are superseded by a newer event for the same document are discarded without
+    processing them.
+    Returns the number of processed and skipped events and the number of node writes that were
+    skipped because the projection didn't change.
     """
-
-    # The pglock.advisory context manager is used to ensure that only one task is running at a time.
-    with pglock.advisory("process_document_events_task", xact=True):
-        # Lock the rows we are going to process so that no other task will process them.
-        events = models.DocumentEvent.objects.select_for_update(skip_locked=True).order_by(
-            "created_at"
+    partitions = settings.NODE_CRDT_EVENTS_PARTITIONS
+    batch_size = batch_size or settings.NODE_CRDT_EVENTS_BATCH_SIZE
+    stats = {"processed": 0, "skipped": 0, "unchanged": 0}
+
+    for current_partition in range(partitions) if partition is None else [partition]:
+        if not 0 <= current_partition < partitions:
+            raise ValueError(f"Partition {current_partition} is out of range (0-{partitions - 1}).")
+        lock_id = (
+            "process_document_events_task"
+            if partitions == 1
+            else f"process_document_events_task_{current_partition}"
         )
-        for document_event in events:
-            logger.debug(f"Processing event {document_event.pk} for {document_event.public_id}")
-            try:
-                with transaction.atomic():
-                    if document_event.document_type == models.DocumentType.EDITOR:
-                        # It would be nice to split this into a separate task, but keeping the
-                        # lock is a good way to ensure that we don't process the same event
-                        # twice.
-                        if document_event.action in (
-                            models.DocumentEvent.EventType.INSERT,
-                            models.DocumentEvent.EventType.UPDATE,
-                        ):
-                            # Fetch the node, or create it.
-                            try:
-                                node = models.Node.all_objects.select_for_update(no_key=True).get(
-                                    public_id=document_event.public_id
-                                )
-                            except models.Node.DoesNotExist:
-                                node = models.Node(
-                                    public_id=document_event.public_id,
-                                    node_type=models.NodeType.DEFAULT,
-                                )
-
-                            # Try setting the graph and editor documents.
-                            if not node.graph_document:
-                                try:
-                                    node.graph_document = models.Document.objects.only("id").get(
-                                        public_id=document_event.public_id,
-                                        document_type=models.DocumentType.GRAPH,
-                                    )
-                                except models.Document.DoesNotExist:
-                                    pass
-
-                            if not node.editor_document:
-                                try:
-                                    node.editor_document = models.Document.objects.only("id").get(
-                                        public_id=document_event.public_id,
-                                        document_type=models.DocumentType.EDITOR,
-                                    )
-                                except models.Document.DoesNotExist:
-                                    pass
-
-                            node.content = document_event.new_data
-                            node.save()
-
-                        elif document_event.action == models.DocumentEvent.EventType.DELETE:
-                            # We don't actually expect the document to be deleted in the
-                            # database, they are just marked as deleted.
-                            logger.warning(
-                                f"Deletion event for {document_event.public_id} received. "
-                                "Ignoring..."
-                            )
-                        else:
-                            logger.warning(
-                                f"Unknown action {document_event.action} for "
-                                f"{document_event.public_id} received. ignoring..."
-                            )
-                    elif document_event.document_type == models.DocumentType.SPACE:
-                        if document_event.action in (
-                            models.DocumentEvent.EventType.INSERT,
-                            models.DocumentEvent.EventType.UPDATE,
-                        ):
-                            if not document_event.new_data:
-                                logger.error(
-                                    f"Space Event {document_event.public_id} has no data. "
-                                    "Ignoring..."
-                                )
-                                continue
-                            # 1. Update the space
-
-                            # Extract nodes and titles from space data
-                            node_titles = {
-                                node_id: node_data.get("title")
-                                for node_id, node_data in document_event.new_data.get(
-                                    "nodes", {}
-                                ).items()
-                            }
-
-                            try:
-                                space = models.Space.all_objects.select_for_update(no_key=True).get(
-                                    public_id=document_event.public_id
-                                )
-                            except models.Space.DoesNotExist:
-                                logger.error(
-                                    f"Space {document_event.public_id} does not exist. "
-                                    "Ignoring..."
-                                )
-                                if raise_exception:
-                                    raise
-                                continue
-
-                            if not space.document:
-                                try:
-                                    space.document = models.Document.objects.only("id").get(
-                                        public_id=document_event.public_id
-                                    )
-                                except models.Document.DoesNotExist:
-                                    pass
-                                else:
-                                    space.save(update_fields=["document"])
-
-                            space_nodes = (
-                                models.Node.all_objects.select_for_update(no_key=True)
-                                .filter(public_id__in=node_titles.keys())
-                                .defer("content", "text")
-                                .order_by("-created_at")
-                            )
-                            space.nodes.set(space_nodes)
-
-                            # 2. Update the node titles and token counts of existing nodes
-                            nodes_in_space = set(node_titles.keys())
-                            nodes_existing = set(
-                                map(str, space_nodes.values_list("public_id", flat=True))
-                            )
-
-                            for node in space_nodes:
-                                if node.title != node_titles[str(node.public_id)]:
-                                    node.title = node_titles[str(node.public_id)]
-                                    node.save(update_fields=["title"])
-
-                            # 3. Create new nodes that didn't get their content synced yet
-                            for node_id in nodes_in_space - nodes_existing:
-                                node = models.Node(
-                                    public_id=node_id,
-                                    title=node_titles[node_id],
-                                    space=space,
-                                    node_type=models.NodeType.DEFAULT,
-                                )
-
-                                # This is in case the node was synced meanwhile.
-                                try:
-                                    node.graph_document = models.Document.objects.only("id").get(
-                                        public_id=document_event.public_id,
-                                        document_type=models.DocumentType.GRAPH,
-                                    )
-                                except models.Document.DoesNotExist:
-                                    pass
-
-                                try:
-                                    node.editor_document = models.Document.objects.only("id").get(
-                                        public_id=document_event.public_id,
-                                        document_type=models.DocumentType.EDITOR,
-                                    )
-                                except models.Document.DoesNotExist:
-                                    pass
-
-                                node.save()
-
-                        elif document_event.action == models.DocumentEvent.EventType.DELETE:
-                            logger.warning(
-                                f"Deletion event for {document_event.public_id} received. "
-                                "Ignoring..."
-                            )
-                        else:
-                            logger.warning(
-                                f"Unknown action {document_event.action} for "
-                                f"{document_event.public_id} received. ignoring..."
-                            )
-
-                    elif document_event.document_type == models.DocumentType.GRAPH:
-                        if document_event.action in (
-                            models.DocumentEvent.EventType.INSERT,
-                            models.DocumentEvent.EventType.UPDATE,
-                        ):
-                            if not document_event.new_data:
-                                logger.error(
-                                    f"Graph Event {document_event.public_id} has no data. "
-                                    "Ignoring..."
-                                )
-                                continue
 
-                            # 1. Get or create the parent node
-                            try:
-                                node = models.Node.all_objects.select_for_update(no_key=True).get(
-                                    public_id=document_event.public_id
-                                )
-                            except models.Node.DoesNotExist:
-                                node = models.Node.objects.create(
-                                    public_id=document_event.public_id,
-                                    node_type=models.NodeType.DEFAULT,
-                                )
-
-                            if not node.graph_document:
-                                try:
-                                    node.graph_document = models.Document.objects.only("id").get(
-                                        public_id=document_event.public_id,
-                                        document_type=models.DocumentType.GRAPH,
-                                    )
-                                except models.Document.DoesNotExist:
-                                    pass
-                                else:
-                                    # TODO: Remove duplicate save
-                                    node.save(update_fields=["graph_document"])
-
-                            # 2. Set subnodes
-
-                            for node_id in document_event.new_data.get("nodes", []):
-                                try:
-                                    subnode = models.Node.all_objects.select_for_update(
-                                        no_key=True
-                                    ).get(public_id=node_id)
-                                except models.Node.DoesNotExist:
-                                    subnode = models.Node.objects.create(
-                                        public_id=node_id, node_type=models.NodeType.DEFAULT
-                                    )
-                                node.subnodes.add(subnode)
-
-                        elif document_event.action == models.DocumentEvent.EventType.DELETE:
-                            logger.warning(
-                                f"Deletion event for {document_event.public_id} received. "
-                                "Ignoring..."
-                            )
-                        else:
-                            logger.warning(
-                                f"Unknown action {document_event.action} for "
-                                f"{document_event.public_id} received. ignoring..."
-                            )
-                    elif document_event.document_type == models.DocumentType.METHOD_GRAPH:
-                        if document_event.action in (
-                            models.DocumentEvent.EventType.INSERT,
-                            models.DocumentEvent.EventType.UPDATE,
-                        ):
-                            # 1. Get or create the parent node
-                            try:
-                                node = models.Node.all_objects.select_for_update(no_key=True).get(
-                                    public_id=document_event.public_id
-                                )
-                            except models.Node.DoesNotExist:
-                                node = models.Node.objects.create(
-                                    public_id=document_event.public_id,
-                                    node_type=models.NodeType.METHOD,
-                                )
-
-                            if not node.graph_document:
-                                try:
-                                    node.graph_document = models.Document.objects.only("id").get(
-                                        public_id=document_event.public_id,
-                                        document_type=models.DocumentType.METHOD_GRAPH,
-                                    )
-                                except models.Document.DoesNotExist:
-                                    pass
-                                else:
-                                    # TODO: Remove duplicate save
-                                    node.save(update_fields=["graph_document"])
-
-                        elif document_event.action == models.DocumentEvent.EventType.DELETE:
-                            logger.warning(
-                                f"Deletion event for {document_event.public_id} received. "
-                                "Ignoring..."
-                            )
-                        else:
-                            logger.warning(
-                                f"Unknown action {document_event.action} for "
-                                f"{document_event.public_id} received. ignoring..."
-                            )
-            except Exception as e:
-                logger.exception(f"Error processing event {document_event.pk}: {e}")
-                if raise_exception:
-                    raise
-                continue
-            finally:
-                document_event.delete()
+        while True:
+            # The pglock.advisory context manager is used to ensure that only one task is running
+            # per partition at a time. Each batch runs in its own transaction, so processed batches
+            # are committed even if a later one fails.
+            with pglock.advisory(lock_id, xact=True):
+                # Lock the rows we are going to process so that no other task will process them.
+                events = list(
+                    sync.filter_partition(
+                        models.DocumentEvent.objects.select_for_update(skip_locked=True),
+                        current_partition,
+                        partitions,
+                    ).order_by("created_at", "pk")[:batch_size]
+                )
+                if not events:
+                    break
+
+                latest_events, superseded_events = sync.coalesce_events(events)
+                unchanged = sync.process_events(latest_events, raise_exception=raise_exception)
+                models.DocumentEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+
+            stats["processed"] += len(latest_events)
+            stats["skipped"] += len(superseded_events)
+            stats["unchanged"] += unchanged
+
+            # A partial batch means that we caught up with the queue.
+            if len(events) < batch_size:
+                break
+
+    if stats["skipped"] or stats["unchanged"]:
+        logger.info(
+            f"Processed {stats['processed']} document events, skipped {stats['skipped']} "
+            f"superseded events and {stats['unchanged']} unchanged node writes."
+        )
+    return stats
 
 
 @shared_task(ignore_result=True, expires=settings.NODE_VERSIONING_INTERVAL * 5)
-def document_versioning() -> None:
+def document_versioning(batch_size: int | None = None) -> int:
     """
-    Save a snapshot of all documents if they were changed within the last interval.
+    Save a snapshot of all documents that changed since their last version.
+    Documents are versioned once they weren't changed for `NODE_VERSIONING_INTERVAL` seconds,
+    documents without a version are versioned right away.
+    The hash of the document JSON is maintained by a database trigger, so this is an indexed scan
+    for documents whose hash differs from the last versioned one and the JSON is never loaded.
+    Returns the number of created versions.
     """
+    threshold_time = timezone.now() - timedelta(seconds=settings.NODE_VERSIONING_INTERVAL)
+    batch_size = batch_size or settings.NODE_VERSIONING_BATCH_SIZE
+
+    changed_documents = (
+        models.Document.objects.filter(~Q(json_hash=F("last_versioned_hash")))
+        .filter(Q(last_versioned_hash="") | Q(updated_at__lt=threshold_time))
+        .only("document_type", "data", "json_hash")
+        .order_by("pk")
+    )
 
+    created = 0
+    last_pk = 0
+    while documents := list(changed_documents.filter(pk__gt=last_pk)[:batch_size]):
+        with transaction.atomic():
+            versions = []
+            for document in documents:
+                version = models.DocumentVersion(
+                    document=document,
+                    document_type=document.document_type,
+                    json_hash=document.json_hash,
+                )
+                version.set_data(document.data)
+                versions.append(version)
+            models.DocumentVersion.objects.bulk_create(versions)
+            # Store the hash that was versioned, if the document changed in the meantime it will
+            # be picked up again by the next run.
+            for document in documents:
+                document.last_versioned_hash = document.json_hash
+            models.Document.objects.bulk_update(documents, ["last_versioned_hash"])
+
+        created += len(documents)
+        last_pk = documents[-1].pk
+        if len(documents) < batch_size:
+            break
+
+    return created
+
+
+@shared_task(ignore_result=True, expires=settings.NODE_VERSIONING_RETENTION_TASK_INTERVAL)
+def thin_document_versions(batch_size: int = 1000) -> int:
+    """
+    Thin out document versions according to the `NODE_VERSIONING_RETENTION` tiers.
+    Within each tier, only the latest version per document and bucket is kept. Buckets are aligned
+    to the epoch, so the kept versions don't change between runs and the latest version of a
+    document is always kept.
+    Versions are soft-deleted, unless `NODE_VERSIONING_RETENTION_HARD_DELETE` is set.
+    Returns the number of removed versions.
+    """
     now = timezone.now()
-    threshold_time = now - timedelta(seconds=settings.NODE_VERSIONING_INTERVAL)
-    lower_threshold_time = threshold_time - timedelta(days=1)
+    tiers = sorted(settings.NODE_VERSIONING_RETENTION)
 
-    # Fetch document versions that were created outside the current interval. Doing the query this
-    # way around means we have to do another one for documents without versions, but this is by
-    # far the fastest query I could find.
-    # TODO: Still add fitting indices for this query to the database. The number of DocumentVersion
-    #       objects will grow very fast.
-    # TODO: Consider using a different approach where we calculate the sha256 hash of the document
-    #       and compare it to the hash stored in the database. This would be faster, but we would
-    #       have to store the hash in the database and calculate it on every save.
-    # Note: We added a lower threshold time to the query to avoid fetching documents checking
-    #       documents that weren't update recently. This became necessary because the query was
-    #       taking too long to execute. However this will cause problems if the task is not run
-    #       for a long time.
-    latest_versions = (
-        models.DocumentVersion.available_objects.order_by("document_id", "-created_at")
-        .distinct("document_id")
-        .select_related("document")
-        .filter(
-            document__updated_at__lt=threshold_time, document__updated_at__gt=lower_threshold_time
+    removed = 0
+    for index, (age, bucket_size) in enumerate(tiers):
+        versions = models.DocumentVersion.available_objects.filter(
+            created_at__lt=now - timedelta(seconds=age)
+        )
+        if index + 1 < len(tiers):
+            versions = versions.filter(created_at__gte=now - timedelta(seconds=tiers[index + 1][0]))
+
+        superseded_versions = (
+            versions.annotate(
+                rank=Window(
+                    RowNumber(),
+                    partition_by=[
+                        F("document_id"),
+                        Floor(Extract("created_at", "epoch") / bucket_size),
+                    ],
+                    order_by=[F("created_at").desc(), F("pk").desc()],
+                )
+            )
+            .filter(rank__gt=1)
+            .values_list("pk", flat=True)
         )
-        .only("document__document_type", "document__data", "document__json", "json_hash")
+        while version_ids := list(superseded_versions[:batch_size]):
+            to_remove = models.DocumentVersion.all_objects.filter(pk__in=version_ids)
+            if settings.NODE_VERSIONING_RETENTION_HARD_DELETE:
+                to_remove.delete()
+            else:
+                to_remove.update(is_removed=True)
+            removed += len(version_ids)
+            if len(version_ids) < batch_size:
+                break
+
+    if removed:
+        logger.info(f"Removed {removed} document versions.")
+    return removed
+
+
+@shared_task(ignore_result=True, expires=settings.NODE_EMBEDDINGS_TASK_INTERVAL)
+def update_node_embeddings(batch_size: int | None = None) -> int:
+    """
+    Embed the nodes whose title or text changed since they were last embedded, in batches of
+    `batch_size` (defaults to the `NODE_EMBEDDINGS_BATCH_SIZE` setting).
+    Changed nodes are flagged by the `node_update_search_vector` trigger, see
+    `nodes.embeddings.update_node_embeddings` for how the chunks are embedded.
+    Returns the number of embedded chunks.
+    """
+    batch_size = batch_size or settings.NODE_EMBEDDINGS_BATCH_SIZE
+    # Captured when the nodes are read, to find the nodes that changed while they were embedded.
+    content_hash = MD5(
+        Concat(
+            Coalesce("title", Value(""), output_field=TextField()),
+            Value("\n"),
+            Coalesce("text", Value(""), output_field=TextField()),
+            output_field=TextField(),
+        )
+    )
+    stale_nodes = (
+        models.Node.available_objects.filter(embeddings_stale=True)
+        .only("title", "text")
+        .annotate(content_hash=content_hash)
+        .order_by("pk")
     )
 
-    for version in latest_versions:
-        document_hash = sha256(str(version.document.json).encode()).hexdigest()
-        if version.json_hash != document_hash:
-            version.document.versions.create(
-                data=version.document.data,
-                json_hash=document_hash,
-                document_type=version.document.document_type,
+    embedded = 0
+    last_pk = 0
+    while True:
+        nodes = list(stale_nodes.filter(pk__gt=last_pk)[:batch_size])
+        if not nodes:
+            break
+        # The embedder can call an external API, so it runs outside of the transaction.
+        rows, embedded_chunks = embeddings.embed_nodes(nodes)
+        # Only one task stores chunks at a time, so they aren't stored twice.
+        with pglock.advisory("update_node_embeddings_task", xact=True):
+            embeddings.store_node_embeddings(nodes, rows)
+            # If a node changed in the meantime, it stays flagged for the next run.
+            current_hashes = dict(
+                models.Node.all_objects.filter(pk__in=[node.pk for node in nodes])
+                .select_for_update()
+                .annotate(content_hash=content_hash)
+                .values_list("pk", "content_hash")
             )
-
-    # Fetch documents without versions and create a version for them
-    for document in models.Document.objects.filter(versions__isnull=True):
-        document.versions.create(
-            data=document.data,
-            json_hash=sha256(str(document.json).encode()).hexdigest(),
-            document_type=document.document_type,
-        )
+            models.Node.all_objects.filter(
+                pk__in=[
+                    node.pk for node in nodes if current_hashes.get(node.pk) == node.content_hash
+                ]
+            ).update(embeddings_stale=False)
+        embedded += embedded_chunks
+
+        last_pk = nodes[-1].pk
+        if len(nodes) < batch_size:
+            break
+
+    if embedded:
+        logger.info(f"Embedded {embedded} node chunks.")
+    return embedded
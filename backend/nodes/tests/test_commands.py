@@ -0,0 +1,90 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from nodes import models
+from nodes.tests import factories
+from utils import compression
+from utils.testcases import BaseTransactionTestCase
+
+
+class RecompressDocumentVersionsTestCase(BaseTransactionTestCase):
+    def test_recompress(self) -> None:
+        data = b"a near-identical CRDT snapshot " * 100
+        versions = factories.DocumentVersionFactory.create_batch(
+            5, data=data, codec=compression.Codec.NONE
+        )
+
+        out = StringIO()
+        call_command("recompress_document_versions", codec="zstd", batch_size=2, stdout=out)
+
+        for version in versions:
+            version.refresh_from_db()
+            self.assertEqual(version.codec, compression.Codec.ZSTD)
+            self.assertLess(len(version.data), len(data))
+            self.assertEqual(version.get_data(), data)
+
+        compressed_size = sum(len(version.data) for version in versions)
+        self.assertIn(
+            f"Recompressed 5 versions with zstd: {5 * len(data)} -> {compressed_size} bytes",
+            out.getvalue(),
+        )
+
+        # Running it again doesn't touch the already compressed versions.
+        out = StringIO()
+        call_command("recompress_document_versions", codec="zstd", stdout=out)
+        self.assertIn("Recompressed 0 versions", out.getvalue())
+
+    def test_decompress(self) -> None:
+        version = factories.DocumentVersionFactory.build(document=factories.DocumentFactory())
+        version.set_data(b"crdt data", compression.Codec.ZSTD)
+        version.save()
+
+        call_command("recompress_document_versions", codec="none", stdout=StringIO())
+
+        version = models.DocumentVersion.all_objects.get(pk=version.pk)
+        self.assertEqual(version.codec, compression.Codec.NONE)
+        self.assertEqual(bytes(version.data), b"crdt data")
+
+
+class BenchmarkTextExtractionTestCase(SimpleTestCase):
+    def test_benchmark(self) -> None:
+        out = StringIO()
+        call_command("benchmark_text_extraction", paragraphs=10, depth=3, repeat=1, stdout=out)
+        self.assertIn("recursive:", out.getvalue())
+        self.assertIn("iterative:", out.getvalue())
+        self.assertIn("Extracted 799 characters", out.getvalue())
+
+
+class BenchmarkUserRolesTestCase(BaseTransactionTestCase):
+    def test_benchmark(self) -> None:
+        out = StringIO()
+        call_command(
+            "benchmark_user_roles", nodes=20, members=5, page_size=10, repeat=1, stdout=out
+        )
+        self.assertIn("annotation:", out.getvalue())
+        self.assertIn("grouped:", out.getvalue())
+        self.assertIn("Resolved the roles of 10 of 20 nodes", out.getvalue())
+        # The benchmark data is rolled back.
+        self.assertFalse(models.Space.all_objects.filter(title="Benchmark").exists())
+
+
+class ResetNodeEmbeddingsTestCase(BaseTransactionTestCase):
+    def test_reset(self) -> None:
+        node = factories.NodeFactory.create()
+        models.Node.objects.filter(pk=node.pk).update(embeddings_stale=False)
+        models.NodeEmbedding.objects.create(node=node, chunk=0, embedder="other", vector=b"")
+        models.NodeEmbedding.objects.create(node=node, chunk=0, embedder="hashing-256", vector=b"")
+
+        out = StringIO()
+        call_command("reset_node_embeddings", stdout=out)
+        self.assertIn("Flagged 1 nodes", out.getvalue())
+        node.refresh_from_db()
+        self.assertTrue(node.embeddings_stale)
+        self.assertEqual(models.NodeEmbedding.objects.count(), 2)
+
+        call_command("reset_node_embeddings", "--delete-other", stdout=out)
+        self.assertListEqual(
+            list(models.NodeEmbedding.objects.values_list("embedder", flat=True)), ["hashing-256"]
+        )
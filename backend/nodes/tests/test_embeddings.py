@@ -0,0 +1,103 @@
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from nodes import embeddings, models
+from nodes.tests import factories
+from utils.testcases import BaseTransactionTestCase
+
+
+class ChunkTextTestCase(SimpleTestCase):
+    @override_settings(NODE_EMBEDDINGS_CHUNK_WORDS=4, NODE_EMBEDDINGS_OVERLAP=1)
+    def test_chunk_text(self) -> None:
+        self.assertListEqual(
+            embeddings.chunk_text("Title", "one two three four five six seven"),
+            ["Title\none two three four", "Title\nfour five six seven"],
+        )
+        self.assertListEqual(
+            embeddings.chunk_text(None, "one two three four five"),
+            ["one two three four", "four five"],
+        )
+        self.assertListEqual(embeddings.chunk_text("Title", ""), ["Title"])
+        self.assertListEqual(embeddings.chunk_text(None, None), [])
+
+
+class SpaceIndexTestCase(SimpleTestCase):
+    def test_search(self) -> None:
+        vectors = np.eye(3, dtype=np.float32)[[0, 1, 2, 2]]
+        index = embeddings.SpaceIndex(np.array([1, 1, 2, 3]), vectors)
+
+        # Nodes are scored by their most similar chunk.
+        query = np.array([0.6, 0.8, 0.0], dtype=np.float32)
+        self.assertListEqual(
+            [(round(score, 2), node_id) for score, node_id in index.search(query, 10)],
+            [(0.8, 1), (0.0, 2), (0.0, 3)],
+        )
+        self.assertListEqual([node_id for _, node_id in index.search(query, 1)], [1])
+
+        empty_index = embeddings.SpaceIndex(np.array([], dtype=np.int64), np.zeros((0, 3)))
+        self.assertListEqual(empty_index.search(query, 10), [])
+
+
+class NodeEmbeddingsTestCase(BaseTransactionTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        embeddings.index_cache.clear()
+
+    @override_settings(NODE_EMBEDDINGS_CHUNK_WORDS=4, NODE_EMBEDDINGS_OVERLAP=0)
+    def test_update_node_embeddings(self) -> None:
+        node = factories.NodeFactory.create(title="Dogs", text="one two three four five six")
+
+        self.assertEqual(embeddings.update_node_embeddings([node]), 2)
+        rows = list(models.NodeEmbedding.objects.filter(node=node).order_by("chunk"))
+        self.assertListEqual([row.chunk for row in rows], [0, 1])
+        self.assertEqual(rows[0].embedder, "hashing-256")
+        self.assertEqual(len(rows[0].vector), 256 * 4)
+
+        # Only the changed chunk is embedded again.
+        node.text = "one two three four seven"
+        self.assertEqual(embeddings.update_node_embeddings([node]), 1)
+        new_rows = list(models.NodeEmbedding.objects.filter(node=node).order_by("chunk"))
+        self.assertEqual(bytes(new_rows[0].vector), bytes(rows[0].vector))
+        self.assertNotEqual(new_rows[1].text_hash, rows[1].text_hash)
+
+        # The vectors of other embedders are kept.
+        other = models.NodeEmbedding.objects.create(
+            node=node, chunk=0, embedder="other", text_hash="hash", vector=b"\x00" * 4
+        )
+        node.title = node.text = None
+        self.assertEqual(embeddings.update_node_embeddings([node]), 0)
+        self.assertListEqual(list(models.NodeEmbedding.objects.filter(node=node)), [other])
+
+    def test_search(self) -> None:
+        space = factories.SpaceFactory.create()
+        other_space = factories.SpaceFactory.create()
+        dog = factories.NodeFactory.create(
+            title="Dogs", text="Dogs bark at the mailman.", space=space
+        )
+        cat = factories.NodeFactory.create(title="Cats", text="Cats purr on the sofa.", space=space)
+        other_dog = factories.NodeFactory.create(
+            title="Dogs", text="Dogs bark at the mailman.", space=other_space
+        )
+        embeddings.update_node_embeddings([dog, cat, other_dog])
+
+        results = embeddings.search("barking dogs", [space.pk])
+        self.assertListEqual([node_id for _, node_id in results], [dog.pk, cat.pk])
+        self.assertGreater(results[0][0], results[1][0])
+
+        results = embeddings.search("barking dogs", [space.pk, other_space.pk], limit=2)
+        self.assertSetEqual({node_id for _, node_id in results}, {dog.pk, other_dog.pk})
+
+        # The indexes are cached until the vectors of their space change.
+        with self.assertNumQueries(1):
+            embeddings.search("barking dogs", [space.pk, other_space.pk])
+        dog.delete()
+        self.assertListEqual(
+            [node_id for _, node_id in embeddings.search("barking dogs", [space.pk])], [cat.pk]
+        )
+        dog.title = "Parrots"
+        dog.is_removed = False
+        dog.save()
+        embeddings.update_node_embeddings([dog])
+        self.assertListEqual(
+            [node_id for _, node_id in embeddings.search("parrots", [space.pk])], [dog.pk, cat.pk]
+        )
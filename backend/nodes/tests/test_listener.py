@@ -0,0 +1,111 @@
+import asyncio
+import contextlib
+import uuid
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django import test
+
+from nodes import listener, models, sync
+from nodes.tests import factories
+from utils.testcases import BaseTransactionTestCase
+
+
+class NotificationDebouncerTestCase(test.SimpleTestCase):
+    def test_burst_is_dispatched_once_per_window(self) -> None:
+        """A burst of notifications results in one task per partition."""
+        public_ids = [str(uuid.uuid4()) for _ in range(20)]
+        debouncer = listener.NotificationDebouncer(window=1.0, partitions=4)
+
+        for i in range(500):
+            debouncer.add(public_ids[i % len(public_ids)], now=100.0 + i / 1000)
+
+        self.assertEqual(debouncer.timeout(now=100.5), 0.5)
+        self.assertListEqual(debouncer.pop_due(now=100.5), [])
+
+        expected_partitions = sorted(
+            {sync.partition_for_public_id(public_id, 4) for public_id in public_ids}
+        )
+        with mock.patch("nodes.tasks.queue_document_events") as queue_document_events:
+            self.assertListEqual(debouncer.dispatch(now=101.0), expected_partitions)
+        queue_document_events.assert_called_once_with(expected_partitions)
+
+        self.assertIsNone(debouncer.timeout(now=101.0))
+        self.assertDictEqual(
+            debouncer.stats,
+            {"received": 500, "documents": 20, "dispatched": len(expected_partitions)},
+        )
+
+    def test_window_is_not_extended(self) -> None:
+        """Notifications arriving during a window don't postpone the dispatch."""
+        debouncer = listener.NotificationDebouncer(window=1.0, partitions=1)
+        debouncer.add(str(uuid.uuid4()), now=0.0)
+        debouncer.add(str(uuid.uuid4()), now=0.9)
+
+        self.assertListEqual(debouncer.pop_due(now=1.0), [0])
+        self.assertListEqual(debouncer.pop_due(now=1.0), [])
+
+    def test_without_window(self) -> None:
+        """Without a window every batch of notifications is dispatched right away."""
+        debouncer = listener.NotificationDebouncer(window=0.0, partitions=2)
+        debouncer.add(str(uuid.uuid4()), now=5.0)
+
+        self.assertEqual(debouncer.timeout(now=5.0), 0.0)
+        self.assertEqual(len(debouncer.pop_due(now=5.0)), 1)
+
+    def test_invalid_payload_dispatches_all_partitions(self) -> None:
+        debouncer = listener.NotificationDebouncer(window=0.0, partitions=3)
+        with self.assertLogs("nodes.listener", level="WARNING"):
+            debouncer.add("", now=0.0)
+
+        self.assertListEqual(debouncer.pop_due(now=0.0), [0, 1, 2])
+
+
+class AsyncDocumentListenerTestCase(BaseTransactionTestCase):
+    async def test_events_are_processed_in_process(self) -> None:
+        """A document change is applied by the listener without going through Celery."""
+        document_listener = listener.AsyncDocumentListener(
+            listener.NotificationDebouncer(window=0.0, partitions=1)
+        )
+        listen_task = asyncio.create_task(document_listener.listen())
+        try:
+            await asyncio.wait_for(document_listener.listening.wait(), timeout=10)
+
+            public_id = str(uuid.uuid4())
+            with mock.patch("nodes.tasks.queue_document_events") as queue_document_events:
+                await sync_to_async(factories.DocumentFactory.create)(
+                    public_id=public_id,
+                    document_type=models.DocumentType.EDITOR,
+                    json=factories.content_for_text("in process"),
+                )
+                node = None
+                for _ in range(100):
+                    node = await models.Node.all_objects.filter(public_id=public_id).afirst()
+                    if node is not None:
+                        break
+                    await asyncio.sleep(0.05)
+            queue_document_events.assert_not_called()
+        finally:
+            listen_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await listen_task
+            await asyncio.gather(*document_listener.running)
+
+        self.assertIsNotNone(node)
+        self.assertEqual(node.text, "in process")
+        self.assertEqual(document_listener.debouncer.stats["received"], 1)
+        self.assertEqual(await models.DocumentEvent.objects.acount(), 0)
+
+    async def test_celery_fallback(self) -> None:
+        """If processing fails, the partition is handed over to Celery."""
+        document_listener = listener.AsyncDocumentListener(
+            listener.NotificationDebouncer(window=0.0, partitions=2)
+        )
+        with (
+            mock.patch("nodes.listener.process_partition", side_effect=RuntimeError),
+            mock.patch("nodes.tasks.queue_document_events") as queue_document_events,
+            self.assertLogs("nodes.listener", level="ERROR"),
+        ):
+            await document_listener.process(1)
+
+        queue_document_events.assert_called_once_with([1])
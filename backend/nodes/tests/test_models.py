@@ -1,8 +1,13 @@
 from itertools import chain
+from unittest import mock
+
+from django.contrib.postgres import search as pg_search
+from django.db.models import Value
 
 import permissions.models
 from nodes import models
 from nodes.tests import factories
+from utils import tokens
 from utils.testcases import BaseTestCase
 
 
@@ -51,6 +56,57 @@ class NodeModelTestCase(BaseTestCase):
         node.refresh_from_db()
         self.assertEqual(node.text_token_count, 2)
 
+    def test_node_text_is_counted_incrementally(self) -> None:
+        """Only the blocks that changed are counted again when the content changes."""
+        paragraphs = [f"Paragraph number {i} with some text." for i in range(5)]
+        content = {
+            "type": "doc",
+            "content": [
+                {"type": "paragraph", "content": [{"type": "text", "text": paragraph}]}
+                for paragraph in paragraphs
+            ],
+        }
+        node = factories.NodeFactory.create(content=content)
+        self.assertEqual(node.text, " ".join(paragraphs))
+        self.assertEqual(node.text_token_count, tokens.token_count(node.text))
+        self.assertEqual(len(node.text_blocks), 5)
+
+        content["content"][3]["content"][0]["text"] = "A changed paragraph."
+        node.content = content
+        with mock.patch("utils.tokens.token_counts", wraps=tokens.token_counts) as token_counts:
+            node.save()
+        token_counts.assert_called_once_with([" A changed paragraph."])
+
+        node.refresh_from_db()
+        self.assertEqual(
+            node.text, " ".join(paragraphs[:3] + ["A changed paragraph."] + paragraphs[4:])
+        )
+        self.assertEqual(node.text_token_count, tokens.token_count(node.text))
+
+        node.content = None
+        node.save()
+        self.assertEqual(node.text, "")
+        self.assertEqual(node.text_token_count, 0)
+        self.assertListEqual(node.text_blocks, [])
+
+    def test_search_vector_is_only_updated_for_text_changes(self) -> None:
+        node = factories.NodeFactory.create(title="title", content=factories.content_for_text("x"))
+        models.Node.all_objects.filter(pk=node.pk).update(
+            search_vector=pg_search.SearchVector(Value("stale"))
+        )
+
+        models.Node.all_objects.filter(pk=node.pk).update(title_token_count=10)
+        self.assertEqual(
+            models.Node.all_objects.values_list("search_vector", flat=True).get(pk=node.pk),
+            "'stale':1",
+        )
+
+        models.Node.all_objects.filter(pk=node.pk).update(title="new title")
+        self.assertEqual(
+            models.Node.all_objects.values_list("search_vector", flat=True).get(pk=node.pk),
+            "'new':1A 'titl':2A 'x':3C",
+        )
+
     def test_subnode_fetching(self) -> None:
         """Test that subnodes are fetched by depth."""
         third_level_subnodes = [factories.NodeFactory.create_batch(3) for _ in range(3)]
@@ -60,12 +116,33 @@ class NodeModelTestCase(BaseTestCase):
         node = factories.NodeFactory()
         node.subnodes.add(*second_level_subnodes)
 
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(2):
             nodes_at_depth = node.fetch_subnodes(2)
             self.assertEqual(len(nodes_at_depth[0]), 1)
             self.assertEqual(len(nodes_at_depth[1]), 3)
             self.assertEqual(len(nodes_at_depth[2]), 9)
             self.assertNotIn(3, nodes_at_depth)
+            # The fields of the context are loaded with the nodes.
+            for subnode in nodes_at_depth[2]:
+                self.assertIsNotNone(subnode.title)
+                self.assertIsNotNone(subnode.text)
+                subnode.description  # noqa: B018
+
+    def test_subnode_fetching_with_cycles(self) -> None:
+        """Test that nodes are only returned at their smallest depth, also for cycles."""
+        node, first, second, removed, below_removed = factories.NodeFactory.create_batch(5)
+        node.subnodes.add(first, second)
+        first.subnodes.add(second, removed)
+        second.subnodes.add(node, first)
+        removed.subnodes.add(below_removed)
+        removed.delete()
+
+        nodes_at_depth = node.fetch_subnodes(5)
+        self.assertEqual(
+            {depth: [subnode.pk for subnode in nodes] for depth, nodes in nodes_at_depth.items()},
+            {0: [node.pk], 1: sorted([first.pk, second.pk])},
+        )
+        self.assertEqual(node.fetch_subnodes(0), {0: [node]})
 
     def test_node_as_str(self) -> None:
         node = factories.NodeFactory.create(title="test", text="test text")
@@ -175,6 +252,128 @@ class NodeModelTestCase(BaseTestCase):
         # to specify its content.
         self.assertEqual(context.count(str(third_level_subnode.public_id)), 3)
 
+    def test_node_context_query_count(self) -> None:
+        """The context needs the same number of queries regardless of the size of the graph."""
+
+        def build_graph(width: int) -> models.Node:
+            node = factories.NodeFactory.create()
+            subnodes = factories.NodeFactory.create_batch(width)
+            node.subnodes.add(*subnodes)
+            for subnode in subnodes:
+                subnode.subnodes.add(*factories.NodeFactory.create_batch(width))
+            return node
+
+        small, large = build_graph(1), build_graph(6)
+        for node in (small, large):
+            # The depths, the nodes and the connections of the subgraph.
+            with self.assertNumQueries(3):
+                context = node.node_context_for_depth(4)
+            # The connections are listed in the order they were added.
+            for subnode in node.subnodes.all():
+                connections = ", ".join(
+                    str(public_id)
+                    for public_id in models.Node.subnodes.through.objects.filter(from_node=subnode)
+                    .order_by("pk")
+                    .values_list("to_node__public_id", flat=True)
+                )
+                self.assertIn(f" - Connects to: {connections}", context)
+
+    def test_cached_context(self) -> None:
+        node = factories.NodeFactory.create()
+        node.subnodes.add(*factories.NodeFactory.create_batch(2))
+
+        context = node.get_cached_context(2)
+        self.assertEqual(context, node.node_context_for_depth(2))
+        with self.assertNumQueries(0):
+            self.assertEqual(node.get_cached_context(2), context)
+        # The context is cached per depth and with or without edges.
+        with self.assertNumQueries(3):
+            node.get_cached_context(3)
+        with self.assertNumQueries(3):
+            node.get_cached_context(2, include_edges=True)
+
+    def test_cached_context_is_invalidated(self) -> None:
+        node = factories.NodeFactory.create()
+        subnode, other = factories.NodeFactory.create_batch(2)
+        node.subnodes.add(subnode)
+        node.get_cached_context(2)
+
+        # Nodes outside of the subgraph don't invalidate the context.
+        other.title = "Unrelated"
+        other.save()
+        with self.assertNumQueries(0):
+            node.get_cached_context(2)
+
+        subnode.title = "Changed title"
+        subnode.save()
+        self.assertIn("Changed title", node.get_cached_context(2))
+
+        subnode.subnodes.add(other)
+        self.assertIn("Unrelated", node.get_cached_context(2))
+
+        other.parents.remove(subnode)
+        self.assertNotIn("Unrelated", node.get_cached_context(2))
+
+        subnode.delete()
+        self.assertNotIn("Changed title", node.get_cached_context(2))
+        subnode.is_removed = False
+        subnode.save()
+        self.assertIn("Changed title", node.get_cached_context(2))
+
+
+class SpaceModelTestCase(BaseTestCase):
+    def test_space_ids_for_user_are_cached(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        factories.SpaceFactory.create()
+
+        read = permissions.models.READ
+        self.assertEqual(models.Space.get_space_ids_for_user(read, self.owner_user), [space.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(models.Space.get_space_ids_for_user(read, self.owner_user), [space.pk])
+        # The cache is per action.
+        with self.assertNumQueries(1):
+            models.Space.get_space_ids_for_user(permissions.models.WRITE, self.owner_user)
+
+    def test_space_ids_for_user_are_invalidated(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        read = permissions.models.READ
+        self.assertEqual(models.Space.get_space_ids_for_user(read, self.viewer_user), [])
+        self.assertEqual(models.Space.get_space_ids_for_user(read, self.owner_user), [space.pk])
+
+        membership = space.members.create(user=self.viewer_user, role=self.viewer_role)
+        self.assertEqual(models.Space.get_space_ids_for_user(read, self.viewer_user), [space.pk])
+        membership.delete()
+        self.assertEqual(models.Space.get_space_ids_for_user(read, self.viewer_user), [])
+
+        space.is_public = True
+        space.save()
+        self.assertEqual(models.Space.get_space_ids_for_user(read, self.viewer_user), [space.pk])
+        self.assertEqual(models.Space.get_space_ids_for_user(read), [space.pk])
+
+        space.is_removed = True
+        space.save()
+        self.assertEqual(models.Space.get_space_ids_for_user(read, self.owner_user), [])
+        self.assertEqual(models.Space.get_space_ids_for_user(read), [])
+
+        # Saving a space without changing its visibility keeps the cached IDs.
+        models.Space.get_space_ids_for_user(read, self.owner_user)
+        space.title = "Renamed"
+        space.save()
+        with self.assertNumQueries(0):
+            models.Space.get_space_ids_for_user(read, self.owner_user)
+
+    def test_any_lookup(self) -> None:
+        spaces = factories.SpaceFactory.create_batch(3)
+        node = factories.NodeFactory.create(space=spaces[0])
+        space_ids = [spaces[0].pk, spaces[1].pk]
+
+        self.assertQuerySetEqual(
+            models.Space.objects.filter(pk__any=space_ids).order_by("pk"), spaces[:2]
+        )
+        self.assertQuerySetEqual(models.Node.objects.filter(space_id__any=space_ids), [node])
+        self.assertQuerySetEqual(models.Node.objects.filter(space__any=space_ids), [node])
+        self.assertFalse(models.Space.objects.filter(pk__any=[]).exists())
+
 
 class MethodNodeModelTestCase(BaseTestCase):
     def test_role_annotation_query_owner(self) -> None:
@@ -1,6 +1,11 @@
+import threading
 import uuid
+from unittest import mock
 
-from nodes import models, tasks
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from nodes import models, sync, tasks
 from nodes.tests import factories, fixtures
 from utils.testcases import BaseTransactionTestCase
 
@@ -17,6 +22,64 @@ class NodeEventTestCase(BaseTransactionTestCase):
 
         self.assertEqual(models.DocumentEvent.objects.count(), 1)
 
+    def test_document_trigger_is_compact(self) -> None:
+        """Test that the trigger only records the document and notifies with its public ID."""
+        public_id = str(uuid.uuid4())
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {models.PG_NOTIFY_CHANNEL};")
+        try:
+            document = factories.DocumentFactory.create(
+                public_id=public_id,
+                document_type=models.DocumentType.EDITOR,
+                json=factories.content_for_text("first"),
+            )
+            document.json = factories.content_for_text("second")
+            document.save()
+            notifies = list(connection.connection.notifies(timeout=1, stop_after=2))
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"UNLISTEN {models.PG_NOTIFY_CHANNEL};")
+
+        self.assertListEqual([notify.payload for notify in notifies], [public_id, public_id])
+        self.assertListEqual(
+            list(
+                models.DocumentEvent.objects.order_by("pk").values_list(
+                    "action", "old_data", "new_data"
+                )
+            ),
+            [
+                (models.DocumentEvent.EventType.INSERT, None, None),
+                (models.DocumentEvent.EventType.UPDATE, None, None),
+            ],
+        )
+
+    def test_compact_events_use_current_document(self) -> None:
+        """Test that events without data are applied with the current data of the document."""
+        public_id = str(uuid.uuid4())
+        document = factories.DocumentFactory.create(
+            public_id=public_id,
+            document_type=models.DocumentType.EDITOR,
+            json=factories.content_for_text("first"),
+        )
+        models.Document.objects.filter(pk=document.pk).update(
+            json=factories.content_for_text("second")
+        )
+        graph_document = factories.DocumentFactory.create(
+            public_id=public_id, document_type=models.DocumentType.GRAPH, json=fixtures.GRAPH
+        )
+
+        tasks.process_document_events(raise_exception=True)
+
+        node = models.Node.all_objects.get(public_id=public_id)
+        self.assertEqual(node.text, "second")
+        self.assertEqual(node.editor_document, document)
+        self.assertEqual(node.graph_document, graph_document)
+        self.assertSetEqual(
+            {str(subnode.public_id) for subnode in node.subnodes.all()},
+            set(fixtures.GRAPH["nodes"]),
+        )
+        self.assertEqual(models.DocumentEvent.objects.count(), 0)
+
     def test_node_create(self) -> None:
         """Test that a new node is created."""
         self.assertEqual(models.Node.all_objects.count(), 0)
@@ -83,6 +146,23 @@ class NodeEventTestCase(BaseTransactionTestCase):
         self.assertEqual(models.Node.all_objects.count(), 3)
         self.assertEqual(models.DocumentEvent.objects.count(), 0)
 
+    def test_graph_event_invalidates_cached_context(self) -> None:
+        node = factories.NodeFactory.create()
+        context = node.get_cached_context(2)
+
+        factories.DocumentEventFactory.create(
+            public_id=node.public_id,
+            action="INSERT",
+            new_data=fixtures.GRAPH,
+            document_type=models.DocumentType.GRAPH,
+        )
+        tasks.process_document_events(raise_exception=True)
+
+        new_context = node.get_cached_context(2)
+        self.assertNotEqual(new_context, context)
+        for public_id in fixtures.GRAPH["nodes"]:
+            self.assertIn(public_id, new_context)
+
     def test_graph_and_node_create(self) -> None:
         """Test that a new graph is created."""
         self.assertEqual(models.Node.all_objects.count(), 0)
@@ -213,3 +293,316 @@ class NodeEventTestCase(BaseTransactionTestCase):
         self.assertIsNotNone(node)
         assert node is not None
         self.assertEqual(node.node_type, models.NodeType.METHOD)
+
+    def test_batch_query_count_is_independent_of_batch_size(self) -> None:
+        """Processing a batch should take the same number of queries regardless of its size."""
+
+        def create_events(count: int) -> None:
+            for _ in range(count):
+                factories.DocumentEventFactory.create(
+                    public_id=str(uuid.uuid4()),
+                    action="INSERT",
+                    new_data=fixtures.EDITOR_WITHOUT_NODES,
+                    document_type=models.DocumentType.EDITOR,
+                )
+
+        create_events(2)
+        with CaptureQueriesContext(connection) as small_batch:
+            tasks.process_document_events(raise_exception=True)
+
+        create_events(20)
+        with CaptureQueriesContext(connection) as large_batch:
+            tasks.process_document_events(raise_exception=True)
+
+        self.assertEqual(len(small_batch), len(large_batch))
+        self.assertEqual(models.Node.all_objects.count(), 22)
+        self.assertEqual(models.DocumentEvent.objects.count(), 0)
+        self.assertFalse(models.Node.all_objects.filter(text_token_count__isnull=True).exists())
+
+    def test_batches_are_processed_in_order(self) -> None:
+        """Later events in the queue should win, even if they are spread over several batches."""
+        space = factories.SpaceFactory.create()
+        node_id = next(iter(fixtures.SPACE["nodes"]))
+
+        for title in ("First", "Second", "Third"):
+            factories.DocumentEventFactory.create(
+                public_id=str(space.public_id),
+                action="UPDATE",
+                new_data={"nodes": {node_id: {"id": node_id, "title": title}}},
+                document_type=models.DocumentType.SPACE,
+            )
+        factories.DocumentEventFactory.create(
+            public_id=node_id,
+            action="UPDATE",
+            new_data=fixtures.EDITOR_WITHOUT_NODES,
+            document_type=models.DocumentType.EDITOR,
+        )
+
+        tasks.process_document_events(raise_exception=True, batch_size=2)
+
+        self.assertEqual(models.DocumentEvent.objects.count(), 0)
+        node = models.Node.all_objects.get(public_id=node_id)
+        self.assertEqual(node.title, "Third")
+        self.assertEqual(node.space, space)
+        self.assertEqual(node.text, "Test This is node 2!")
+
+    def test_batch_subnodes_and_documents(self) -> None:
+        """Nodes created within a batch get their documents and subnodes connected."""
+        public_id = str(uuid.uuid4())
+        graph_document = factories.DocumentFactory.create(
+            public_id=public_id, document_type=models.DocumentType.GRAPH, json=fixtures.GRAPH
+        )
+        # The trigger created an event for the document above, replace it with our own events.
+        models.DocumentEvent.objects.all().delete()
+
+        factories.DocumentEventFactory.create(
+            public_id=public_id,
+            action="INSERT",
+            new_data=fixtures.GRAPH,
+            document_type=models.DocumentType.GRAPH,
+        )
+        factories.DocumentEventFactory.create(
+            public_id=public_id,
+            action="UPDATE",
+            new_data=fixtures.EDITOR_WITH_NODES,
+            document_type=models.DocumentType.EDITOR,
+        )
+
+        tasks.process_document_events(raise_exception=True)
+
+        node = models.Node.all_objects.get(public_id=public_id)
+        self.assertEqual(node.graph_document, graph_document)
+        self.assertEqual(node.text, "Test Test Hey")
+        self.assertSetEqual(
+            set(map(str, node.subnodes.values_list("public_id", flat=True))),
+            set(fixtures.GRAPH["nodes"]),
+        )
+
+    def test_superseded_events_are_skipped(self) -> None:
+        """Only the latest event per document is applied, the others are discarded."""
+        public_id = str(uuid.uuid4())
+        for text in ("First", "Second", "Third"):
+            factories.DocumentEventFactory.create(
+                public_id=public_id,
+                action="UPDATE",
+                new_data=factories.content_for_text(text),
+                document_type=models.DocumentType.EDITOR,
+            )
+        space = factories.SpaceFactory.create()
+        factories.DocumentEventFactory.create(
+            public_id=str(space.public_id),
+            action="UPDATE",
+            new_data=fixtures.SPACE,
+            document_type=models.DocumentType.SPACE,
+        )
+
+        stats = tasks.process_document_events(raise_exception=True)
+
+        self.assertDictEqual(stats, {"processed": 2, "skipped": 2, "unchanged": 0})
+        self.assertEqual(models.DocumentEvent.objects.count(), 0)
+        self.assertEqual(models.Node.all_objects.get(public_id=public_id).text, "Third")
+        self.assertEqual(space.nodes.count(), 4)
+
+    def test_events_superseded_by_a_later_batch_are_skipped(self) -> None:
+        """Events are also skipped if the newer event is only part of a later batch."""
+        public_id = str(uuid.uuid4())
+        for text in ("First", "Second", "Third", "Fourth", "Fifth"):
+            factories.DocumentEventFactory.create(
+                public_id=public_id,
+                action="UPDATE",
+                new_data=factories.content_for_text(text),
+                document_type=models.DocumentType.EDITOR,
+            )
+
+        stats = tasks.process_document_events(raise_exception=True, batch_size=2)
+
+        self.assertDictEqual(stats, {"processed": 1, "skipped": 4, "unchanged": 0})
+        self.assertEqual(models.Node.all_objects.get(public_id=public_id).text, "Fifth")
+
+    def test_unchanged_nodes_are_not_written(self) -> None:
+        """Events that don't change the projection of a node don't touch the database."""
+        public_id = str(uuid.uuid4())
+        factories.DocumentEventFactory.create(
+            public_id=public_id,
+            action="UPDATE",
+            new_data=factories.content_for_text("Same"),
+            document_type=models.DocumentType.EDITOR,
+        )
+        tasks.process_document_events(raise_exception=True)
+        updated_at = models.Node.all_objects.get(public_id=public_id).updated_at
+
+        factories.DocumentEventFactory.create(
+            public_id=public_id,
+            action="UPDATE",
+            new_data=factories.content_for_text("Same"),
+            document_type=models.DocumentType.EDITOR,
+        )
+        with mock.patch.object(models.Node.all_objects, "bulk_update") as bulk_update:
+            stats = tasks.process_document_events(raise_exception=True)
+
+        bulk_update.assert_not_called()
+        self.assertDictEqual(stats, {"processed": 1, "skipped": 0, "unchanged": 1})
+        self.assertEqual(models.Node.all_objects.get(public_id=public_id).updated_at, updated_at)
+
+    def test_nodes_are_updated_by_changed_fields(self) -> None:
+        """Nodes are only written with the fields that changed for them."""
+        space = factories.SpaceFactory.create()
+        renamed, edited = (
+            factories.NodeFactory.create(title="Title", space=space) for _ in range(2)
+        )
+        models.DocumentEvent.objects.all().delete()
+
+        factories.DocumentEventFactory.create(
+            public_id=str(space.public_id),
+            action="UPDATE",
+            new_data={
+                "nodes": {
+                    str(node.public_id): {
+                        "id": str(node.public_id),
+                        "title": "New title" if node == renamed else "Title",
+                    }
+                    for node in (renamed, edited)
+                }
+            },
+            document_type=models.DocumentType.SPACE,
+        )
+        factories.DocumentEventFactory.create(
+            public_id=str(edited.public_id),
+            action="UPDATE",
+            new_data=factories.content_for_text("New text"),
+            document_type=models.DocumentType.EDITOR,
+        )
+
+        with mock.patch.object(
+            models.Node.all_objects, "bulk_update", wraps=models.Node.all_objects.bulk_update
+        ) as bulk_update:
+            tasks.process_document_events(raise_exception=True)
+
+        self.assertCountEqual(
+            [
+                ([node.pk for node in nodes], fields)
+                for (nodes, fields), _ in bulk_update.call_args_list
+            ],
+            [
+                ([renamed.pk], ("title", "title_token_count")),
+                (
+                    [edited.pk],
+                    ("content", "text", "text_blocks", "text_token_count", "updated_at"),
+                ),
+            ],
+        )
+        renamed.refresh_from_db()
+        edited.refresh_from_db()
+        self.assertEqual(renamed.title, "New title")
+        self.assertEqual(edited.title, "Title")
+        self.assertEqual(edited.text, "New text")
+
+    def test_unchanged_node_save_is_skipped(self) -> None:
+        node = factories.NodeFactory.create(title="Title")
+        node = models.Node.all_objects.get(pk=node.pk)
+
+        with self.assertNumQueries(0):
+            node.save()
+            node.title = "Title"
+            node.save(update_fields=["title"])
+
+        node.title = "New title"
+        with self.assertNumQueries(1):
+            node.save(update_fields=["title"])
+        self.assertEqual(models.Node.all_objects.get(pk=node.pk).title_token_count, 2)
+
+        # Fields of subclasses aren't tracked, so method nodes are always saved.
+        method = factories.MethodNodeFactory.create()
+        method = models.MethodNode.all_objects.get(pk=method.pk)
+        self.assertTrue(method.has_unsaved_changes())
+        self.assertFalse(method.has_unsaved_changes(["title"]))
+
+
+class PartitionedNodeEventTestCase(BaseTransactionTestCase):
+    def test_partition_matches_database(self) -> None:
+        """The partition calculated in Python has to match the one calculated by the database."""
+        public_ids = [uuid.uuid4() for _ in range(50)]
+        for public_id in public_ids:
+            factories.DocumentEventFactory.create(
+                public_id=public_id, action="UPDATE", document_type=models.DocumentType.EDITOR
+            )
+
+        database_partitions = dict(
+            models.DocumentEvent.objects.annotate(
+                partition=sync.DocumentPartition("public_id", 7)
+            ).values_list("public_id", "partition")
+        )
+        self.assertDictEqual(
+            database_partitions,
+            {public_id: sync.partition_for_public_id(public_id, 7) for public_id in public_ids},
+        )
+
+    def test_partition_out_of_range(self) -> None:
+        with self.settings(NODE_CRDT_EVENTS_PARTITIONS=2), self.assertRaises(ValueError):
+            tasks.process_document_events(partition=2)
+
+    def test_concurrent_partitions_keep_document_order(self) -> None:
+        """
+        Workers for different partitions run in parallel, multiple workers for the same partition
+        are serialized, and the events of each document are applied in the order they were queued.
+        Coalescing is disabled, otherwise only the latest event of most documents would be applied.
+        """
+        partitions = 4
+        public_ids = [str(uuid.uuid4()) for _ in range(20)]
+        versions: dict[int, tuple[str, int]] = {}
+        for version in range(5):
+            for public_id in public_ids:
+                event = factories.DocumentEventFactory.create(
+                    public_id=public_id,
+                    action="UPDATE",
+                    new_data=factories.content_for_text(f"{public_id} {version}"),
+                    document_type=models.DocumentType.EDITOR,
+                )
+                versions[event.pk] = (public_id, version)
+
+        errors: list[Exception] = []
+        applied: list[tuple[str, int]] = []
+        apply = sync.DocumentEventBatch.apply
+
+        def record_apply(batch: sync.DocumentEventBatch, event: models.DocumentEvent) -> None:
+            applied.append(versions[event.pk])
+            apply(batch, event)
+
+        def worker(partition: int) -> None:
+            try:
+                tasks.process_document_events(
+                    raise_exception=True, batch_size=7, partition=partition
+                )
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        with (
+            self.settings(NODE_CRDT_EVENTS_PARTITIONS=partitions),
+            mock.patch.object(sync, "coalesce_events", side_effect=lambda events: (events, [])),
+            mock.patch.object(
+                sync.DocumentEventBatch, "apply", autospec=True, side_effect=record_apply
+            ),
+        ):
+            # Two workers per partition to also check that they don't step on each other.
+            threads = [
+                threading.Thread(target=worker, args=(partition,))
+                for partition in list(range(partitions)) * 2
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertListEqual(errors, [])
+        self.assertEqual(models.DocumentEvent.objects.count(), 0)
+        for public_id in public_ids:
+            self.assertListEqual(
+                [version for applied_id, version in applied if applied_id == public_id],
+                list(range(5)),
+            )
+        self.assertDictEqual(
+            dict(models.Node.all_objects.values_list("public_id", "text")),
+            {uuid.UUID(public_id): f"{public_id} 4" for public_id in public_ids},
+        )
@@ -1,10 +1,13 @@
-from datetime import timedelta
+import json
+from datetime import datetime, timedelta
 from hashlib import sha256
+from unittest import mock
 
 from django.utils import timezone
 
-from nodes import models, tasks
+from nodes import embeddings, models, tasks
 from nodes.tests import factories
+from utils import compression
 from utils.testcases import BaseTransactionTestCase
 
 
@@ -14,8 +17,9 @@ class DocumentVersioningTestCase(BaseTransactionTestCase):
         document = factories.DocumentFactory(json={"test": "data"}, data=b"test data")
 
         # Run the task
-        with self.assertNumQueries(3):
-            # Two queries to check and one insert to create the version
+        with self.assertNumQueries(5):
+            # One query to check, then one transaction to insert the versions and update the
+            # versioned hashes
             tasks.document_versioning()
 
         # Since there wasn't any previous version, there should be only one version now
@@ -23,15 +27,16 @@ class DocumentVersioningTestCase(BaseTransactionTestCase):
         document_version = models.DocumentVersion.available_objects.all()[0]
 
         self.assertEqual(document_version.document, document)
-        self.assertEqual(document_version.data, b"test data")
-        self.assertEqual(
-            document_version.json_hash, sha256(str(document.json).encode()).hexdigest()
-        )
+        self.assertEqual(document_version.codec, compression.Codec.ZSTD)
+        self.assertEqual(document_version.get_data(), b"test data")
+        document.refresh_from_db()
+        self.assertEqual(document_version.json_hash, document.json_hash)
+        self.assertEqual(document.last_versioned_hash, document.json_hash)
         self.assertEqual(document_version.document_type, document.document_type)
 
         # Run the task again
-        with self.assertNumQueries(2):
-            # Only two queries to check and no inserts
+        with self.assertNumQueries(1):
+            # Only one query to check and no inserts
             tasks.document_versioning()
 
         # There should be no new versions since the document hasn't changed and the interval hasn't
@@ -58,17 +63,16 @@ class DocumentVersioningTestCase(BaseTransactionTestCase):
         last_document_version = models.DocumentVersion.available_objects.last()
         assert last_document_version is not None  # For mypy
         self.assertEqual(last_document_version.document, document)
-        self.assertEqual(last_document_version.data, b"new data")
-        self.assertEqual(
-            last_document_version.json_hash, sha256(str(document.json).encode()).hexdigest()
-        )
+        self.assertEqual(last_document_version.get_data(), b"new data")
+        document.refresh_from_db()
+        self.assertEqual(last_document_version.json_hash, document.json_hash)
         self.assertEqual(last_document_version.document_type, document.document_type)
 
         # But if we run the task again, there should be no new versions since the document hasn't
         # changed
 
-        with self.assertNumQueries(2):
-            # Only two queries to check and no inserts
+        with self.assertNumQueries(1):
+            # Only one query to check and no inserts
             tasks.document_versioning()
         self.assertEqual(models.DocumentVersion.available_objects.count(), 2)
 
@@ -107,8 +111,8 @@ class DocumentVersioningTestCase(BaseTransactionTestCase):
         tasks.document_versioning()
         self.assertEqual(models.DocumentVersion.available_objects.count(), 2)
 
-        # However if we make objects even older, they will get skipped because we're limiting the
-        # query to only the last 24 hours for performance reasons.
+        # Making the objects even older doesn't change that, since the document still has the same
+        # hash as the last version.
         models.DocumentVersion.available_objects.update(
             created_at=timezone.now() - timedelta(hours=25),
             updated_at=timezone.now() - timedelta(hours=25),
@@ -121,3 +125,161 @@ class DocumentVersioningTestCase(BaseTransactionTestCase):
         # Run the task again
         tasks.document_versioning()
         self.assertEqual(models.DocumentVersion.available_objects.count(), 2)
+
+    def test_document_json_hash(self) -> None:
+        """The hash of the JSON is maintained by the database."""
+        document = factories.DocumentFactory(json={"test": "data"}, data=b"test data")
+        document.refresh_from_db()
+        self.assertEqual(document.json_hash, sha256(json.dumps(document.json).encode()).hexdigest())
+        self.assertEqual(document.last_versioned_hash, "")
+
+        models.Document.objects.filter(pk=document.pk).update(json={"new": "data"})
+        document.refresh_from_db()
+        self.assertEqual(document.json_hash, sha256(b'{"new": "data"}').hexdigest())
+
+    def test_versioning_does_not_create_document_events(self) -> None:
+        factories.DocumentFactory.create_batch(3, json={"test": "data"}, data=b"test data")
+        models.DocumentEvent.objects.all().delete()
+
+        self.assertEqual(tasks.document_versioning(), 3)
+
+        self.assertEqual(models.DocumentVersion.available_objects.count(), 3)
+        self.assertEqual(models.DocumentEvent.objects.count(), 0)
+
+    def test_versioning_in_batches(self) -> None:
+        documents = factories.DocumentFactory.create_batch(5, json={"test": "data"}, data=b"data")
+
+        with self.assertNumQueries(3 * 5):
+            # Three batches with a check and a transaction with an insert and an update each
+            self.assertEqual(tasks.document_versioning(batch_size=2), 5)
+
+        self.assertSetEqual(
+            set(models.DocumentVersion.available_objects.values_list("document_id", flat=True)),
+            {document.pk for document in documents},
+        )
+
+    def test_versioning_without_compression(self) -> None:
+        factories.DocumentFactory(json={"test": "data"}, data=b"test data")
+
+        with self.settings(NODE_VERSIONING_CODEC=compression.Codec.NONE):
+            tasks.document_versioning()
+
+        document_version = models.DocumentVersion.available_objects.get()
+        self.assertEqual(document_version.codec, compression.Codec.NONE)
+        self.assertEqual(bytes(document_version.data), b"test data")
+
+
+class DocumentVersionRetentionTestCase(BaseTransactionTestCase):
+    def create_version(
+        self, document: models.Document, created_at: datetime
+    ) -> models.DocumentVersion:
+        version = factories.DocumentVersionFactory(document=document)
+        models.DocumentVersion.all_objects.filter(pk=version.pk).update(created_at=created_at)
+        return version
+
+    def create_versions(self) -> tuple[set[int], set[int]]:
+        """Create versions in all retention tiers, returns the IDs to keep and to remove."""
+        now = timezone.now()
+        document = factories.DocumentFactory()
+        other_document = factories.DocumentFactory()
+        keep, remove = set(), set()
+
+        # All versions of the last 24 hours are kept.
+        keep.add(self.create_version(document, now - timedelta(minutes=5)).pk)
+        keep.add(self.create_version(document, now - timedelta(minutes=10)).pk)
+
+        # Only the latest version per hour is kept for 30 days.
+        hour = (now - timedelta(days=3)).replace(minute=0, second=0, microsecond=0)
+        remove.add(self.create_version(document, hour + timedelta(minutes=5)).pk)
+        remove.add(self.create_version(document, hour + timedelta(minutes=10)).pk)
+        keep.add(self.create_version(document, hour + timedelta(minutes=20)).pk)
+        keep.add(self.create_version(document, hour + timedelta(minutes=65)).pk)
+        # Versions are thinned per document.
+        keep.add(self.create_version(other_document, hour + timedelta(minutes=5)).pk)
+
+        # Only the latest version per day is kept after that.
+        day = (now - timedelta(days=40)).replace(hour=0, minute=0, second=0, microsecond=0)
+        remove.add(self.create_version(document, day + timedelta(hours=1)).pk)
+        remove.add(self.create_version(document, day + timedelta(hours=5)).pk)
+        keep.add(self.create_version(document, day + timedelta(hours=23)).pk)
+        keep.add(self.create_version(document, day + timedelta(hours=25)).pk)
+
+        return keep, remove
+
+    def test_thin_document_versions(self) -> None:
+        keep, remove = self.create_versions()
+
+        self.assertEqual(tasks.thin_document_versions(batch_size=3), len(remove))
+
+        self.assertSetEqual(
+            set(models.DocumentVersion.available_objects.values_list("pk", flat=True)), keep
+        )
+        # The versions are only soft-deleted by default.
+        self.assertSetEqual(
+            set(
+                models.DocumentVersion.all_objects.filter(is_removed=True).values_list(
+                    "pk", flat=True
+                )
+            ),
+            remove,
+        )
+
+        # Running the task again doesn't remove any more versions.
+        self.assertEqual(tasks.thin_document_versions(), 0)
+
+    def test_thin_document_versions_hard_delete(self) -> None:
+        keep, _ = self.create_versions()
+
+        with self.settings(NODE_VERSIONING_RETENTION_HARD_DELETE=True):
+            tasks.thin_document_versions()
+
+        self.assertSetEqual(
+            set(models.DocumentVersion.all_objects.values_list("pk", flat=True)), keep
+        )
+
+
+class NodeEmbeddingsTaskTestCase(BaseTransactionTestCase):
+    def test_update_node_embeddings(self) -> None:
+        node = factories.NodeFactory.create(title="Dogs", text="Dogs bark.")
+        unchanged = factories.NodeFactory.create(title="Cats", text="Cats purr.")
+        self.assertTrue(node.embeddings_stale)
+
+        self.assertEqual(tasks.update_node_embeddings(batch_size=1), 2)
+        self.assertEqual(models.NodeEmbedding.objects.count(), 2)
+        self.assertFalse(models.Node.objects.filter(embeddings_stale=True).exists())
+        self.assertEqual(tasks.update_node_embeddings(), 0)
+
+        # The trigger flags nodes whose title or text changed.
+        node = models.Node.objects.get(pk=node.pk)
+        unchanged = models.Node.objects.get(pk=unchanged.pk)
+        node.title = "Barking dogs"
+        node.save()
+        unchanged.description = "Not embedded"
+        unchanged.save()
+        self.assertListEqual(
+            list(models.Node.objects.filter(embeddings_stale=True).values_list("pk", flat=True)),
+            [node.pk],
+        )
+        self.assertEqual(tasks.update_node_embeddings(), 1)
+        node.refresh_from_db()
+        self.assertFalse(node.embeddings_stale)
+
+    def test_nodes_changed_while_embedding_stay_stale(self) -> None:
+        node = factories.NodeFactory.create(title="Dogs", text="Dogs bark.")
+        factories.NodeFactory.create(title="Cats", text="Cats purr.")
+        embed_nodes = embeddings.embed_nodes
+
+        def embed_and_edit(nodes: list[models.Node]) -> tuple[list[models.NodeEmbedding], int]:
+            result = embed_nodes(nodes)
+            models.Node.all_objects.filter(pk=node.pk).update(text="Dogs howl.")
+            return result
+
+        with mock.patch.object(embeddings, "embed_nodes", side_effect=embed_and_edit):
+            self.assertEqual(tasks.update_node_embeddings(), 2)
+
+        self.assertListEqual(
+            list(models.Node.objects.filter(embeddings_stale=True).values_list("pk", flat=True)),
+            [node.pk],
+        )
+        self.assertEqual(tasks.update_node_embeddings(), 1)
+        self.assertFalse(models.Node.objects.filter(embeddings_stale=True).exists())
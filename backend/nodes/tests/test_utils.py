@@ -1,3 +1,5 @@
+import sys
+
 from django.test import SimpleTestCase
 
 from nodes import utils
@@ -7,5 +9,64 @@ from nodes.tests import fixtures
 class NodeExtractionTestCase(SimpleTestCase):
     def test_extract_text_from_node(self) -> None:
         """Test that text is extracted from a node."""
-        text = utils.extract_text_from_node(fixtures.EDITOR_WITH_NODES["default"])
+        text = list(utils.extract_text_from_node(fixtures.EDITOR_WITH_NODES["default"]))
         self.assertListEqual(text, ["Test", "Test", "Hey"])
+
+    def test_extract_text_with_block_separator(self) -> None:
+        """Block boundaries are kept if requested, empty blocks don't add a separator."""
+        text = "".join(
+            utils.extract_text_from_node(
+                fixtures.EDITOR_WITH_NODES["default"], block_separator="\n"
+            )
+        )
+        self.assertEqual(text, "Test\nTest\nHey\n")
+
+        nested = {
+            "type": "doc",
+            "content": [
+                {"type": "heading", "content": [{"type": "text", "text": "Title"}]},
+                {
+                    "type": "bulletList",
+                    "content": [
+                        {
+                            "type": "listItem",
+                            "content": [
+                                {"type": "paragraph", "content": [{"type": "text", "text": "a"}]}
+                            ],
+                        },
+                        {
+                            "type": "listItem",
+                            "content": [
+                                {"type": "paragraph", "content": [{"type": "text", "text": "b"}]}
+                            ],
+                        },
+                    ],
+                },
+            ],
+        }
+        self.assertListEqual(
+            list(utils.extract_text_from_node(nested, block_separator="\n")),
+            ["Title", "\n", "a", "\n", "b", "\n"],
+        )
+
+    def test_extract_text_from_deeply_nested_node(self) -> None:
+        """Nesting deeper than the recursion limit doesn't fail."""
+        node: dict = {"type": "text", "text": "deep"}
+        for _ in range(sys.getrecursionlimit() * 2):
+            node = {"type": "blockquote", "content": [node]}
+
+        self.assertListEqual(list(utils.extract_text_from_node(node)), ["deep"])
+
+    def test_extract_text_from_empty_node(self) -> None:
+        self.assertListEqual(list(utils.extract_text_from_node(None)), [])
+        self.assertListEqual(list(utils.extract_text_from_node({"type": "doc"})), [])
+
+    def test_extract_text_blocks(self) -> None:
+        """Blocks without text are skipped, joining the blocks gives the full text."""
+        document = fixtures.EDITOR_WITH_NODES["default"]
+        blocks = utils.extract_text_blocks(document)
+        self.assertListEqual(blocks, ["Test", "Test", "Hey"])
+        self.assertEqual(" ".join(blocks), " ".join(utils.extract_text_from_node(document)))
+
+        self.assertListEqual(utils.extract_text_blocks(None), [])
+        self.assertListEqual(utils.extract_text_blocks({"type": "text", "text": "a"}), ["a"])
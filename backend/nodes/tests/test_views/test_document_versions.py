@@ -1,7 +1,10 @@
+from unittest import mock
+
 from django.urls import reverse
 
 import nodes.models
 from nodes.tests import factories
+from utils import compression
 from utils.testcases import BaseTransactionTestCase
 
 
@@ -19,6 +22,21 @@ class DocumentVersionViewTestCase(BaseTransactionTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["count"], 1)
 
+    def test_list_document_with_several_paths(self) -> None:
+        """Versions of a document that is readable through several paths are listed once."""
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        document = factories.DocumentFactory.create()
+        space.document = document
+        space.save()
+        factories.NodeFactory.create(space=space, editor_document=document)
+        factories.NodeFactory.create(space=space, graph_document=document)
+        factories.DocumentVersionFactory.create(document=document)
+
+        response = self.owner_client.get(reverse("nodes:document-versions-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(len(response.data["results"]), 1)
+
     def test_retrieve(self) -> None:
         space = factories.SpaceFactory.create(owner=self.owner_user)
         document = factories.DocumentFactory.create()
@@ -31,6 +49,107 @@ class DocumentVersionViewTestCase(BaseTransactionTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["id"], str(document_version.public_id))
 
+    def test_crdt(self) -> None:
+        """The CRDT data is returned uncompressed, regardless of the codec it's stored with."""
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        document = factories.DocumentFactory.create()
+        factories.NodeFactory.create(space=space, editor_document=document)
+
+        for codec in compression.Codec.values:
+            document_version = factories.DocumentVersionFactory.build(document=document)
+            document_version.set_data(b"crdt data", codec)
+            document_version.save()
+
+            response = self.owner_client.get(
+                reverse("nodes:document-versions-crdt", args=[document_version.public_id])
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"crdt data")
+            self.assertEqual(response["Content-Length"], "9")
+            self.assertEqual(response["ETag"], f'"{document_version.json_hash}"')
+
+    def test_crdt_chunks(self) -> None:
+        """The CRDT data is streamed in chunks."""
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        document = factories.DocumentFactory.create()
+        factories.NodeFactory.create(space=space, editor_document=document)
+        data = bytes(range(256)) * 40
+
+        for codec in compression.Codec.values:
+            document_version = factories.DocumentVersionFactory.build(document=document)
+            document_version.set_data(data, codec)
+            document_version.save()
+
+            with mock.patch("nodes.views.CRDT_CHUNK_SIZE", 1024):
+                response = self.owner_client.get(
+                    reverse("nodes:document-versions-crdt", args=[document_version.public_id])
+                )
+            self.assertEqual(response.status_code, 200)
+            chunks = list(response.streaming_content)
+            self.assertGreater(len(chunks), 1)
+            self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+            self.assertEqual(b"".join(chunks), data)
+
+    def test_crdt_not_modified(self) -> None:
+        """A matching If-None-Match returns 304 without loading the data."""
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        document = factories.DocumentFactory.create()
+        factories.NodeFactory.create(space=space, editor_document=document)
+        document_version = factories.DocumentVersionFactory.create(document=document)
+        url = reverse("nodes:document-versions-crdt", args=[document_version.public_id])
+
+        response = self.owner_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with mock.patch.object(
+            nodes.models.DocumentVersion, "iter_data", side_effect=AssertionError
+        ):
+            response = self.owner_client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.owner_client.get(url, headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_crdt_range(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        document = factories.DocumentFactory.create()
+        factories.NodeFactory.create(space=space, editor_document=document)
+        data = b"0123456789" * 1000
+
+        for codec in compression.Codec.values:
+            document_version = factories.DocumentVersionFactory.build(document=document)
+            document_version.set_data(data, codec)
+            document_version.save()
+            url = reverse("nodes:document-versions-crdt", args=[document_version.public_id])
+
+            for header, expected_range, expected_data in [
+                ("bytes=0-9", "bytes 0-9/10000", data[:10]),
+                ("bytes=5000-", "bytes 5000-9999/10000", data[5000:]),
+                ("bytes=-15", "bytes 9985-9999/10000", data[-15:]),
+                ("bytes=9990-20000", "bytes 9990-9999/10000", data[9990:]),
+            ]:
+                with mock.patch("nodes.views.CRDT_CHUNK_SIZE", 1024):
+                    response = self.owner_client.get(url, headers={"Range": header})
+                self.assertEqual(response.status_code, 206, header)
+                self.assertEqual(response["Content-Range"], expected_range)
+                self.assertEqual(response["Content-Length"], str(len(expected_data)))
+                self.assertEqual(b"".join(response.streaming_content), expected_data)
+
+            response = self.owner_client.get(url, headers={"Range": "bytes=10000-"})
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response["Content-Range"], "bytes */10000")
+
+            # Multiple ranges and ranges for a different version return the whole data.
+            for headers in [
+                {"Range": "bytes=0-1,5-6"},
+                {"Range": "bytes=0-1", "If-Range": '"other"'},
+            ]:
+                response = self.owner_client.get(url, headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b"".join(response.streaming_content), data)
+
     def test_create(self) -> None:
         response = self.client.post(reverse("nodes:document-versions-list"), {})
         self.assertEqual(response.status_code, 405)
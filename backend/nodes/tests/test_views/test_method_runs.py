@@ -25,7 +25,7 @@ class MethodNodeRunTestCase(BaseTransactionTestCase):
     def test_retrieve(self) -> None:
         method_run = factories.MethodNodeRunFactory.create(user=self.owner_user)
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):  # One more to cache the readable spaces of the user
             response = self.owner_client.get(
                 reverse("nodes:method-runs-detail", args=[method_run.public_id])
             )
@@ -254,8 +254,8 @@ class MethodNodeRunTestCase(BaseTransactionTestCase):
         )
 
         # Test with own_runs=true - should return only user's own runs
-        # This should only require 2 queries (one for the runs, one for permissions)
-        with self.assertNumQueries(2):
+        # 2 queries (one for the runs, one for permissions) and one to cache the readable spaces
+        with self.assertNumQueries(3):
             response = self.owner_client.get(
                 reverse("nodes:method-runs-list"), {"own_runs": "true"}
             )
@@ -279,8 +279,8 @@ class MethodNodeRunTestCase(BaseTransactionTestCase):
         self.assertEqual(response.data["count"], 5)
 
         # Test with viewer user
-        # This should only require 2 queries (one for the runs, one for permissions)
-        with self.assertNumQueries(2):
+        # 2 queries (one for the runs, one for permissions) and one to cache the readable spaces
+        with self.assertNumQueries(3):
             response = self.viewer_client.get(
                 reverse("nodes:method-runs-list"), {"own_runs": "true"}
             )
@@ -294,8 +294,8 @@ class MethodNodeRunTestCase(BaseTransactionTestCase):
         factories.MethodNodeRunFactory.create_batch(1, user=self.owner_user, is_public=False)
 
         # Test with is_public=true - should return only public runs
-        # This should only require 2 queries (one for the runs, one for permissions)
-        with self.assertNumQueries(2):
+        # 2 queries (one for the runs, one for permissions) and one to cache the readable spaces
+        with self.assertNumQueries(3):
             response = self.owner_client.get(
                 reverse("nodes:method-runs-list"), {"is_public": "true"}
             )
@@ -337,8 +337,8 @@ class MethodNodeRunTestCase(BaseTransactionTestCase):
             run.members.create(user=self.viewer_user, role=permissions.utils.get_viewer_role())
 
         # Test with own_runs=false for owner - should return viewer's runs
-        # This should only require 2 queries (one for the runs, one for permissions)
-        with self.assertNumQueries(2):
+        # 2 queries (one for the runs, one for permissions) and one to cache the readable spaces
+        with self.assertNumQueries(3):
             response = self.owner_client.get(
                 reverse("nodes:method-runs-list"), {"own_runs": "false"}
             )
@@ -350,8 +350,8 @@ class MethodNodeRunTestCase(BaseTransactionTestCase):
             self.assertFalse(result["is_owner"])
 
         # Test with own_runs=false for viewer - should return owner's runs
-        # This should only require 2 queries (one for the runs, one for permissions)
-        with self.assertNumQueries(2):
+        # 2 queries (one for the runs, one for permissions) and one to cache the readable spaces
+        with self.assertNumQueries(3):
             response = self.viewer_client.get(
                 reverse("nodes:method-runs-list"), {"own_runs": "false"}
             )
@@ -406,8 +406,8 @@ class MethodNodeRunTestCase(BaseTransactionTestCase):
         shared_run.members.create(user=self.viewer_user, role=permissions.utils.get_viewer_role())
 
         # Owner should see both runs with correct is_shared values
-        # This should only require 2 queries (one for the runs, one for permissions)
-        with self.assertNumQueries(2):
+        # 2 queries (one for the runs, one for permissions) and one to cache the readable spaces
+        with self.assertNumQueries(3):
             response = self.owner_client.get(reverse("nodes:method-runs-list"))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["count"], 2)
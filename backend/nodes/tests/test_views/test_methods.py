@@ -29,7 +29,7 @@ class MethodNodesViewTestCase(BaseTransactionTestCase):
                 creator=self.owner_user, owner=self.owner_user, forked_from=original_version
             )
 
-        with self.assertNumQueries(3):
+        with self.assertNumQueries(4):  # Count, page, authors and the roles of the page
             response = self.owner_client.get(reverse("nodes:methods-list"))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["count"], 16)
@@ -1,6 +1,8 @@
+from django.core.cache import cache
 from django.urls import reverse
 
 import nodes.models
+from nodes import embeddings, tasks
 from nodes.tests import factories
 from utils.testcases import BaseTransactionTestCase
 
@@ -18,7 +20,8 @@ class SearchViewTestCase(BaseTransactionTestCase):
         space.nodes.add(parent_node)
         parent_node.subnodes.add(node)
 
-        with self.assertNumQueries(4):
+        # Readable spaces, content type, nodes, parents and authors.
+        with self.assertNumQueries(5):
             response = self.owner_client.get(reverse("nodes:search"), {"q": node.title})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data["results"]), 1)
@@ -69,7 +72,6 @@ class SearchViewTestCase(BaseTransactionTestCase):
 
         response = self.owner_client.get(reverse("nodes:search"), {"q": "good"})
         self.assertEqual(response.status_code, 200)
-        print(response.data)
         self.assertEqual(len(response.data["results"]), 2)
 
         response = self.owner_client.get(
@@ -87,3 +89,231 @@ class SearchViewTestCase(BaseTransactionTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data["results"]), 1)
         self.assertEqual(response.data["results"][0]["id"], str(default_node.public_id))
+
+    def test_websearch_mode(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        dog = factories.NodeFactory.create(title="The dog", text="Sunny barks.", space=space)
+        cat = factories.NodeFactory.create(title="The cat", text="Sheila meows.", space=space)
+
+        response = self.owner_client.get(
+            reverse("nodes:search"), {"q": "dog or cat", "mode": "websearch"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertSetEqual(
+            {result["id"] for result in response.data["results"]},
+            {str(dog.public_id), str(cat.public_id)},
+        )
+
+        response = self.owner_client.get(
+            reverse("nodes:search"), {"q": '"the dog" -cat', "mode": "websearch"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(
+            [result["id"] for result in response.data["results"]], [str(dog.public_id)]
+        )
+
+        # In plain mode all words have to match.
+        response = self.owner_client.get(reverse("nodes:search"), {"q": "dog or cat"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 0)
+
+    def test_highlight(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        factories.NodeFactory.create(title="Dog", text="Sunny is a good dog.", space=space)
+
+        response = self.owner_client.get(reverse("nodes:search"), {"q": "dog"})
+        self.assertIsNone(response.data["results"][0]["headline"])
+
+        response = self.owner_client.get(reverse("nodes:search"), {"q": "dog", "highlight": True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0]["headline"], "Sunny is a good <b>dog</b>")
+
+    def test_offset_pagination(self) -> None:
+        """Without a cursor, pages are fetched by offset in the order of the full result."""
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        for i in range(5):
+            factories.NodeFactory.create(title=f"dog {'dog ' * (i % 3)}", space=space)
+
+        response = self.owner_client.get(reverse("nodes:search"), {"q": "dog"})
+        ranked = [result["id"] for result in response.data["results"]]
+        self.assertEqual(len(ranked), 5)
+
+        response = self.owner_client.get(reverse("nodes:search"), {"q": "dog", "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual([result["id"] for result in response.data["results"]], ranked[:2])
+        self.assertIsNone(response.data["previous"])
+        self.assertIn("offset=2", response.data["next"])
+
+        response = self.owner_client.get(response.data["next"])
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual([result["id"] for result in response.data["results"]], ranked[2:4])
+        self.assertIn("offset=4", response.data["next"])
+
+    def test_cursor_pagination(self) -> None:
+        """Pages are fetched by (rank, public ID), without gaps or duplicates."""
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        nodes = [
+            factories.NodeFactory.create(title=f"dog {'dog ' * (i % 3)}", space=space)
+            for i in range(7)
+        ]
+
+        seen: list[str] = []
+        url: str | None = reverse("nodes:search") + "?q=dog&limit=3&cursor="
+        pages = 0
+        while url is not None:
+            response = self.owner_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data["results"]), 3)
+            seen.extend(result["id"] for result in response.data["results"])
+            url = response.data["next"]
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertSetEqual(set(seen), {str(node.public_id) for node in nodes})
+
+        response = self.owner_client.get(reverse("nodes:search"), {"q": "dog", "cursor": "x"})
+        self.assertEqual(response.status_code, 404)
+
+
+class TypeaheadViewTestCase(BaseTransactionTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    def test_typeahead(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        contains = factories.NodeFactory.create(title="The graph theory", space=space)
+        prefix_long = factories.NodeFactory.create(title="Graph neural networks", space=space)
+        prefix_short = factories.NodeFactory.create(title="graphs", space=space)
+        factories.NodeFactory.create(title="Something else", space=space)
+
+        # Readable spaces, content type and nodes.
+        with self.assertNumQueries(3):
+            response = self.owner_client.get(reverse("nodes:search-typeahead"), {"q": "GRAPH"})
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(
+            [result["id"] for result in response.data],
+            [str(prefix_short.public_id), str(prefix_long.public_id), str(contains.public_id)],
+        )
+        self.assertDictEqual(
+            response.data[0],
+            {
+                "id": str(prefix_short.public_id),
+                "title": "graphs",
+                "node_type": nodes.models.NodeType.DEFAULT,
+                "space": str(space.public_id),
+            },
+        )
+
+        response = self.owner_client.get(
+            reverse("nodes:search-typeahead"), {"q": "graph", "limit": 1}
+        )
+        self.assertListEqual(
+            [result["id"] for result in response.data], [str(prefix_short.public_id)]
+        )
+
+        # Wildcards are matched literally.
+        response = self.owner_client.get(reverse("nodes:search-typeahead"), {"q": "gr%"})
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(response.data, [])
+
+    def test_typeahead_permissions(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        other_space = factories.SpaceFactory.create()
+        own_node = factories.NodeFactory.create(title="Sunny the dog", space=space)
+        factories.NodeFactory.create(title="Sunny the other dog", space=other_space)
+        method = factories.MethodNodeFactory.create(title="Sunny's method", owner=self.owner_user)
+        factories.MethodNodeFactory.create(title="Sunny's other method")
+
+        response = self.owner_client.get(reverse("nodes:search-typeahead"), {"q": "sunny"})
+        self.assertEqual(response.status_code, 200)
+        self.assertSetEqual(
+            {result["id"] for result in response.data},
+            {str(own_node.public_id), str(method.public_id)},
+        )
+
+        response = self.owner_client.get(
+            reverse("nodes:search-typeahead"),
+            {"q": "sunny", "node_type": nodes.models.NodeType.METHOD},
+        )
+        self.assertListEqual([result["id"] for result in response.data], [str(method.public_id)])
+
+        response = self.owner_client.get(
+            reverse("nodes:search-typeahead"), {"q": "sunny", "space": str(space.public_id)}
+        )
+        self.assertListEqual([result["id"] for result in response.data], [str(own_node.public_id)])
+
+        response = self.owner_client.get(
+            reverse("nodes:search-typeahead"), {"q": "sunny", "space": str(other_space.public_id)}
+        )
+        self.assertEqual(response.status_code, 400, response.data)
+
+    def test_typeahead_cache(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        node = factories.NodeFactory.create(title="Sunny the dog", space=space)
+
+        response = self.owner_client.get(reverse("nodes:search-typeahead"), {"q": "sun"})
+        self.assertEqual(len(response.data), 1)
+
+        # Results are cached per user, only the query parameters are validated.
+        node.title = "Sheila the cat"
+        node.save()
+        with self.assertNumQueries(0):
+            response = self.owner_client.get(reverse("nodes:search-typeahead"), {"q": "sun"})
+        self.assertListEqual([result["id"] for result in response.data], [str(node.public_id)])
+
+        response = self.viewer_client.get(reverse("nodes:search-typeahead"), {"q": "sun"})
+        self.assertListEqual(response.data, [])
+
+        with self.settings(NODE_TYPEAHEAD_CACHE_TIMEOUT=0):
+            response = self.owner_client.get(reverse("nodes:search-typeahead"), {"q": "she"})
+            self.assertEqual(len(response.data), 1)
+            node.title = "Sunny the dog"
+            node.save()
+            response = self.owner_client.get(reverse("nodes:search-typeahead"), {"q": "she"})
+            self.assertListEqual(response.data, [])
+
+
+class SemanticSearchViewTestCase(BaseTransactionTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        embeddings.index_cache.clear()
+
+    def test_semantic_search(self) -> None:
+        space = factories.SpaceFactory.create(owner=self.owner_user)
+        other_space = factories.SpaceFactory.create()
+        dog = factories.NodeFactory.create(
+            title="Dogs", text="Dogs bark at the mailman.", space=space
+        )
+        cat = factories.NodeFactory.create(title="Cats", text="Cats purr on the sofa.", space=space)
+        factories.NodeFactory.create(title="Dogs", text="Dogs bark at night.", space=other_space)
+        tasks.update_node_embeddings()
+
+        # Readable spaces, index stamps, index vectors and nodes.
+        with self.assertNumQueries(4):
+            response = self.owner_client.get(
+                reverse("nodes:search-semantic"), {"q": "barking dogs"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(
+            [result["id"] for result in response.data],
+            [str(dog.public_id), str(cat.public_id)],
+        )
+        self.assertEqual(response.data[0]["title"], "Dogs")
+        self.assertEqual(response.data[0]["space"], str(space.public_id))
+        self.assertGreater(response.data[0]["score"], response.data[1]["score"])
+
+        response = self.owner_client.get(
+            reverse("nodes:search-semantic"),
+            {"q": "barking dogs", "space": str(space.public_id), "limit": 1},
+        )
+        self.assertListEqual([result["id"] for result in response.data], [str(dog.public_id)])
+
+        response = self.owner_client.get(
+            reverse("nodes:search-semantic"), {"q": "dogs", "space": str(other_space.public_id)}
+        )
+        self.assertEqual(response.status_code, 400, response.data)
+
+        response = self.viewer_client.get(reverse("nodes:search-semantic"), {"q": "barking dogs"})
+        self.assertListEqual(response.data, [])
@@ -15,7 +15,7 @@ class SpacesViewTestCase(BaseTransactionTestCase):
             owner=self.owner_user, default_node=factories.NodeFactory()
         )
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(4):  # Readable spaces, count, page and the roles of the page
             response = self.owner_client.get(reverse("nodes:spaces-list"))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["count"], 1)
@@ -23,7 +23,7 @@ class SpacesViewTestCase(BaseTransactionTestCase):
         nodes = factories.NodeFactory.create_batch(10)
         space.nodes.set(nodes)
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):
             response = self.owner_client.get(reverse("nodes:spaces-list"))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["count"], 1)
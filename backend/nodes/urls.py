@@ -21,4 +21,6 @@ urlpatterns = router.urls
 
 urlpatterns += [
     path("nodes/search/", views.SearchView.as_view(), name="search"),
+    path("nodes/search/typeahead/", views.TypeaheadView.as_view(), name="search-typeahead"),
+    path("nodes/search/semantic/", views.SemanticSearchView.as_view(), name="search-semantic"),
 ]
@@ -1,16 +1,74 @@
 import typing
 
+# The ProseMirror node types after which a block boundary is yielded, see `extract_text_from_node`.
+BLOCK_NODE_TYPES = frozenset(
+    {
+        "paragraph",
+        "heading",
+        "blockquote",
+        "codeBlock",
+        "listItem",
+        "taskItem",
+        "tableCell",
+        "tableHeader",
+    }
+)
+
+_BLOCK_END = object()
+
+
+def extract_text_from_node(
+    node: dict[str, typing.Any] | list | None, block_separator: str | None = None
+) -> typing.Iterator[str]:
+    """
+    Yield the text fragments of a node in document order.
+
+    The node is walked with an explicit stack instead of recursion, so deeply nested documents
+    don't hit the recursion limit and fragments aren't copied between intermediate lists.
+    If `block_separator` is given, it's yielded at the end of every block (see
+    `BLOCK_NODE_TYPES`) that contained text, e.g. to keep paragraph and heading breaks.
+    """
+    # The stack holds the nodes that are still to be walked, in reverse document order. Text nodes
+    # are leaves in ProseMirror, so only their text is used. Anything else is skipped when popped.
+    stack: list[typing.Any] = [node]
+    push, pop, extend = stack.append, stack.pop, stack.extend
+    text_since_boundary = False
+
+    while stack:
+        item = pop()
+        if isinstance(item, dict):
+            if item.get("type") == "text":
+                text_since_boundary = True
+                yield item["text"]
+                continue
+            if block_separator is not None and item.get("type") in BLOCK_NODE_TYPES:
+                push(_BLOCK_END)
+            for value in reversed(item.values()):
+                if isinstance(value, (dict, list)):
+                    push(value)
+        elif isinstance(item, list):
+            extend(reversed(item))
+        elif item is _BLOCK_END and text_since_boundary:
+            text_since_boundary = False
+            yield typing.cast("str", block_separator)
+
+
+def extract_text_blocks(node: dict[str, typing.Any] | list | None) -> list[str]:
+    """
+    Return the text of each top-level block of a document, skipping blocks without text.
+    Joining the blocks with spaces gives the same text as joining all fragments of the document.
+    """
+    if not isinstance(node, dict) or not isinstance(node.get("content"), list):
+        blocks = [node]
+    elif any(isinstance(value, (dict, list)) for key, value in node.items() if key != "content"):
+        # Text outside of the content would be out of order, treat the document as one block.
+        blocks = [node]
+    else:
+        blocks = node["content"]
 
-def extract_text_from_node(node: dict[str, typing.Any] | list | None) -> list[str]:
-    """Extract text from a node."""
     texts: list[str] = []
-    if isinstance(node, dict):
-        for key, value in node.items():
-            if key == "type" and value == "text":
-                texts.append(node["text"])
-            elif isinstance(value, (dict, list)):
-                texts.extend(extract_text_from_node(value))
-    elif isinstance(node, list):
-        for item in node:
-            texts.extend(extract_text_from_node(item))
+    for block in blocks:
+        fragments = list(extract_text_from_node(block))
+        if fragments:
+            texts.append(" ".join(fragments))
     return texts
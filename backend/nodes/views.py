@@ -1,3 +1,4 @@
+import hashlib
 import json
 import typing
 import uuid
@@ -9,8 +10,13 @@ import dry_rest_permissions.generics as dry_permissions
 import rest_framework.filters
 import sentry_sdk
 from django import http
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models as django_models
 from django.db.models import BooleanField, Case, Value, When
+from django.db.models.functions import Cast, Length, StrIndex, Upper
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
 from rest_framework import decorators, generics, parsers, response
 
@@ -23,13 +29,18 @@ import users.models
 import utils.managers
 import utils.pagination
 import utils.parsers
-from nodes import filters, models, serializers
+from nodes import embeddings, filters, models, serializers
 from utils import filters as base_filters
-from utils import views
+from utils import middlewares, views
 
 if typing.TYPE_CHECKING:
     from rest_framework import request
 
+    from users import typing as user_typing
+
+# The size of the chunks the CRDT data of versions is streamed in.
+CRDT_CHUNK_SIZE = 64 * 1024
+
 
 @extend_schema(tags=["Nodes"])
 @extend_schema_view(
@@ -129,7 +140,7 @@ class NodeModelViewSet(views.BaseReadOnlyModelViewSet[models.Node]):
         except ValueError as exc:
             raise ValueError("Depth must be an integer.") from exc
 
-        return response.Response(node.node_context_for_depth(query_depth=depth, include_edges=True))
+        return response.Response(node.get_cached_context(depth, include_edges=True))
 
 
 @extend_schema(tags=["Skills"])
@@ -149,6 +160,7 @@ class NodeModelViewSet(views.BaseReadOnlyModelViewSet[models.Node]):
 class MethodNodeModelViewSet(
     views.BaseModelViewSet[models.MethodNode],
     permissions.views.PermissionViewSetMixin[models.MethodNode],
+    permissions.views.UserRolesViewSetMixin[models.MethodNode],
 ):
     """API endpoint that allows methods to be viewed or edited."""
 
@@ -162,12 +174,10 @@ class MethodNodeModelViewSet(
         self,
     ) -> "permissions.managers.SoftDeletableMembershipModelQuerySet[models.MethodNode]":
         queryset = (
-            self.queryset.annotate_user_permissions(  # type: ignore[attr-defined]
-                request=self.request
-            )
-            .defer(
+            self.queryset.defer(
                 "content",
                 "text",
+                "text_blocks",
                 "graph_document",
                 "editor_document",
                 "search_vector",
@@ -187,6 +197,9 @@ class MethodNodeModelViewSet(
             )
         )
         assert isinstance(queryset, permissions.managers.SoftDeletableMembershipModelQuerySet)
+        if self.action != "list":
+            # The roles of list pages are set after pagination.
+            queryset = queryset.annotate_user_permissions(request=self.request)
 
         if self.action == "retrieve":
             latest_version_subquery = (
@@ -243,7 +256,9 @@ class MethodNodeModelViewSet(
     destroy=extend_schema(description="Delete a space.", summary="Delete space"),
 )
 class SpaceModelViewSet(
-    permissions.views.PermissionViewSetMixin[models.Space], views.BaseModelViewSet[models.Space]
+    permissions.views.PermissionViewSetMixin[models.Space],
+    permissions.views.UserRolesViewSetMixin[models.Space],
+    views.BaseModelViewSet[models.Space],
 ):
     """API endpoint that allows projects to be viewed or edited."""
 
@@ -268,12 +283,16 @@ class SpaceModelViewSet(
             .defer(
                 "default_node__content",
                 "default_node__text",
+                "default_node__text_blocks",
                 "default_node__search_vector",
                 "default_node__editor_document",
                 "default_node__graph_document",
             )
         )
         assert isinstance(queryset, permissions.managers.SoftDeletableMembershipModelQuerySet)
+        if self.action == "list":
+            # The roles of list pages are set after pagination.
+            return queryset
         return queryset.annotate_user_permissions(request=self.request)
 
     def perform_create(self, serializer: serializers.SpaceSerializer) -> None:  # type: ignore[override]
@@ -303,14 +322,76 @@ class DocumentVersionModelViewSet(views.BaseReadOnlyModelViewSet[models.Document
     ordering = ["-created_at"]
     permission_classes = (dry_permissions.DRYObjectPermissions,)
 
+    def get_queryset(self) -> "django_models.QuerySet[models.DocumentVersion]":
+        queryset = super().get_queryset()
+        if self.action == "crdt":
+            # The data is only loaded if it's sent, conditional requests don't need it.
+            return queryset.defer("data")
+        return queryset
+
     @extend_schema(
-        description="Retrieve the CRDT file of a node version.",
+        description=(
+            "Retrieve the CRDT file of a node version. Supports conditional requests with "
+            "If-None-Match (the ETag is the JSON hash of the version) and single byte ranges."
+        ),
         summary="Retrieve CRDT of a node version",
     )
     @decorators.action(detail=True, methods=["get"])
-    def crdt(self, request: "request.Request", public_id: str | None = None) -> http.HttpResponse:
+    # Compressing the stream would break the Content-Length and the byte ranges.
+    @middlewares.disable_gzip
+    def crdt(
+        self, request: "request.Request", public_id: str | None = None
+    ) -> http.HttpResponseBase:
         document_version = self.get_object()
-        return http.HttpResponse(document_version.data, content_type="application/octet-stream")
+        etag = quote_etag(document_version.json_hash)
+        if response := get_conditional_response(request, etag=etag):
+            response["ETag"] = etag
+            return response
+
+        size = document_version.get_data_size()
+        start, stop = 0, size
+        range_header = request.headers.get("Range")
+        # Ranges only apply if the client still has the same version, see If-Range.
+        if range_header and request.headers.get("If-Range", etag) == etag:
+            try:
+                byte_range = views.parse_byte_range(range_header, size)
+            except ValueError:
+                byte_range = (0, size)
+                range_header = None
+            if byte_range is None:
+                response = http.HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+            start, stop = byte_range
+        else:
+            range_header = None
+
+        response = http.StreamingHttpResponse(
+            document_version.iter_data(start, stop, chunk_size=CRDT_CHUNK_SIZE),
+            content_type="application/octet-stream",
+            status=206 if range_header else 200,
+        )
+        if range_header:
+            response["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        response["Content-Length"] = str(stop - start)
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = etag
+        # Versions never change, but they're only visible to users with access to the document.
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+
+def get_readable_nodes_filter(user: "user_typing.AnyUserType | None") -> django_models.Q:
+    """
+    Filter for the nodes the user can read: the nodes in readable spaces and the readable methods.
+    """
+    readable_methods = models.MethodNode.available_objects.filter(
+        models.MethodNode.get_user_has_permission_filter(permissions.models.READ, user)
+    ).values("pk")
+    return django_models.Q(
+        space_id__any=models.Space.get_space_ids_for_user(permissions.models.READ, user),
+        node_type=models.NodeType.DEFAULT,
+    ) | django_models.Q(pk__in=readable_methods)
 
 
 @extend_schema(tags=["Nodes"])
@@ -334,56 +415,175 @@ class SearchView(generics.ListAPIView):
         )
         search_query_serializer.is_valid(raise_exception=True)
 
+        validated_data = search_query_serializer.validated_data
+        search_query = pg_search.SearchQuery(
+            validated_data["q"], search_type=validated_data["mode"]
+        )
         nodes = (
             models.Node.available_objects.filter(
-                django_models.Q(
-                    models.Node.get_user_has_permission_filter(
-                        permissions.models.READ, request.user
-                    ),
-                    node_type=models.NodeType.DEFAULT,
-                )
-                | django_models.Q(
-                    models.MethodNode.get_user_has_permission_filter(
-                        permissions.models.READ, request.user, prefix="methodnode"
-                    ),
-                ),
+                get_readable_nodes_filter(request.user), search_vector=search_query
             )
+            .defer("content", "text", "text_blocks")
             .select_related("space")
             .prefetch_related(
                 django_models.Prefetch(
                     "parents", queryset=models.Node.available_objects.only("id", "public_id")
                 ),
             )
+            # The rank is a real, which is sent rounded as text, the cast keeps the cursor exact.
             .annotate(
-                rank=pg_search.SearchRank(
-                    "search_vector",
-                    pg_search.SearchQuery(search_query_serializer.validated_data["q"]),
+                rank=Cast(
+                    pg_search.SearchRank("search_vector", search_query),
+                    django_models.FloatField(),
                 )
             )
-            .filter(
-                search_vector=pg_search.SearchQuery(search_query_serializer.validated_data["q"])
-            )
-            .order_by("-rank")
-            .distinct()
+            .order_by("-rank", "-public_id")
         )
 
-        if "space" in search_query_serializer.validated_data:
-            nodes = nodes.filter(space=search_query_serializer.validated_data["space"])
+        if "space" in validated_data:
+            nodes = nodes.filter(space=validated_data["space"])
 
-        if "node_type" in search_query_serializer.validated_data:
-            nodes = nodes.filter(node_type=search_query_serializer.validated_data["node_type"])
+        if "node_type" in validated_data:
+            nodes = nodes.filter(node_type=validated_data["node_type"])
 
+        if "cursor" in validated_data:
+            self.pagination_class = utils.pagination.KeysetCursorPagination
         page = self.paginate_queryset(nodes)
-        if page is not None:
-            serializer = serializers.NodeSearchResultSerializer(
-                page, many=True, context={"request": request}
+        if page is None:
+            page = list(nodes)
+        if page and validated_data["highlight"]:
+            # Only highlight the nodes of the page, ts_headline has to parse the whole text.
+            headlines = dict(
+                models.Node.all_objects.filter(pk__in=[node.pk for node in page])
+                .annotate(
+                    headline=pg_search.SearchHeadline(
+                        "text", search_query, max_fragments=3, start_sel="<b>", stop_sel="</b>"
+                    )
+                )
+                .values_list("pk", "headline")
             )
-            return self.get_paginated_response(serializer.data)
+            for node in page:
+                node.headline = headlines.get(node.pk)
 
         serializer = serializers.NodeSearchResultSerializer(
-            nodes, many=True, context={"request": request}
+            page, many=True, context={"request": request}
+        )
+        return self.get_paginated_response(serializer.data)
+
+
+@extend_schema(tags=["Nodes"])
+class TypeaheadView(generics.GenericAPIView):
+    """API endpoint that allows looking up nodes by their title as the user types."""
+
+    queryset = models.Node.available_objects.none()
+
+    @extend_schema(
+        description=(
+            "Find nodes whose title contains the query, titles starting with it first. "
+            "Results are cached per user for a few seconds."
+        ),
+        summary="Typeahead node titles",
+        parameters=[serializers.NodeTypeaheadQuerySerializer],
+        responses={200: serializers.NodeTypeaheadResultSerializer(many=True)},
+    )
+    def get(
+        self, request: "request.Request", *args: typing.Any, **kwargs: typing.Any
+    ) -> response.Response:
+        query_serializer = serializers.NodeTypeaheadQuerySerializer(
+            data=request.query_params, context={"request": request}
+        )
+        query_serializer.is_valid(raise_exception=True)
+        validated_data = query_serializer.validated_data
+
+        space = validated_data.get("space")
+        cache_key = "nodes:typeahead:{}:{}".format(
+            request.user.pk,
+            hashlib.blake2b(
+                json.dumps(
+                    [
+                        validated_data["q"],
+                        space.pk if space else None,
+                        validated_data.get("node_type"),
+                        validated_data["limit"],
+                    ]
+                ).encode(),
+                digest_size=16,
+            ).hexdigest(),
+        )
+        results = cache.get(cache_key)
+        if results is None:
+            results = self.get_results(request, validated_data)
+            cache.set(cache_key, results, settings.NODE_TYPEAHEAD_CACHE_TIMEOUT)
+
+        return response.Response(serializers.NodeTypeaheadResultSerializer(results, many=True).data)
+
+    def get_results(
+        self, request: "request.Request", validated_data: dict[str, typing.Any]
+    ) -> list[dict[str, typing.Any]]:
+        query = validated_data["q"]
+        # The case-insensitive lookups are served by the trigram index on UPPER(title), see
+        # migration 0052. Only the columns of the results are fetched, without model instances.
+        nodes = models.Node.available_objects.filter(
+            get_readable_nodes_filter(request.user), title__icontains=query
+        )
+        if "space" in validated_data:
+            nodes = nodes.filter(space=validated_data["space"])
+        if "node_type" in validated_data:
+            nodes = nodes.filter(node_type=validated_data["node_type"])
+
+        nodes = nodes.order_by(
+            # Titles starting with the query first, then by the position of the match.
+            StrIndex(Upper("title"), Upper(Value(query))),
+            Length("title"),
+            "title",
+            "pk",
+        ).values("public_id", "title", "node_type", "space__public_id")
+        return list(nodes[: validated_data["limit"]])
+
+
+@extend_schema(tags=["Nodes"])
+class SemanticSearchView(generics.GenericAPIView):
+    """API endpoint that allows searching for nodes by meaning instead of by words."""
+
+    queryset = models.Node.available_objects.none()
+
+    @extend_schema(
+        description=(
+            "Find the nodes whose title and text are most similar to the query, by the embeddings "
+            "of their chunks. Nodes are embedded in the background after they change."
+        ),
+        summary="Semantic search nodes",
+        parameters=[serializers.NodeSemanticSearchQuerySerializer],
+        responses={200: serializers.NodeSemanticSearchResultSerializer(many=True)},
+    )
+    def get(
+        self, request: "request.Request", *args: typing.Any, **kwargs: typing.Any
+    ) -> response.Response:
+        query_serializer = serializers.NodeSemanticSearchQuerySerializer(
+            data=request.query_params, context={"request": request}
+        )
+        query_serializer.is_valid(raise_exception=True)
+        validated_data = query_serializer.validated_data
+
+        if "space" in validated_data:
+            space_ids = [validated_data["space"].pk]
+        else:
+            space_ids = models.Space.get_space_ids_for_user(permissions.models.READ, request.user)
+
+        hits = embeddings.search(validated_data["q"], space_ids, validated_data["limit"])
+        # The index can lag behind, so the nodes are filtered again.
+        nodes = {
+            node["pk"]: node
+            for node in models.Node.available_objects.filter(
+                pk__in=[node_id for _, node_id in hits],
+                space_id__any=space_ids,
+                node_type=models.NodeType.DEFAULT,
+            ).values("pk", "public_id", "title", "node_type", "space__public_id")
+        }
+        results = [nodes[node_id] | {"score": score} for score, node_id in hits if node_id in nodes]
+        return response.Response(
+            serializers.NodeSemanticSearchResultSerializer(results, many=True).data
         )
-        return response.Response(serializer.data)
 
 
 @extend_schema(tags=["Skills"])
@@ -3,6 +3,7 @@ import typing
 import dry_rest_permissions.generics
 from django.contrib.contenttypes import fields as content_type_fields
 from django.contrib.contenttypes import models as content_type_models
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.db import models
 
 import utils.models
@@ -221,6 +222,47 @@ class MembershipModelMixin(utils.typing.ModelBase):
     ) -> models.Func | models.Expression | models.QuerySet:
         raise NotImplementedError
 
+    def get_public_roles(self) -> list[str]:
+        """Return the roles that every user has on this object because it is public."""
+        if not self.is_public or getattr(self, "is_removed", False):
+            return []
+        return [VIEWER, "writer"] if self.is_public_writable else [VIEWER]
+
+    @classmethod
+    def get_user_roles(
+        cls, objects: typing.Iterable["MembershipModelMixin"], user: "users.typing.AnyUserType"
+    ) -> dict[int, list[str]]:
+        """
+        Return the roles of the user per primary key of the given objects, the same roles as the
+        `user_roles` annotation of `annotate_user_permissions`. The memberships of the user are
+        fetched with one query grouped by object and the public roles are taken from the objects,
+        so this is cheap for a page of objects that are already loaded.
+        """
+        objects = list(objects)
+        member_roles: dict[int, list[str]] = {}
+        if user.is_authenticated and objects:
+            member_roles = dict(
+                ObjectMembership.objects.filter(
+                    content_type=content_type_models.ContentType.objects.get_for_model(cls),
+                    object_id__any=[obj.pk for obj in objects],
+                    user=user,
+                )
+                .values("object_id")
+                .annotate(roles=ArrayAgg("role__role", distinct=True))
+                .values_list("object_id", "roles")
+            )
+        return {obj.pk: [*member_roles.get(obj.pk, []), *obj.get_public_roles()] for obj in objects}
+
+    @classmethod
+    def set_user_roles(
+        cls, objects: typing.Iterable["MembershipModelMixin"], user: "users.typing.AnyUserType"
+    ) -> None:
+        """Set `user_roles` on the given objects, see `get_user_roles`."""
+        objects = list(objects)
+        roles = cls.get_user_roles(objects, user)
+        for obj in objects:
+            obj.user_roles = roles[obj.pk]
+
     @staticmethod
     def has_read_permission(request: "http.HttpRequest") -> bool:
         """
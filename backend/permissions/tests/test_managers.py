@@ -1,3 +1,5 @@
+from django.contrib.auth.models import AnonymousUser
+
 import nodes.models
 import permissions.models
 import permissions.utils
@@ -78,3 +80,57 @@ class MembershipModelQuerySetMixinTestCase(BaseTestCase):
 
         # Now soft delete the space and check that the permissions are not transferred anymore
         space.delete()
+
+    def test_user_roles_match_annotation(self) -> None:
+        """Test that the grouped role lookup returns the same roles as the annotation."""
+        spaces = [
+            nodes_factories.SpaceFactory.create(owner=self.owner_user, viewer=self.viewer_user),
+            nodes_factories.SpaceFactory.create(is_public=True, viewer=self.viewer_user),
+            nodes_factories.SpaceFactory.create(is_public=True, is_public_writable=True),
+            nodes_factories.SpaceFactory.create(member=self.owner_user),
+        ]
+        methods = [
+            nodes_factories.MethodNodeFactory.create(owner=self.owner_user),
+            nodes_factories.MethodNodeFactory.create(is_public=True, viewer=self.viewer_user),
+        ]
+        node_list = [
+            nodes_factories.NodeFactory.create(space=spaces[0]),
+            nodes_factories.NodeFactory.create(space=spaces[2]),
+        ]
+
+        for user in (self.owner_user, self.viewer_user, self.member_user, AnonymousUser()):
+            for model, objects in (
+                (nodes.models.Space, spaces),
+                (nodes.models.MethodNode, methods),
+            ):
+                annotated = {
+                    obj.pk: sorted(obj.user_roles)
+                    for obj in model.objects.filter(pk__in=[obj.pk for obj in objects]).annotate(
+                        user_roles=model.get_role_annotation_query(user)
+                    )
+                }
+                with self.assertNumQueries(1 if user.is_authenticated else 0):
+                    roles = model.get_user_roles(objects, user)
+                self.assertEqual(
+                    {pk: sorted(obj_roles) for pk, obj_roles in roles.items()}, annotated
+                )
+
+            # Nodes have the roles of their spaces.
+            space_roles = nodes.models.Space.get_user_roles(spaces, user)
+            self.assertEqual(
+                nodes.models.Node.get_user_roles(node_list, user),
+                {node.pk: space_roles[node.space_id] for node in node_list},
+            )
+
+    def test_set_user_roles(self) -> None:
+        space = nodes_factories.SpaceFactory.create(owner=self.owner_user)
+        space = nodes.models.Space.objects.get(pk=space.pk)
+
+        nodes.models.Space.set_user_roles([space], self.owner_user)
+        self.assertEqual(space.user_roles, [permissions.models.RoleOptions.OWNER])
+        # The permissions are answered from the roles without further queries.
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                space.get_allowed_actions_for_user(user=self.owner_user),
+                ["read", "write", "delete", "manage"],
+            )
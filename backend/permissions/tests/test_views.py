@@ -89,7 +89,7 @@ class PermissionViewSetMixinTestCase(BaseTransactionTestCase):
         self.assertEqual(node.subnodes.count(), 10)
         self.assertEqual(space.nodes.count(), 11)
 
-        with self.assertNumQueries(3):
+        with self.assertNumQueries(4):  # One more to cache the readable spaces of the user
             response = self.owner_client.get(
                 reverse("nodes:nodes-detail", args=[str(node.public_id)])
             )
@@ -121,7 +121,7 @@ class PermissionViewSetMixinTestCase(BaseTransactionTestCase):
             set(response_data["allowed_actions"]), {"read", "write", "manage", "delete"}
         )
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(4):  # Readable spaces, count, page and the roles of the page
             response = self.owner_client.get(reverse("nodes:spaces-list"))
             self.assertEqual(response.status_code, 200)
 
@@ -10,6 +10,7 @@ from rest_framework.settings import api_settings
 from permissions import models, serializers
 
 if typing.TYPE_CHECKING:
+    from django.db.models import QuerySet
     from rest_framework import request
 
 
@@ -89,3 +90,17 @@ class PermissionViewSetMixin(generics.GenericAPIView[T_co], typing.Generic[T_co]
             return Response(status=status.HTTP_404_NOT_FOUND)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UserRolesViewSetMixin(generics.GenericAPIView[T_co], typing.Generic[T_co]):
+    """
+    Set the roles of the user on the objects of a list page after pagination, with one query
+    grouped by object (see `MembershipModelMixin.set_user_roles`), instead of annotating every row
+    of the queryset with `annotate_user_permissions`.
+    """
+
+    def paginate_queryset(self, queryset: "QuerySet[T_co]") -> list[T_co] | None:
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            queryset.model.set_user_roles(page, self.request.user)
+        return page
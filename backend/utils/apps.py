@@ -6,5 +6,6 @@ class ApiConfig(AppConfig):
     name = "utils"
 
     def ready(self) -> None:
-        # Import the storage_checks module to register the storage configuration check
+        # Import the modules that register the custom lookups and the storage configuration check
+        import utils.lookups  # noqa: PLC0415
         import utils.storage_checks  # noqa: F401, PLC0415
@@ -0,0 +1,77 @@
+"""
+Compression of binary blobs that are stored in the database.
+The codec is stored next to the blob, so that rows written with different codecs can coexist.
+"""
+
+import io
+import typing
+
+import zstandard
+from django.db import models
+
+
+class Codec(models.TextChoices):
+    NONE = "none", "None"
+    ZSTD = "zstd", "Zstandard"
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    """Compress the data with the given codec."""
+    if codec == Codec.NONE:
+        return bytes(data)
+    if codec == Codec.ZSTD:
+        return zstandard.ZstdCompressor().compress(bytes(data))
+    raise ValueError(f"Unknown codec {codec}.")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    """Decompress data that was compressed with the given codec."""
+    if codec == Codec.NONE:
+        return bytes(data)
+    if codec == Codec.ZSTD:
+        # The content size is always written by `compress`, so no maximum size is needed.
+        return zstandard.ZstdDecompressor().decompress(bytes(data))
+    raise ValueError(f"Unknown codec {codec}.")
+
+
+def decompressed_size(data: bytes, codec: str) -> int:
+    """Return the size of the decompressed data without decompressing it if possible."""
+    if codec == Codec.NONE:
+        return len(data)
+    if codec == Codec.ZSTD:
+        size = zstandard.frame_content_size(bytes(data))
+        if size >= 0:
+            return size
+        return len(decompress(data, codec))
+    raise ValueError(f"Unknown codec {codec}.")
+
+
+def iter_decompress(
+    data: bytes,
+    codec: str,
+    start: int = 0,
+    stop: int | None = None,
+    chunk_size: int = 64 * 1024,
+) -> typing.Iterator[bytes]:
+    """
+    Yield the decompressed data from `start` to `stop` (exclusive) in chunks of at most
+    `chunk_size` bytes, without holding the whole decompressed data in memory.
+    """
+    if codec == Codec.NONE:
+        view = memoryview(data)
+        stop = len(view) if stop is None else min(stop, len(view))
+        for offset in range(start, stop, chunk_size):
+            yield bytes(view[offset : min(offset + chunk_size, stop)])
+        return
+    if codec != Codec.ZSTD:
+        raise ValueError(f"Unknown codec {codec}.")
+
+    position = 0
+    reader = zstandard.ZstdDecompressor().read_to_iter(io.BytesIO(data), write_size=chunk_size)
+    for chunk in reader:
+        chunk_start, position = position, position + len(chunk)
+        if position <= start:
+            continue
+        if stop is not None and chunk_start >= stop:
+            break
+        yield chunk[max(start - chunk_start, 0) : None if stop is None else stop - chunk_start]
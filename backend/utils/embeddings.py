@@ -0,0 +1,114 @@
+import abc
+import functools
+import hashlib
+import json
+import re
+import typing
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+WORD_RE = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=65536)
+def hash_token(token: str) -> int:
+    """A 64-bit hash of the token that is stable between processes, unlike `hash`."""
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+
+
+class Embedder(abc.ABC):
+    """
+    Turns texts into vectors for semantic search. Implementations are configured with the
+    `NODE_EMBEDDINGS_PROVIDER` setting, see `get_embedder`.
+    """
+
+    # Identifies the vectors of this embedder, vectors with a different name aren't comparable.
+    name: str
+    dimensions: int
+
+    @abc.abstractmethod
+    def embed(self, texts: typing.Sequence[str]) -> np.ndarray:
+        """Return a float32 array with one L2-normalized row per text."""
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic embedder that hashes words and their character trigrams into a fixed number of
+    dimensions. It doesn't capture meaning like a language model, but it runs locally without any
+    model files, so it's the default for development and tests.
+    """
+
+    def __init__(self, dimensions: int = 256) -> None:
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def feature(self, token: str) -> tuple[int, float]:
+        """The dimension and sign a token is hashed to."""
+        value = hash_token(token)
+        return value % self.dimensions, 1.0 if value >> 63 else -1.0
+
+    def tokens(self, text: str) -> typing.Iterator[str]:
+        """The words of the text (marked so they don't collide with trigrams) and their trigrams."""
+        for word in WORD_RE.findall(text.lower()):
+            yield f"<{word}>"
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i : i + 3]
+
+    def embed(self, texts: typing.Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in self.tokens(text):
+                dimension, sign = self.feature(token)
+                vectors[row, dimension] += sign
+        return self.normalize(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embedder that uses the embeddings API of OpenAI (or Azure OpenAI)."""
+
+    def __init__(
+        self, model: str = "text-embedding-3-small", dimensions: int = 1536, batch_size: int = 100
+    ) -> None:
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.name = f"openai-{model}-{dimensions}"
+
+    def embed(self, texts: typing.Sequence[str]) -> np.ndarray:
+        import llms.utils  # noqa: PLC0415
+
+        client = llms.utils.get_openai_client()
+        vectors: list[list[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            response = client.embeddings.create(
+                model=self.model,
+                input=list(texts[start : start + self.batch_size]),
+                dimensions=self.dimensions,
+            )
+            vectors.extend(item.embedding for item in response.data)
+        return self.normalize(np.array(vectors, dtype=np.float32).reshape(-1, self.dimensions))
+
+
+@functools.cache
+def load_embedder(path: str, options: str) -> Embedder:
+    return import_string(path)(**json.loads(options))
+
+
+def get_embedder() -> Embedder:
+    """
+    Return the embedder configured by `NODE_EMBEDDINGS_PROVIDER` (a dotted path to an `Embedder`
+    class) and `NODE_EMBEDDINGS_PROVIDER_OPTIONS` (its keyword arguments).
+    """
+    return load_embedder(
+        settings.NODE_EMBEDDINGS_PROVIDER,
+        json.dumps(settings.NODE_EMBEDDINGS_PROVIDER_OPTIONS, sort_keys=True),
+    )
@@ -0,0 +1,30 @@
+import typing
+
+from django.db.models import Field, ForeignObject, Lookup
+
+if typing.TYPE_CHECKING:
+    from django.db.backends.base.base import BaseDatabaseWrapper
+    from django.db.models.sql.compiler import SQLCompiler
+
+
+@ForeignObject.register_lookup
+@Field.register_lookup
+class AnyLookup(Lookup):
+    """
+    `field__any=values` compiles to `field = ANY(%s)` with the values as a single array parameter.
+    Unlike `__in`, the SQL doesn't grow with the number of values, so long lists of IDs stay cheap
+    to send and parse.
+    """
+
+    lookup_name = "any"
+    prepare_rhs = False
+
+    def get_prep_lookup(self) -> list[typing.Any]:
+        return [self.lhs.output_field.get_prep_value(value) for value in self.rhs]
+
+    def as_sql(
+        self, compiler: "SQLCompiler", connection: "BaseDatabaseWrapper"
+    ) -> tuple[str, list[typing.Any]]:
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        db_type = self.lhs.output_field.cast_db_type(connection)
+        return f"{lhs} = ANY(%s::{db_type}[])", [*lhs_params, self.rhs]
@@ -1,7 +1,12 @@
+import base64
+import binascii
+import json
 import typing
 
 import rest_framework.pagination
 import rest_framework.response
+from rest_framework.exceptions import NotFound
+from rest_framework.settings import api_settings
 from rest_framework.utils.urls import replace_query_param
 
 if typing.TYPE_CHECKING:
@@ -9,7 +14,7 @@ if typing.TYPE_CHECKING:
     from rest_framework.request import Request
     from rest_framework.views import APIView
 
-from django.db.models import Model
+from django.db.models import Model, Q
 
 _MT = typing.TypeVar("_MT", bound=Model)
 
@@ -84,3 +89,110 @@ class NoCountLimitOffsetPagination(
 
     def get_count(self, queryset: "QuerySet | typing.Sequence") -> int:
         raise NotImplementedError("get_count() is not implemented on this paginator.")
+
+
+class KeysetCursorPagination(rest_framework.pagination.BasePagination, typing.Generic[_MT]):
+    """
+    Pagination over a descending (score, key) ordering, e.g. (search rank, public ID).
+
+    The cursor holds the score and key of the last object of the page, the next page is fetched
+    with `(score, key) < (last score, last key)`, so every page costs the same no matter how deep
+    it is, unlike OFFSET. The score can be an annotation, the key has to be unique.
+    Only forward pagination is supported, so there is no previous link.
+    """
+
+    score_field = "rank"
+    key_field = "public_id"
+    cursor_query_param = "cursor"
+    limit_query_param = "limit"
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 1000
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_limit(self, request: "Request") -> int:
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def decode_cursor(self, request: "Request") -> tuple[float, str] | None:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            score, key = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            return float(score), str(key)
+        except (TypeError, ValueError, binascii.Error) as exc:
+            raise NotFound(self.invalid_cursor_message) from exc
+
+    def encode_cursor(self, obj: _MT) -> str:
+        cursor = [getattr(obj, self.score_field), str(getattr(obj, self.key_field))]
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    def paginate_queryset(  # type: ignore[override]
+        self, queryset: "QuerySet[_MT]", request: "Request", view: "APIView | None" = None
+    ) -> list[_MT]:
+        self.request = request
+        self.limit = self.get_limit(request)
+
+        if (cursor := self.decode_cursor(request)) is not None:
+            score, key = cursor
+            queryset = queryset.filter(
+                Q(**{f"{self.score_field}__lt": score})
+                | Q(**{self.score_field: score, f"{self.key_field}__lt": key})
+            )
+        queryset = queryset.order_by(f"-{self.score_field}", f"-{self.key_field}")
+
+        # Fetch one more object to know whether there is a next page.
+        page = list(queryset[: self.limit + 1])
+        self.has_next = len(page) > self.limit
+        self.page = page[: self.limit]
+        return self.page
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data: list[_MT]) -> rest_framework.response.Response:
+        return rest_framework.response.Response(
+            {"next": self.get_next_link(), "previous": None, "results": data}
+        )
+
+    def get_paginated_response_schema(self, schema: dict[str, typing.Any]) -> dict[str, typing.Any]:
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {
+                    "type": "string",
+                    "nullable": True,
+                    "format": "uri",
+                    "example": "http://api.example.org/accounts/?{cursor_param}=cD00ODY%3D".format(
+                        cursor_param=self.cursor_query_param
+                    ),
+                },
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view: "APIView") -> list[dict[str, typing.Any]]:
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.limit_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
@@ -1,5 +1,6 @@
 from django import test
 from django.contrib.contenttypes import models as content_type_models
+from django.core.cache import cache
 from rest_framework import test as drf_test
 
 import nodes.models
@@ -13,6 +14,9 @@ class BaseSetupTestCase:
     fixtures = ["roles"]
 
     def setUp(self) -> None:
+        # Cached values like the space IDs of users must not leak from one test into the next.
+        cache.clear()
+
         self.owner_role = permissions_models.ObjectMembershipRole.objects.get(
             role=permissions_models.RoleOptions.OWNER
         )
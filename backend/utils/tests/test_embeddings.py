@@ -0,0 +1,46 @@
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from utils import embeddings
+
+
+class HashingEmbedderTestCase(SimpleTestCase):
+    def test_embed(self) -> None:
+        embedder = embeddings.HashingEmbedder(dimensions=64)
+        vectors = embedder.embed(["The dog barks", "the dog barks.", "Stock market prices", ""])
+
+        self.assertEqual(vectors.shape, (4, 64))
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(vectors[:3], axis=1), 1.0, rtol=1e-6)
+        # Empty texts don't have any features.
+        self.assertFalse(vectors[3].any())
+        # Case and punctuation don't matter, unrelated texts are less similar.
+        np.testing.assert_allclose(vectors[0], vectors[1])
+        self.assertGreater(
+            vectors[0] @ embedder.embed(["dogs barking"])[0], vectors[0] @ vectors[2]
+        )
+
+    def test_deterministic(self) -> None:
+        """Vectors don't depend on the process, unlike the built-in `hash`."""
+        embedder = embeddings.HashingEmbedder(dimensions=16)
+        self.assertListEqual(list(embedder.tokens("Dog")), ["<dog>", "#do", "dog", "og#"])
+        expected = np.zeros(16)
+        expected[[5, 9]] = 0.5
+        expected[[1, 6]] = -0.5
+        np.testing.assert_allclose(embedder.embed(["dog"])[0], expected, atol=1e-6)
+
+
+class GetEmbedderTestCase(SimpleTestCase):
+    def test_get_embedder(self) -> None:
+        embedder = embeddings.get_embedder()
+        self.assertIsInstance(embedder, embeddings.HashingEmbedder)
+        self.assertIs(embeddings.get_embedder(), embedder)
+
+        with override_settings(NODE_EMBEDDINGS_PROVIDER_OPTIONS={"dimensions": 32}):
+            self.assertEqual(embeddings.get_embedder().name, "hashing-32")
+
+        with override_settings(
+            NODE_EMBEDDINGS_PROVIDER="utils.embeddings.OpenAIEmbedder",
+            NODE_EMBEDDINGS_PROVIDER_OPTIONS={"model": "text-embedding-3-large", "dimensions": 256},
+        ):
+            self.assertEqual(embeddings.get_embedder().name, "openai-text-embedding-3-large-256")
@@ -0,0 +1,109 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from utils import tokens
+
+
+class TokensTestCase(SimpleTestCase):
+    def test_encoding_is_memoized(self) -> None:
+        self.assertIs(tokens.get_encoding("gpt-4"), tokens.get_encoding("gpt-4"))
+        with self.assertRaises(KeyError):
+            tokens.get_encoding("unknown-model")
+
+    def test_token_counts(self) -> None:
+        """Batched counts match the counts of the individual strings, None stays None."""
+        texts = ["Hello world", None, "", "A longer text with a few more tokens in it."]
+        self.assertListEqual(
+            tokens.token_counts(texts), [tokens.token_count(text) for text in texts]
+        )
+        self.assertListEqual(tokens.token_counts([None, "Hello world"]), [None, 2])
+        self.assertListEqual(tokens.token_counts([]), [])
+
+    def test_num_tokens_from_message_lists(self) -> None:
+        message_lists = [
+            [{"role": "system", "content": "You are helpful."}],
+            [],
+            [
+                {"role": "system", "content": "You are helpful."},
+                {"role": "user", "content": "Hello there", "name": "someone"},
+            ],
+        ]
+        self.assertListEqual(
+            tokens.num_tokens_from_message_lists(message_lists, "gpt-4"),
+            [tokens.num_tokens_from_messages(messages, "gpt-4") for messages in message_lists],
+        )
+        # Every message adds 3 tokens and every reply is primed with 3 tokens.
+        self.assertEqual(tokens.num_tokens_from_messages([], "gpt-4"), 3)
+
+    def test_unknown_model_uses_default_encoding(self) -> None:
+        with self.assertLogs("utils.tokens", level="WARNING"):
+            encoding = tokens.get_encoding_or_default("model-that-does-not-exist")
+        self.assertEqual(encoding.name, "cl100k_base")
+
+
+class TokenCountCacheTestCase(SimpleTestCase):
+    text = "A text that is long enough to be cached by the token count cache."
+
+    def setUp(self) -> None:
+        super().setUp()
+        tokens.cache.clear()
+        self.addCleanup(tokens.cache.clear)
+
+    def test_counts_are_cached(self) -> None:
+        count = tokens.token_count(self.text)
+        self.assertDictEqual(tokens.cache.stats, {"hits": 0, "shared_hits": 0, "misses": 1})
+
+        with mock.patch.object(
+            tokens.get_encoding("gpt-4"), "encode", side_effect=AssertionError
+        ) as encode:
+            self.assertEqual(tokens.token_count(self.text), count)
+            self.assertListEqual(tokens.token_counts([self.text, None]), [count, None])
+        encode.assert_not_called()
+        self.assertDictEqual(tokens.cache.stats, {"hits": 2, "shared_hits": 0, "misses": 1})
+
+        # The key includes the encoding.
+        tokens.token_count(self.text, "gpt-4o")
+        self.assertEqual(tokens.cache.stats["misses"], 2)
+
+    def test_short_texts_are_not_cached(self) -> None:
+        tokens.token_counts(["short", "short"])
+        self.assertDictEqual(tokens.cache.stats, {"hits": 0, "shared_hits": 0, "misses": 0})
+        self.assertEqual(len(tokens.cache.entries), 0)
+
+    @override_settings(TOKEN_COUNT_CACHE_SIZE=2)
+    def test_lru_eviction(self) -> None:
+        texts = [f"{self.text} {i}" for i in range(3)]
+        tokens.token_counts(texts[:2])
+        # Use the first text, so that the second one is the least recently used.
+        tokens.token_count(texts[0])
+        tokens.token_count(texts[2])
+
+        self.assertListEqual(
+            list(tokens.cache.entries),
+            [tokens.cache.key(tokens.get_encoding("gpt-4"), text) for text in [texts[0], texts[2]]],
+        )
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "tokens": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "tokens",
+            },
+        },
+        TOKEN_COUNT_CACHE_ALIAS="tokens",
+    )
+    def test_shared_cache(self) -> None:
+        """Counts are shared between processes through the configured cache."""
+        count = tokens.token_count(self.text)
+        key = tokens.cache.key(tokens.get_encoding("gpt-4"), self.text)
+        self.assertEqual(caches["tokens"].get(key), count)
+
+        # Another process only has the shared cache.
+        tokens.cache.entries.clear()
+        self.assertEqual(tokens.token_count(self.text), count)
+        self.assertDictEqual(tokens.cache.stats, {"hits": 0, "shared_hits": 1, "misses": 1})
+        self.assertIn(key, tokens.cache.entries)
+        caches["tokens"].clear()
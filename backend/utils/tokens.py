@@ -1,18 +1,155 @@
+import functools
+import hashlib
 import logging
+import threading
 import typing
+from collections import OrderedDict
 
 import tiktoken
+from django.conf import settings
+from django.core.cache import caches
 from openai.types.chat import ChatCompletionMessageParam
 
 logger = logging.getLogger(__name__)
 
+# The number of threads tiktoken uses to encode batches.
+BATCH_THREADS = 8
+
+
+class TokenCountCache:
+    """
+    Cache of token counts keyed by the encoding and a hash of the text.
+
+    Counts are kept in an in-process LRU cache of `TOKEN_COUNT_CACHE_SIZE` entries and, if
+    `TOKEN_COUNT_CACHE_ALIAS` is set, in that cache of `CACHES` (e.g. Redis) to share them between
+    processes. Texts shorter than `TOKEN_COUNT_CACHE_MIN_LENGTH` are cheaper to encode than to look
+    up and aren't cached.
+    """
+
+    def __init__(self) -> None:
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.lock = threading.Lock()
+        # Counters to see how much tokenization the cache saves, see `stats`.
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(encoding: tiktoken.Encoding, text: str) -> str:
+        digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        return f"tokens:{encoding.name}:{digest}"
+
+    @staticmethod
+    def shared_cache() -> typing.Any:
+        alias = settings.TOKEN_COUNT_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def get_many(self, keys: typing.Collection[str]) -> dict[str, int]:
+        """Return the cached counts of the given keys, missing keys are left out."""
+        found: dict[str, int] = {}
+        with self.lock:
+            for key in keys:
+                if (count := self.entries.get(key)) is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = count
+            self.hits += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and (shared_cache := self.shared_cache()) is not None:
+            shared = shared_cache.get_many(missing)
+            self.shared_hits += len(shared)
+            self.store(shared)
+            found.update(shared)
+
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, counts: dict[str, int]) -> None:
+        self.store(counts)
+        if counts and (shared_cache := self.shared_cache()) is not None:
+            shared_cache.set_many(counts, timeout=settings.TOKEN_COUNT_CACHE_TIMEOUT)
+
+    def store(self, counts: dict[str, int]) -> None:
+        """Store the counts in the in-process cache only."""
+        with self.lock:
+            self.entries.update(counts)
+            for key in counts:
+                self.entries.move_to_end(key)
+            while len(self.entries) > settings.TOKEN_COUNT_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """The number of counts found in-process, in the shared cache and not found at all."""
+        return {"hits": self.hits, "shared_hits": self.shared_hits, "misses": self.misses}
+
+
+cache = TokenCountCache()
+
+
+@functools.cache
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Return the encoding of a model, memoized per process.
+    Looking up the encoding by model name is relatively slow and happens for every string counted.
+    Raises KeyError if the model is unknown.
+    """
+    return tiktoken.encoding_for_model(model)
+
+
+@functools.cache
+def get_encoding_or_default(model: str) -> tiktoken.Encoding:
+    """Return the encoding of a model, or cl100k_base if the model is unknown."""
+    try:
+        return get_encoding(model)
+    except KeyError:
+        # This is different from the original code, which uses the o200k_base encoding, but for us,
+        # cl100k_base is still the default.
+        logger.warning(f"Model {model} not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_with_encoding(encoding: tiktoken.Encoding, texts: typing.Sequence[str]) -> list[int]:
+    """
+    Count the number of tokens of the texts with the given encoding. Cached counts are reused,
+    the remaining texts are encoded in one batch.
+    """
+    keys = {
+        text: cache.key(encoding, text)
+        for text in texts
+        if len(text) >= settings.TOKEN_COUNT_CACHE_MIN_LENGTH
+    }
+    cached = cache.get_many(list(keys.values())) if keys else {}
+    counts = {text: cached[key] for text, key in keys.items() if key in cached}
+
+    missing = list(dict.fromkeys(text for text in texts if text not in counts))
+    if len(missing) == 1:
+        # Not worth the thread pool of `encode_batch`.
+        counts[missing[0]] = len(encoding.encode(missing[0]))
+    elif missing:
+        encoded = encoding.encode_batch(missing, num_threads=BATCH_THREADS)
+        counts.update(zip(missing, map(len, encoded), strict=True))
+    cache.set_many({keys[text]: counts[text] for text in missing if text in keys})
+
+    return [counts[text] for text in texts]
+
 
 def token_count(text: str | None, model: str = "gpt-4") -> int | None:
     """Count the number of tokens in a string."""
-    if text is None:
-        return None
-    enc = tiktoken.encoding_for_model(model)
-    return len(enc.encode(text))
+    return token_counts([text], model)[0]
+
+
+def token_counts(texts: typing.Sequence[str | None], model: str = "gpt-4") -> list[int | None]:
+    """Count the number of tokens of multiple strings at once, None stays None."""
+    counts = iter(
+        count_with_encoding(get_encoding(model), [text for text in texts if text is not None])
+    )
+    return [None if text is None else next(counts) for text in texts]
 
 
 # Copied from the OpenAI cookbook at:
@@ -22,13 +159,18 @@ def num_tokens_from_messages(
     messages: typing.Iterable[ChatCompletionMessageParam], model: str = "gpt-3.5-turbo-0613"
 ) -> int:
     """Return the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        # This is different from the original code, which uses the o200k_base encoding, but for us,
-        # cl100k_base is still the default.
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+    return num_tokens_from_message_lists([messages], model)[0]
+
+
+def num_tokens_from_message_lists(
+    message_lists: typing.Iterable[typing.Iterable[ChatCompletionMessageParam]],
+    model: str = "gpt-3.5-turbo-0613",
+) -> list[int]:
+    """
+    Return the number of tokens used by each of the lists of messages.
+    All message values are encoded in one batch.
+    """
+    encoding = get_encoding_or_default(model)
 
     if model == "gpt-3.5-turbo-0301":
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
@@ -37,12 +179,24 @@ def num_tokens_from_messages(
         tokens_per_message = 3
         tokens_per_name = 1
 
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(str(value)))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-    return num_tokens
+    values: list[str] = []
+    list_lengths: list[int] = []
+    num_tokens_per_list: list[int] = []
+    for messages in message_lists:
+        num_tokens = 0
+        list_start = len(values)
+        for message in messages:
+            num_tokens += tokens_per_message
+            for key, value in message.items():
+                values.append(str(value))
+                if key == "name":
+                    num_tokens += tokens_per_name
+        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        num_tokens_per_list.append(num_tokens)
+        list_lengths.append(len(values) - list_start)
+
+    counts = iter(count_with_encoding(encoding, values))
+    return [
+        num_tokens + sum(next(counts) for _ in range(list_length))
+        for num_tokens, list_length in zip(num_tokens_per_list, list_lengths, strict=True)
+    ]
@@ -1,3 +1,4 @@
+import re
 import typing
 
 from rest_framework import mixins, viewsets
@@ -5,6 +6,8 @@ from rest_framework import mixins, viewsets
 if typing.TYPE_CHECKING:
     from django.db import models
 
+BYTE_RANGE_RE = re.compile(r"bytes=(?P<first>\d*)-(?P<last>\d*)", re.IGNORECASE)
+
 T_co = typing.TypeVar("T_co", bound="models.Model", covariant=True)
 
 
@@ -27,3 +30,26 @@ class BaseNoCreateDeleteModelViewSet(
 class BaseReadOnlyModelViewSet(viewsets.ReadOnlyModelViewSet[T_co], typing.Generic[T_co]):
     lookup_field = "public_id"
     lookup_url_kwarg = "public_id"
+
+
+def parse_byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parse an HTTP Range header for a resource of the given size.
+    Return the (start, stop) of the requested bytes (stop exclusive), or None if the range is not
+    satisfiable. Raise ValueError if the header is malformed or requests multiple ranges, in which
+    case the header should be ignored and the whole resource returned.
+    """
+    match = BYTE_RANGE_RE.fullmatch(header.strip())
+    if match is None:
+        raise ValueError(f"Unsupported range: {header}")
+    first, last = match["first"], match["last"]
+    if not first:
+        # Suffix range, e.g. "bytes=-500" for the last 500 bytes.
+        suffix = int(last)
+        return (max(size - suffix, 0), size) if suffix and size else None
+    start = int(first)
+    if last and int(last) < start:
+        raise ValueError(f"Invalid range: {header}")
+    if start >= size:
+        return None
+    return start, min(int(last) + 1, size) if last else size